@@ -87,14 +87,14 @@ class RSAobj(pubkey.pubkey):
     def _encrypt(self, plaintext, K=''):
         if self.n<=plaintext:
             raise error, 'Plaintext too large'
-        return (pow(plaintext, self.e, self.n),)
+        return (number.powmod(plaintext, self.e, self.n),)
 
     def _decrypt(self, ciphertext):
         if (not hasattr(self, 'd')):
             raise error, 'Private key not available in this object'
         if self.n<=ciphertext[0]:
             raise error, 'Ciphertext too large'
-        return pow(ciphertext[0], self.d, self.n)
+        return number.powmod(ciphertext[0], self.d, self.n)
 
     def _sign(self, M, K=''):
         return (self._decrypt((M,)),)
@@ -106,7 +106,7 @@ class RSAobj(pubkey.pubkey):
         else: return 0
 
     def _blind(self, M, B):
-        tmp = pow(B, self.e, self.n)
+        tmp = number.powmod(B, self.e, self.n)
         return (M * tmp) % self.n
 
     def _unblind(self, M, B):
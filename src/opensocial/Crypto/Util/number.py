@@ -18,6 +18,24 @@ try:
 except ImportError:
     _fastmath = None
 
+# Modular exponentiation for the public and private key operations: GMP
+# through gmpy2 or gmpy when one is installed, otherwise the builtin pow.
+# Both take and return Python longs.
+try:
+    import gmpy2
+    def powmod(base, exponent, modulus):
+        return long(gmpy2.powmod(base, exponent, modulus))
+    POWMOD_BACKEND = 'gmpy2'
+except ImportError:
+    try:
+        import gmpy
+        def powmod(base, exponent, modulus):
+            return long(pow(gmpy.mpz(base), exponent, modulus))
+        POWMOD_BACKEND = 'gmpy'
+    except ImportError:
+        powmod = pow
+        POWMOD_BACKEND = 'builtin'
+
 # Commented out and replaced with faster versions below
 ## def long2str(n):
 ##     s=''
@@ -140,9 +158,10 @@ sieve=[2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59,
        197, 199, 211, 223, 227, 229, 233, 239, 241, 251]
 
 # Improved conversion functions contributed by Barry Warsaw, after
-# careful benchmarking
+# careful benchmarking; since replaced by hex conversions, which do the work
+# in C and are an order of magnitude faster for 1024 and 2048 bit numbers
 
-import struct
+from binascii import hexlify, unhexlify
 
 def long_to_bytes(n, blocksize=0):
     """long_to_bytes(n:long, blocksize:int) : string
@@ -152,24 +171,14 @@ def long_to_bytes(n, blocksize=0):
     byte string with binary zeros so that the length is a multiple of
     blocksize.
     """
-    # after much testing, this algorithm was deemed to be the fastest
-    s = ''
-    n = long(n)
-    pack = struct.pack
-    while n > 0:
-        s = pack('>I', n & 0xffffffffL) + s
-        n = n >> 32
-    # strip off leading zeros
-    for i in range(len(s)):
-        if s[i] != '\000':
-            break
+    if n > 0:
+        s = '%x' % n
+        if len(s) % 2:
+            s = '0' + s
+        s = unhexlify(s)
     else:
-        # only happens when n == 0
+        # only happens when n <= 0
         s = '\000'
-        i = 0
-    s = s[i:]
-    # add back some pad bytes.  this could be done more efficiently w.r.t. the
-    # de-padding being done above, but sigh...
     if blocksize > 0 and len(s) % blocksize:
         s = (blocksize - len(s) % blocksize) * '\000' + s
     return s
@@ -180,16 +189,9 @@ def bytes_to_long(s):
 
     This is (essentially) the inverse of long_to_bytes().
     """
-    acc = 0L
-    unpack = struct.unpack
-    length = len(s)
-    if length % 4:
-        extra = (4 - length % 4)
-        s = '\000' * extra + s
-        length = length + extra
-    for i in range(0, length, 4):
-        acc = (acc << 32) + unpack('>I', s[i:i+4])[0]
-    return acc
+    if not s:
+        return 0L
+    return long(hexlify(s), 16)
 
 # For backwards compatibility...
 import warnings
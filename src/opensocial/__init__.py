@@ -18,17 +18,24 @@
 __author__ = 'davidbyttow@google.com (David Byttow)'
 
 
+import hashlib
 import httplib
+import threading
 import urllib
 import urlparse
 
+import cache
+import codec
 import http
+import jsonstream
+import nonce
 import oauth
-import simplejson
+import workers
 
 from data import *
 from errors import *
 from request import *
+from table import *
 from validator import *
 
 class ContainerConfig(object):
@@ -38,7 +45,11 @@ class ContainerConfig(object):
                server_rpc_base=None, server_rest_base=None, 
                security_token=None,
                security_token_param=None,
-               sign_with_body=False):
+               sign_with_body=False,
+               max_concurrent_requests=1,
+               max_rpc_batch_size=None,
+               max_rpc_body_bytes=None,
+               stream_request_bodies=False):
     """Constructor for ContainerConfig.
     
     If no oauth parameters are present, then oauth will not be used to sign
@@ -48,6 +59,17 @@ class ContainerConfig(object):
     otherwise, all requests will fail. If both are supplied, the container
     will attempt to default to rpc and fall back on REST.
 
+    If max_concurrent_requests is greater than one, batches sent over the REST
+    protocol will have up to that many requests in flight at once.
+
+    RPC batches with more than max_rpc_batch_size requests, or whose JSON body
+    would be larger than max_rpc_body_bytes, are split into several POSTs,
+    which are also sent up to max_concurrent_requests at a time.
+
+    If stream_request_bodies is True, POST bodies are encoded and hashed
+    piece by piece, and sent that way by a PooledUrlFetch, rather than built
+    as one string (see http.Request.set_stream_body).
+
     """
     self.oauth_consumer_key = oauth_consumer_key 
     self.oauth_consumer_secret = oauth_consumer_secret
@@ -56,6 +78,10 @@ class ContainerConfig(object):
     self.security_token = security_token
     self.security_token_param = security_token_param
     self.sign_with_body = sign_with_body
+    self.max_concurrent_requests = max_concurrent_requests
+    self.max_rpc_batch_size = max_rpc_batch_size
+    self.max_rpc_body_bytes = max_rpc_body_bytes
+    self.stream_request_bodies = stream_request_bodies
     if not server_rpc_base and not server_rest_base:
       raise ConfigError("Neither 'server_rpc_base' nor 'server_rest_base' set")
 
@@ -69,7 +95,7 @@ class ContainerContext(object):
 
   """
   
-  def __init__(self, config, url_fetch=None):
+  def __init__(self, config, url_fetch=None, cache=None):
     """Constructor for ContainerContext.
     
     If a UrlFetch implementation is not given, will attempt to construct
@@ -78,15 +104,23 @@ class ContainerContext(object):
     Args:
       config: The ContainerConfig to use for this connection.
       url_fetch: (optional) An implementation of the UrlFetch interface.
+      cache: (optional) A cache.ResponseCache used to answer repeated read
+          requests without contacting the container.
 
     """
     self.config = config
     if not self.config:
       raise ConfigError('Invalid ContainerConfig.')
     self.url_fetch = url_fetch or http.get_default_urlfetch()
+    self.cache = cache
     self.oauth_signature_method = oauth.OAuthSignatureMethod_HMAC_SHA1() 
     self.oauth_consumer = None
     self.allow_rpc = True
+    self.single_flight = None
+    self.auto_batcher = None
+    self.object_types = None
+    self._worker_pool = None
+    self._worker_pool_lock = threading.Lock()
     if self.config.oauth_consumer_key and self.config.oauth_consumer_secret:
       self.oauth_consumer = oauth.OAuthConsumer(
           self.config.oauth_consumer_key,
@@ -95,6 +129,53 @@ class ContainerContext(object):
   def set_allow_rpc(self, allowed):
     """Sets if RPC requests are allowed if they are supported."""
     self.allow_rpc = allowed
+
+  def set_object_types(self, object_types):
+    """Sets the classes used to build the objects returned by the container.
+    
+    For example, set_object_types(COMPACT_TYPES) returns CompactPerson
+    objects wherever Person objects would be returned. Requests which have
+    their own object types set keep them.
+
+    Args:
+      object_types: dict Maps data classes, e.g. Person, to the classes to
+          use in their place. None restores the defaults.
+
+    """
+    self.object_types = object_types
+
+  def set_coalesce_requests(self, coalesce):
+    """Sets if concurrent identical read requests share one container call.
+    
+    When enabled, a send_request for a read request which is identical, in
+    method, params and requestor, to one already in flight on another thread
+    waits for that call and returns the same OpenSocial object. The number of
+    calls saved this way is counted in single_flight.coalesced.
+
+    """
+    if coalesce:
+      self.single_flight = self.single_flight or workers.SingleFlight()
+    else:
+      self.single_flight = None
+
+  def set_auto_batching(self, enabled, window=0.002, max_requests=50):
+    """Sets if requests sent separately are combined into RPC batches.
+    
+    When enabled and RPC is supported, send_request, and so every fetch_*
+    method, waits up to window seconds for requests sent from other threads
+    and sends them all in one RPC batch. See request.AutoBatcher.
+
+    Args:
+      enabled: bool Whether to combine requests.
+      window: float (optional) Seconds to wait for more requests.
+      max_requests: int (optional) Number of pending requests which causes
+          the batch to be sent before the window has passed.
+
+    """
+    if enabled:
+      self.auto_batcher = AutoBatcher(self, window, max_requests)
+    else:
+      self.auto_batcher = None
     
   def supports_rpc(self):
     """Tells whether or not the container was setup for RPC protocol.
@@ -146,6 +227,42 @@ class ContainerContext(object):
     request = FetchPeopleRequest(user_id, '@friends', fields=fields)
     return self.send_request(request)
 
+  def stream_friends(self, user_id='@me', fields=None):
+    """Streams the friends of a given user by id.
+    
+    Args:
+      user_id: str The person's container-specific id for which to retrieve
+      friends.
+      fields: list (optional) List of fields to retrieve.
+      
+    Returns: A CollectionStream of Person objects.
+
+    """
+    request = FetchPeopleRequest(user_id, '@friends', fields=fields)
+    return self.stream_request(request)
+
+  def iter_friends(self, user_id='@me', fields=None, page_size=100,
+                   pages_per_batch=1):
+    """Iterates over the friends of a given user, a page at a time.
+    
+    Args:
+      user_id: str The person's container-specific id for which to retrieve
+      friends.
+      fields: list (optional) List of fields to retrieve.
+      page_size: int (optional) Number of friends requested per page.
+      pages_per_batch: int (optional) Number of pages requested in one batch
+          once the number of friends is known.
+      
+    Returns: A PageIterator over Person objects.
+
+    """
+    def make_request(start_index, count):
+      params = {'startIndex': start_index, 'count': count}
+      return FetchPeopleRequest(user_id, '@friends', fields=fields,
+                                params=params)
+    return PageIterator(self, make_request, page_size,
+                        pages_per_batch=pages_per_batch)
+
   def fetch_groups(self, user_id='@me', params=None):
     """Fetches catagories created by user id.
     
@@ -206,6 +323,29 @@ class ContainerContext(object):
     request = FetchActivityRequest(user_id, group, app, params)
     return self.send_request(request)
 
+  def iter_activities(self, user_id='@me', group='@self', app=None,
+                      params=None, page_size=100, pages_per_batch=1):
+    """Iterates over the activities created by user id, a page at a time.
+
+    Args:
+      user_id: str The person's container-specific id.
+      group: str user specified selector.
+      app: str (optional) The id of the application.
+      params: dict (optional) Additional fields to that need to be passed
+      page_size: int (optional) Number of activities requested per page.
+      pages_per_batch: int (optional) Number of pages requested in one batch
+          once the number of activities is known.
+      
+    Returns: A PageIterator over Activity objects.
+
+    """
+    def make_request(start_index, count):
+      page_params = dict(params or {})
+      page_params.update({'startIndex': start_index, 'count': count})
+      return FetchActivityRequest(user_id, group, app, page_params)
+    return PageIterator(self, make_request, page_size,
+                        pages_per_batch=pages_per_batch)
+
   def create_notification(self, user_id, recipients, mediaitems = None, templateParameters = None, 
                           params=None):
         """Creates app notification.
@@ -294,7 +434,18 @@ class ContainerContext(object):
     Returns: The OpenSocial object returned from the container.
 
     """
+    single_flight = self.single_flight
+    if single_flight:
+      key = request.get_cache_key(use_rest or not self.supports_rpc())
+      if key:
+        return single_flight.call(key, self._send_request, request, use_rest)
+    return self._send_request(request, use_rest)
+
+  def _send_request(self, request, use_rest):
     if not use_rest and self.supports_rpc():
+      auto_batcher = self.auto_batcher
+      if auto_batcher and getattr(request, 'rpc_request', None):
+        return auto_batcher.send(request)
       batch = RequestBatch()
       batch.add_request(0, request)
       batch.send(self)
@@ -305,11 +456,48 @@ class ContainerContext(object):
     else:
       return self._send_rest_request(request)
   
+  def stream_request(self, request, cls=Person, use_rest=False):
+    """Sends a request for a collection and streams the entries back.
+    
+    The response is decoded incrementally as the returned CollectionStream
+    is iterated, rather than all at once, which keeps memory flat for very
+    large collections. Streamed responses bypass the response cache.
+
+    Args:
+      request: A Request object for a collection, e.g. FetchPeopleRequest.
+      cls: (optional) The OpenSocial data type of the entries.
+      use_rest: bool (optional) If True, will just use the REST protocol.
+    
+    Returns: A CollectionStream, which should be iterated or closed.
+
+    """
+    if not use_rest and self.supports_rpc():
+      http_request, id_to_key_map = self._make_rpc_http_request(
+          [(0, request)])
+    else:
+      http_request = request.make_rest_request(self.config.server_rest_base)
+    if self.object_types:
+      cls = self.object_types.get(cls, cls)
+    self._prepare_http_request(http_request)
+    http_response = self.url_fetch.fetch_stream(http_request)
+    if http_response.status != httplib.OK:
+      # Reads the rest of the body, for the error, and closes the response.
+      http_response.content
+      raise BadRequestError(http_response)
+
+    def error_handler(error):
+      code = error.get('code')
+      if code == httplib.UNAUTHORIZED:
+        raise UnauthorizedRequestError(http_response)
+      raise BadResponseError(code, error.get('message'))
+    return CollectionStream(http_response, cls, error_handler)
+
   def send_request_batch(self, batch, use_rest=False):
     """Send a batch of requests.
     
-    Batches are only useful when RPC is supported. Otherwise, all requests
-    are sent synchronously. May throw a BadRequest, BadResponse or
+    Batches are only useful when RPC is supported. Otherwise, each request is
+    sent individually, with up to config.max_concurrent_requests of them in
+    flight at once. May throw a BadRequest, BadResponse or
     UnauthorizedRequest exceptions.
 
     Args:
@@ -323,27 +511,170 @@ class ContainerContext(object):
       """REST protocol does not support batching, so just process each
       request individually.
       """
-      for key, request in batch.requests.iteritems():
-        try:
-          result = self._send_rest_request(request)
-        except Error, e:
-          result = e
-        batch._set_data(key, result)
+      requests = batch.requests.items()
+      if self.config.max_concurrent_requests > 1 and len(requests) > 1:
+        pool = self._get_worker_pool()
+        workers.wait_all([
+            pool.submit(self._send_rest_batch_request, batch, key, request)
+            for key, request in requests])
+      else:
+        for key, request in requests:
+          self._send_rest_batch_request(batch, key, request)
+
+  def _get_worker_pool(self):
+    """Returns the pool used to send this container's requests concurrently."""
+    self._worker_pool_lock.acquire()
+    try:
+      if not self._worker_pool:
+        self._worker_pool = workers.WorkerPool(
+            self.config.max_concurrent_requests)
+      return self._worker_pool
+    finally:
+      self._worker_pool_lock.release()
+
+  def _send_rest_batch_request(self, batch, key, request):
+    try:
+      result = self._send_rest_request(request)
+    except Error, e:
+      result = e
+    batch._set_data(key, result)
   
   def _send_rest_request(self, request):
+    cache_key = self._get_cache_key(request, True)
+    if cache_key:
+      json = self.cache.get(cache_key)
+      if json is not None:
+        return self._process_json(request, json)
     http_request = request.make_rest_request(self.config.server_rest_base)
     http_response = self._send_http_request(http_request)
+    return self._process_rest_response(request, http_response, cache_key)
+
+  def _process_rest_response(self, request, http_response, cache_key=None):
     json = self._handle_response(http_response)
+    if cache_key:
+      self.cache.set(cache_key, json)
+    return self._process_json(request, json)
+
+  def _process_json(self, request, json):
+    """Builds the OpenSocial object for a request from the returned JSON."""
+    if self.object_types and request.object_types is None:
+      request.set_object_types(self.object_types)
     return request.process_json(json)
 
+  def _get_cache_key(self, request, use_rest):
+    """Returns the cache key for a request, or None if it is not cached.
+    
+    The key of the request is prefixed with a namespace for this context, so
+    that contexts for different containers, consumers or viewers can share a
+    ResponseCache without seeing each other's responses.
+
+    """
+    if self.cache:
+      cache_key = request.get_cache_key(use_rest)
+      if cache_key:
+        service, key = cache_key
+        return service, '%s %s' % (self._get_cache_namespace(use_rest), key)
+    return None
+
+  def _get_cache_namespace(self, use_rest):
+    """Identifies the container and credentials requests are sent with.
+    
+    Returns: str The base URL of the container followed by a hash of the
+        consumer key and security token.
+
+    """
+    if use_rest:
+      base = self.config.server_rest_base
+    else:
+      base = self.config.server_rpc_base
+    credentials = repr((self.config.oauth_consumer_key,
+                        self.config.security_token))
+    return '%s %s' % (base, hashlib.sha1(credentials).hexdigest())
+
   def _send_rpc_requests(self, batch):
+    requests = []
+    for key, request in batch.requests.iteritems():
+      cache_key = self._get_cache_key(request, False)
+      json = cache_key and self.cache.get(cache_key)
+      if json is not None:
+        batch._set_data(key, self._process_json(request, json))
+      else:
+        requests.append((key, request))
+    if not requests:
+      return
+
+    # The POSTs for all of the chunks are signed together.
+    chunks = [self._make_rpc_http_request(chunk)
+              for chunk in self._split_rpc_requests(requests)]
+    self._prepare_http_requests([http_request
+                                 for http_request, id_to_key_map in chunks])
+    if self.config.max_concurrent_requests > 1 and len(chunks) > 1:
+      pool = self._get_worker_pool()
+      workers.wait_all([pool.submit(self._send_rpc_chunk, batch,
+                                    http_request, id_to_key_map)
+                        for http_request, id_to_key_map in chunks])
+    else:
+      for http_request, id_to_key_map in chunks:
+        self._send_rpc_chunk(batch, http_request, id_to_key_map)
+
+  def _send_rpc_chunk(self, batch, http_request, id_to_key_map):
+    http_response = self.url_fetch.fetch(http_request)
+    self._process_rpc_response(batch, id_to_key_map, http_response)
+
+  def _split_rpc_requests(self, requests):
+    """Splits batched requests into chunks which are sent as one POST.
+    
+    Chunks hold at most config.max_rpc_batch_size requests and, as far as
+    possible, config.max_rpc_body_bytes of JSON. A single request which is
+    larger than max_rpc_body_bytes is sent in a chunk of its own.
+
+    Args:
+      requests: list The (key, request) tuples to send.
+
+    Returns: A list of lists of (key, request) tuples.
+
+    """
+    max_size = self.config.max_rpc_batch_size
+    max_bytes = self.config.max_rpc_body_bytes
+    if not max_size and not max_bytes:
+      return [requests]
+
+    chunks = []
+    chunk = []
+    # The encoded body is a JSON list: '[' + ', '.join(rpcs) + ']'.
+    chunk_bytes = 2
+    for key, request in requests:
+      rpc_bytes = 0
+      if max_bytes:
+        rpc_bytes = len(codec.encode_body(request.get_rpc_body())) + 2
+      if chunk and ((max_size and len(chunk) >= max_size) or
+                    (max_bytes and chunk_bytes + rpc_bytes > max_bytes)):
+        chunks.append(chunk)
+        chunk = []
+        chunk_bytes = 2
+      chunk.append((key, request))
+      chunk_bytes += rpc_bytes
+    if chunk:
+      chunks.append(chunk)
+    return chunks
+
+  def _make_rpc_http_request(self, requests):
+    """Creates the JSON-RPC http.Request for a list of batched requests.
+    
+    Args:
+      requests: list The (key, request) tuples to send.
+
+    Returns: A tuple of the http.Request and a dict which maps the RPC id of
+        each request to its batch key.
+
+    """
     rpcs = []
     id_to_key_map = {}
     query_params = {}
     """Build up a list of RPC calls. Also, create a mapping of RPC request id's
     to batch keys in order to populate the batch object with the responses.
     """
-    for key, request in batch.requests.iteritems():
+    for key, request in requests:
       query_params.update(request.get_query_params())
       rpc_body = request.get_rpc_body()
       rpc_id = rpc_body.get('id')
@@ -354,8 +685,9 @@ class ContainerContext(object):
                                 method='POST',
                                 signed_params=query_params,
                                 post_body=rpcs)
-    
-    http_response = self._send_http_request(http_request)
+    return http_request, id_to_key_map
+
+  def _process_rpc_response(self, batch, id_to_key_map, http_response):
     json = self._handle_response(http_response)
     
     """Pull out all of the results and insert them into the batch object."""
@@ -370,20 +702,38 @@ class ContainerContext(object):
       else:
         json = response.get('data')
         request = batch.requests[key]
-        batch._set_data(key, request.process_json(json))
+        cache_key = self._get_cache_key(request, False)
+        if cache_key:
+          self.cache.set(cache_key, json)
+        batch._set_data(key, self._process_json(request, json))
       
   def _send_http_request(self, http_request):
-    if self.config.security_token:
-      http_request.add_security_token(self.config.security_token,
-                                      self.config.security_token_param)
-
-    if self.oauth_consumer and self.oauth_signature_method:
-      http_request.set_body_as_signing_parameter(self.config.sign_with_body)
-      http_request.sign_request(self.oauth_consumer,
-                                self.oauth_signature_method)
-      
+    self._prepare_http_request(http_request)
     http_response = self.url_fetch.fetch(http_request)
     return http_response
+
+  def _prepare_http_request(self, http_request):
+    """Adds the security token and OAuth signature to an http.Request."""
+    self._prepare_http_requests([http_request])
+
+  def _prepare_http_requests(self, http_requests):
+    """Adds the security token and OAuth signature to several http.Requests.
+
+    The requests are signed together by an http.BulkSigner.
+
+    """
+    for http_request in http_requests:
+      if self.config.stream_request_bodies:
+        http_request.set_stream_body(True)
+      if self.config.security_token:
+        http_request.add_security_token(self.config.security_token,
+                                        self.config.security_token_param)
+      if self.oauth_consumer and self.oauth_signature_method:
+        http_request.set_body_as_signing_parameter(self.config.sign_with_body)
+
+    if self.oauth_consumer and self.oauth_signature_method:
+      http.BulkSigner(self.oauth_consumer,
+                      self.oauth_signature_method).sign(http_requests)
       
   def _handle_response(self, http_response):
     """ If status code "OK", then we can safely inspect the returned JSON."""
@@ -391,7 +741,7 @@ class ContainerContext(object):
       if http.VERBOSE > 0:
         logging.info("http_response.content => %s" % http_response.content)
         
-      json = simplejson.loads(http_response.content)
+      json = codec.loads(http_response.content)
       # Check for any JSON-RPC 2.0 errors.
       if 'error' in json:
         code = json.get('error').get('code')
@@ -404,6 +754,141 @@ class ContainerContext(object):
     else:
       raise BadRequestError(http_response)
 
+class AsyncContainerContext(ContainerContext):
+  """A container context which does not block while requests are in flight.
+  
+  send_request, send_request_batch and all of the fetch_* and create_*
+  methods return immediately with a pending result instead of the
+  OpenSocial object. Calling get_result() on the pending result waits for
+  the container's response and returns the object, or raises the same
+  errors ContainerContext would have, which lets a single thread have many
+  container calls outstanding at once:
+
+    me = context.fetch_person('@me')
+    friends = context.fetch_friends('@me')
+    print me.get_result().get_display_name(), len(friends.get_result())
+
+  """
+
+  def __init__(self, config, url_fetch=None, cache=None):
+    """Constructor for AsyncContainerContext.
+    
+    Args:
+      config: The ContainerConfig to use for this connection.
+      url_fetch: (optional) An implementation of the UrlFetch interface. If
+          it does not provide fetch_async, it is wrapped in an
+          http.AsyncUrlFetch.
+      cache: (optional) A cache.ResponseCache used to answer repeated read
+          requests without contacting the container.
+
+    """
+    url_fetch = url_fetch or http.get_default_async_urlfetch()
+    if not hasattr(url_fetch, 'fetch_async'):
+      url_fetch = http.AsyncUrlFetch(url_fetch)
+    super(AsyncContainerContext, self).__init__(config, url_fetch, cache)
+
+  def send_request(self, request, use_rest=False):
+    """Starts sending the request.
+    
+    Args:
+      request: A Request object.
+      use_rest: bool (optional) If True, will just use the REST protocol.
+      
+    Returns: A pending result whose get_result() returns the OpenSocial object
+        returned from the container.
+
+    """
+    if not use_rest and self.supports_rpc():
+      batch = RequestBatch()
+      batch.add_request(0, request)
+      pending = self.send_request_batch(batch)
+      def get_result():
+        pending.get_result()
+        response = batch.get(0)
+        if isinstance(response, Error):
+          raise response
+        return response
+      return workers.DeferredResult(get_result)
+    else:
+      cache_key = self._get_cache_key(request, True)
+      json = cache_key and self.cache.get(cache_key)
+      if json is not None:
+        return workers.DeferredResult(
+            lambda: self._process_json(request, json))
+      pending = self._send_http_request_async(
+          request.make_rest_request(self.config.server_rest_base))
+      return workers.DeferredResult(
+          lambda: self._process_rest_response(request, pending.get_result(),
+                                              cache_key))
+
+  def send_request_batch(self, batch, use_rest=False):
+    """Starts sending a batch of requests.
+    
+    All of the requests in the batch are sent at once, i.e. every REST
+    request or every chunk of an RPC batch which is split according to
+    config.max_rpc_batch_size and config.max_rpc_body_bytes.
+
+    Args:
+      batch: The RequestBatch object.
+      use_rest: bool (optional) If True, will just use the REST protocol.
+
+    Returns: A pending result whose get_result() fills in and returns the
+        batch.
+
+    """
+    use_rpc = not use_rest and self.supports_rpc()
+    cached = []
+    requests = []
+    for key, request in batch.requests.iteritems():
+      cache_key = self._get_cache_key(request, not use_rpc)
+      json = cache_key and self.cache.get(cache_key)
+      if json is not None:
+        cached.append((key, request, json))
+      else:
+        requests.append((key, request, cache_key))
+
+    if use_rpc:
+      fetches = []
+      if requests:
+        chunks = self._split_rpc_requests([(key, request)
+                                           for key, request, cache_key
+                                           in requests])
+        for chunk in chunks:
+          http_request, id_to_key_map = self._make_rpc_http_request(chunk)
+          fetches.append((id_to_key_map,
+                          self._send_http_request_async(http_request)))
+      def get_result():
+        for key, request, json in cached:
+          batch._set_data(key, self._process_json(request, json))
+        for id_to_key_map, pending in fetches:
+          self._process_rpc_response(batch, id_to_key_map,
+                                     pending.get_result())
+        return batch
+    else:
+      fetches = []
+      for key, request, cache_key in requests:
+        http_request = request.make_rest_request(self.config.server_rest_base)
+        fetches.append((key, request, cache_key,
+                        self._send_http_request_async(http_request)))
+      def get_result():
+        for key, request, json in cached:
+          batch._set_data(key, self._process_json(request, json))
+        for key, request, cache_key, pending in fetches:
+          try:
+            result = self._process_rest_response(request,
+                                                 pending.get_result(),
+                                                 cache_key)
+          except Error, e:
+            result = e
+          batch._set_data(key, result)
+        return batch
+    return workers.DeferredResult(get_result)
+
+  def _send_http_request_async(self, http_request):
+    self._prepare_http_request(http_request)
+    return self.url_fetch.fetch_async(http_request)
+
+
 class OrkutSandboxContext(ContainerContext):
   """The context for accessing orkut's sandbox."""
   def __init__(self, config, url_fetch=None):
@@ -0,0 +1,361 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Caching of container responses for read requests."""
+
+
+import errno
+import hashlib
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+import codec
+
+
+class LruCache(object):
+  """A bounded, thread-safe mapping whose entries expire.
+
+  Once max_entries entries are stored, setting a new key evicts the least
+  recently used entry.
+
+  """
+
+  def __init__(self, max_entries=1000):
+    self.max_entries = max_entries
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    """Returns the value stored for key, or None if missing or expired."""
+    self._lock.acquire()
+    try:
+      entry = self._entries.pop(key, None)
+      if entry is None:
+        return None
+      value, expires = entry
+      if expires < time.time():
+        return None
+      self._entries[key] = entry
+      return value
+    finally:
+      self._lock.release()
+
+  def set(self, key, value, ttl):
+    """Stores value for key for ttl seconds."""
+    self._lock.acquire()
+    try:
+      self._entries.pop(key, None)
+      self._entries[key] = (value, time.time() + ttl)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+    finally:
+      self._lock.release()
+
+  def delete(self, key):
+    self._lock.acquire()
+    try:
+      self._entries.pop(key, None)
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._entries.clear()
+    finally:
+      self._lock.release()
+
+  def __len__(self):
+    return len(self._entries)
+
+
+class CacheBackend(object):
+  """Storage interface used by ResponseCache.
+
+  Backends map str keys to str values which expire after a number of
+  seconds. Keys are at most 250 characters long and contain no whitespace.
+  Backends may be shared by processes serving different containers and
+  viewers: the keys they receive are hashes which include the container and
+  credentials of the context which made the request.
+
+  """
+
+  def get(self, key):
+    """Returns the value stored for key, or None if missing or expired."""
+    raise NotImplementedError('CacheBackend must be subclassed.')
+
+  def set(self, key, value, ttl):
+    """Stores value for key for ttl seconds."""
+    raise NotImplementedError('CacheBackend must be subclassed.')
+
+  def delete(self, key):
+    raise NotImplementedError('CacheBackend must be subclassed.')
+
+  def clear(self):
+    """Drops all entries, if the backend supports it."""
+    raise NotImplementedError('CacheBackend must be subclassed.')
+
+
+class MemoryCacheBackend(LruCache, CacheBackend):
+  """Keeps entries in a bounded LRU cache in this process."""
+
+
+class MemcacheBackend(CacheBackend):
+  """Keeps entries on a server speaking the memcached text protocol.
+
+  Lets several worker processes, or machines, share cached responses. Failed
+  connections are treated as cache misses so an unreachable server only
+  costs performance. Each thread uses its own connection.
+
+  """
+
+  def __init__(self, address, timeout=1.0):
+    """Constructor for MemcacheBackend.
+
+    Args:
+      address: tuple The (host, port) of the memcached server.
+      timeout: float (optional) Socket timeout in seconds.
+
+    """
+    self.address = address
+    self.timeout = timeout
+    self._local = threading.local()
+
+  def get(self, key):
+    response = self._call('get %s\r\n' % key)
+    if not response or not response.startswith('VALUE '):
+      return None
+    header, rest = response.split('\r\n', 1)
+    length = int(header.split()[3])
+    return rest[:length]
+
+  def set(self, key, value, ttl):
+    self._call('set %s 0 %d %d\r\n%s\r\n' % (key, int(ttl), len(value),
+                                                 value))
+
+  def delete(self, key):
+    self._call('delete %s\r\n' % key)
+
+  def clear(self):
+    self._call('flush_all\r\n')
+
+  def _call(self, command):
+    """Sends a command and returns the response, or None on failure."""
+    for attempt in (0, 1):
+      connection = self._get_connection()
+      if not connection:
+        return None
+      try:
+        connection.sendall(command)
+        return self._read_response(connection)
+      except socket.error:
+        self._close_connection()
+    return None
+
+  def _read_response(self, connection):
+    buffer = ''
+    while True:
+      if buffer.startswith('VALUE '):
+        header_end = buffer.find('\r\n')
+        if header_end > -1:
+          length = int(buffer[:header_end].split()[3])
+          # VALUE line, data block, \r\n, END\r\n
+          if len(buffer) >= header_end + 2 + length + 7:
+            return buffer
+      elif buffer.endswith('\r\n'):
+        return buffer
+      data = connection.recv(65536)
+      if not data:
+        raise socket.error(errno.ECONNRESET, 'Connection closed')
+      buffer += data
+
+  def _get_connection(self):
+    connection = getattr(self._local, 'connection', None)
+    if not connection:
+      try:
+        connection = socket.create_connection(self.address, self.timeout)
+      except socket.error:
+        return None
+      self._local.connection = connection
+    return connection
+
+  def _close_connection(self):
+    connection = getattr(self._local, 'connection', None)
+    self._local.connection = None
+    if connection:
+      connection.close()
+
+
+class FileCacheBackend(CacheBackend):
+  """Keeps entries in files, one per key, under a directory.
+
+  Processes sharing the directory share the cached entries. Entries are
+  written to a temporary file and renamed into place, so readers never see
+  a partial entry.
+
+  """
+
+  def __init__(self, directory):
+    self.directory = directory
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+
+  def get(self, key):
+    try:
+      f = open(self._get_path(key), 'rb')
+    except IOError:
+      return None
+    try:
+      expires = f.readline()
+      if float(expires) >= time.time():
+        return f.read()
+    finally:
+      f.close()
+    self.delete(key)
+    return None
+
+  def set(self, key, value, ttl):
+    fd, temp_path = tempfile.mkstemp(dir=self.directory)
+    f = os.fdopen(fd, 'wb')
+    try:
+      f.write('%f\n' % (time.time() + ttl))
+      f.write(value)
+    finally:
+      f.close()
+    os.rename(temp_path, self._get_path(key))
+
+  def delete(self, key):
+    try:
+      os.remove(self._get_path(key))
+    except OSError:
+      pass
+
+  def clear(self):
+    for name in os.listdir(self.directory):
+      if name.endswith('.json'):
+        self.delete(name[:-len('.json')])
+
+  def _get_path(self, key):
+    return os.path.join(self.directory, '%s.json' % key)
+
+
+# Services which requests of the client library write to. Writes do not
+# invalidate cached reads, so these are only cached when given a ttl.
+WRITTEN_SERVICES = ('appdata', 'activities', 'albums')
+
+
+class ResponseCache(object):
+  """Caches the JSON returned by the container for read requests.
+
+  Entries are keyed on the normalized RPC method and params, or REST path and
+  params, of a request plus its requestor (see request.Request.get_cache_key),
+  prefixed by the ContainerContext with the container's base URL and a hash
+  of its consumer key and security token, so that cached data is never
+  shared between containers, consumers or requestors. Requests which
+  modify data, such as UpdateAppDataRequest or CreateActivityRequest, have no
+  cache key and always go to the container. They do not invalidate cached
+  reads either, so the services in WRITTEN_SERVICES are not cached unless
+  ttls gives them a ttl, which accepts reading stale data after a write.
+
+  The raw JSON is stored in a CacheBackend, which by default keeps entries
+  in memory. A MemcacheBackend or FileCacheBackend lets pre-forked workers
+  share responses. Each hit decodes the stored JSON and hands it to the
+  request's process_json, so callers get fresh OpenSocial objects.
+
+  """
+
+  def __init__(self, max_entries=1000, default_ttl=60, ttls=None,
+               backend=None):
+    """Constructor for ResponseCache.
+
+    Args:
+      max_entries: int (optional) The maximum number of responses kept by the
+          default MemoryCacheBackend.
+      default_ttl: int (optional) Seconds a response is kept for.
+      ttls: dict (optional) Seconds a response is kept for, by service name,
+          e.g. {'people': 300, 'activities': 10}. A ttl of 0 disables
+          caching for that service. Services in WRITTEN_SERVICES default to
+          0 rather than default_ttl.
+      backend: CacheBackend (optional) Where responses are stored.
+
+    """
+    self.default_ttl = default_ttl
+    self.ttls = dict.fromkeys(WRITTEN_SERVICES, 0)
+    self.ttls.update(ttls or {})
+    self.hits = 0
+    self.misses = 0
+    if backend is None:
+      backend = MemoryCacheBackend(max_entries)
+    self.backend = backend
+    self._lock = threading.Lock()
+
+  def get(self, cache_key):
+    """Looks up the JSON cached for a request.
+
+    Args:
+      cache_key: tuple The (service, key) tuple returned by
+          Request.get_cache_key.
+
+    Returns: The cached JSON, or None.
+
+    """
+    service, key = cache_key
+    json = None
+    if self.get_ttl(service):
+      value = self.backend.get(self._hash_key(key))
+      if value is not None:
+        json = codec.loads(value)
+    self._lock.acquire()
+    if json is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    self._lock.release()
+    return json
+
+  def set(self, cache_key, json):
+    """Caches the JSON returned for a request.
+
+    Args:
+      cache_key: tuple The (service, key) tuple returned by
+          Request.get_cache_key.
+      json: The JSON returned by the container.
+
+    """
+    service, key = cache_key
+    ttl = self.get_ttl(service)
+    if ttl and json is not None:
+      self.backend.set(self._hash_key(key), codec.dumps(json), ttl)
+
+  def get_ttl(self, service):
+    """Returns the number of seconds responses of a service are kept for."""
+    return self.ttls.get(service, self.default_ttl)
+
+  def clear(self):
+    """Drops all cached responses."""
+    self.backend.clear()
+
+  def _hash_key(self, key):
+    """Turns a request key into a short key safe for every backend."""
+    if isinstance(key, unicode):
+      key = key.encode('utf-8')
+    return 'opensocial-%s' % hashlib.sha1(key).hexdigest()
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Selects the JSON implementation used to encode and decode messages.
+
+The fastest implementation available is picked at import time: the standard
+library's json module or an installed simplejson, preferring one which has
+its C speedups, and otherwise the pure-Python simplejson bundled with this
+library. The others are called with options which make them behave like
+the bundled simplejson: control characters are accepted in strings, and str
+values are encoded as if they held Latin-1 rather than UTF-8.
+
+"""
+
+
+import os
+
+import simplejson
+from simplejson.encoder import encode_fast as _encode_fast
+
+
+def _load_json():
+  import json
+  return json, json.decoder.c_scanstring is not None
+
+
+def _load_simplejson():
+  # A plain import finds the bundled copy next to this module first.
+  module = __import__('simplejson', globals(), {}, [], 0)
+  try:
+    __import__('simplejson._speedups', globals(), {}, [], 0)
+  except ImportError:
+    return module, False
+  return module, True
+
+
+def _load_bundled():
+  return simplejson, False
+
+
+def find_backends():
+  """Returns the available JSON implementations, fastest first.
+
+  Returns: list The (name, module) tuples of the available implementations.
+
+  """
+  return [(name, module) for name, module, accelerated in _find_backends()]
+
+
+def _find_backends():
+  backends = []
+  paths = {}
+  for name, load in (('json', _load_json),
+                     ('simplejson', _load_simplejson),
+                     ('bundled', _load_bundled)):
+    try:
+      module, accelerated = load()
+    except ImportError:
+      continue
+    # The bundled copy is also importable as simplejson when this package's
+    # directory is on sys.path; it is only listed once, as bundled.
+    path = os.path.realpath(os.path.dirname(module.__file__))
+    if path in paths:
+      backends.remove(paths[path])
+    paths[path] = (not accelerated, len(backends), name, module)
+    backends.append(paths[path])
+  backends.sort()
+  return [(name, module, not slow) for slow, _, name, module in backends]
+
+
+BACKEND, _module, _accelerated = _find_backends()[0]
+
+# Keyword arguments passed to each implementation's decoder and encoder.
+DECODER_OPTIONS = {
+  'json': {'strict': False},
+  'simplejson': {'strict': False},
+}
+ENCODER_OPTIONS = {
+  'json': {'encoding': 'latin-1'},
+  'simplejson': {'encoding': 'latin-1'},
+}
+
+_decoder_options = DECODER_OPTIONS.get(BACKEND, {})
+_encoder_options = ENCODER_OPTIONS.get(BACKEND, {})
+
+
+def make_decoder():
+  """Returns a JSONDecoder of the selected implementation."""
+  return _module.JSONDecoder(**_decoder_options)
+
+
+def loads(s):
+  """Decodes a JSON document.
+
+  Args:
+    s: str The JSON document.
+
+  Returns: The decoded value; strings are decoded as unicode.
+
+  """
+  return _module.loads(s, **_decoder_options)
+
+
+def dumps(obj, sort_keys=False):
+  """Encodes a value as a JSON document.
+
+  Args:
+    obj: The value to encode.
+    sort_keys: bool (optional) If True, the keys of dicts are sorted.
+
+  Returns: str The JSON document, in ASCII.
+
+  """
+  return _module.dumps(obj, sort_keys=sort_keys, **_encoder_options)
+
+
+def encode_body(obj):
+  """Encodes a request body, such as a batch of JSON-RPC calls.
+
+  Request bodies are built by this library from dicts, lists, strings and
+  numbers and never contain circular references, so the check for them is
+  skipped. Without C speedups the body is encoded in a single pass by the
+  bundled encoder's encode_fast. The output is the same as for dumps.
+
+  Args:
+    obj: The request body.
+
+  Returns: str The JSON document, in ASCII.
+
+  """
+  if _accelerated:
+    return _module.dumps(obj, check_circular=False, **_encoder_options)
+  return _encode_fast(obj)
+
+
+def iterencode_body(obj):
+  """Encodes a request body piece by piece.
+
+  Args:
+    obj: The request body.
+
+  Returns: An iterator over str chunks which join to encode_body(obj).
+
+  """
+  encoder = _module.JSONEncoder(check_circular=False, **_encoder_options)
+  return encoder.iterencode(obj)
@@ -18,6 +18,10 @@
 __author__ = 'davidbyttow@google.com (David Byttow)'
 
 
+import codec
+import jsonstream
+
+
 def extract_fields(json):
   """Extracts a JSON dict of fields.
   
@@ -184,6 +188,334 @@ class Activity(Object):
     return Activity(extract_fields(json))
 
 
+class LazyObject(object):
+  """An alternative to Object which reads its fields through the JSON dict.
+  
+  Building an Object copies every field of its JSON dict. A LazyObject keeps
+  a reference to the JSON dict instead, which makes building a collection
+  several times faster for callers that only read a few fields, such as
+  get_id and get_display_name. Lookups work as for an Object, through
+  get_field, get, [] and in. Fields which are set or deleted are changed in
+  a copy of the JSON dict, made on the first change.
+
+  A LazyObject is not a dict, nor an instance of the type it stands for, so
+  code which needs one, e.g. to encode it as JSON, must call to_dict().
+
+  """
+
+  __slots__ = ('_fields', '_copied')
+
+  WRAPPER = None
+
+  def __init__(self, fields):
+    if self.WRAPPER and fields:
+      fields = fields.get(self.WRAPPER) or fields
+    self._fields = fields or {}
+    self._copied = False
+
+  def get_field(self, name):
+    """Retrieves a specific field value for this object.
+    
+    Returns: The field value.
+
+    """
+    return self._fields.get(name)
+
+  def get(self, name, default=None):
+    return self._fields.get(name, default)
+
+  def __getitem__(self, name):
+    return self._fields[name]
+
+  def __contains__(self, name):
+    return name in self._fields
+
+  has_key = __contains__
+
+  def __setitem__(self, name, value):
+    self._get_own_fields()[name] = value
+
+  def __delitem__(self, name):
+    del self._get_own_fields()[name]
+
+  def _get_own_fields(self):
+    """Returns the fields, copying the JSON dict before the first change."""
+    if not self._copied:
+      self._fields = dict(self._fields)
+      self._copied = True
+    return self._fields
+
+  def keys(self):
+    return self._fields.keys()
+
+  def values(self):
+    return self._fields.values()
+
+  def items(self):
+    return self._fields.items()
+
+  def iteritems(self):
+    return self._fields.iteritems()
+
+  def __iter__(self):
+    return iter(self._fields)
+
+  def __len__(self):
+    return len(self._fields)
+
+  def to_dict(self):
+    """Returns the fields of this object as a dict."""
+    return dict(self._fields)
+
+  def __eq__(self, other):
+    if isinstance(other, (LazyObject, CompactObject)):
+      other = other.to_dict()
+    return self._fields == other
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return '%s(%r)' % (self.__class__.__name__, self._fields)
+
+
+class LazyPerson(LazyObject):
+  """A lazy opensocial.Person representation."""
+
+  __slots__ = ()
+
+  WRAPPER = 'person'
+
+  def get_id(self):
+    """Returns the container-specific id of this Person."""
+    return self._fields.get('id')
+
+  def get_display_name(self):
+    """Returns the full name of this Person."""
+    display_name = self._fields.get('displayName')
+    if display_name:
+      return display_name
+    names = self._fields.get('name')
+    if names:
+      return '%s %s' % (names['givenName'], names['familyName'])
+    return ''
+
+  @staticmethod
+  def parse_json(json):
+    return LazyPerson(extract_fields(json))
+
+
+class LazyActivity(LazyObject):
+  """A lazy activity entry."""
+
+  __slots__ = ()
+
+  WRAPPER = 'activity'
+
+  @staticmethod
+  def parse_json(json):
+    return LazyActivity(extract_fields(json))
+
+
+class LazyMediaItem(LazyObject):
+  """A lazy MediaItem object."""
+
+  __slots__ = ()
+
+  WRAPPER = 'mediaItem'
+
+  @staticmethod
+  def parse_json(json):
+    return LazyMediaItem(extract_fields(json))
+
+
+class LazyAlbum(LazyObject):
+  """A lazy Album object."""
+
+  __slots__ = ()
+
+  WRAPPER = 'album'
+
+  @staticmethod
+  def parse_json(json):
+    return LazyAlbum(extract_fields(json))
+
+
+# Object types, for ContainerContext.set_object_types, which build lazy
+# objects in place of Person, Activity, MediaItem and Album.
+LAZY_TYPES = {
+  Person: LazyPerson,
+  Activity: LazyActivity,
+  MediaItem: LazyMediaItem,
+  Album: LazyAlbum,
+}
+
+
+_MISSING = object()
+
+
+class CompactObject(object):
+  """A read-only, memory-lean alternative to Object.
+  
+  The fields listed in FIELDS are stored in __slots__, so an instance has no
+  per-instance dict. The remaining fields are kept as a single JSON string
+  which is only decoded when one of them is read. Lookups work as for an
+  Object, through get_field, get, [] and in, but the fields cannot be
+  modified.
+
+  """
+
+  __slots__ = ('_extra',)
+
+  FIELDS = ()
+  WRAPPER = None
+
+  def __init__(self, fields):
+    if self.WRAPPER and fields:
+      fields = fields.get(self.WRAPPER) or fields
+    extra = dict(fields or {})
+    for name in self.FIELDS:
+      value = extra.pop(name, _MISSING)
+      if value is not _MISSING:
+        setattr(self, name, value)
+    self._extra = None
+    if extra:
+      self._extra = codec.dumps(extra)
+
+  def _get_extra(self):
+    """Returns the fields which are not stored in slots, decoding them once."""
+    if self._extra is None:
+      return {}
+    if isinstance(self._extra, basestring):
+      self._extra = codec.loads(self._extra)
+    return self._extra
+
+  def get_field(self, name):
+    """Retrieves a specific field value for this object.
+    
+    Returns: The field value.
+
+    """
+    return self.get(name)
+
+  def get(self, name, default=None):
+    if name in self.FIELDS:
+      return getattr(self, name, default)
+    return self._get_extra().get(name, default)
+
+  def __getitem__(self, name):
+    value = self.get(name, _MISSING)
+    if value is _MISSING:
+      raise KeyError(name)
+    return value
+
+  def __contains__(self, name):
+    return self.get(name, _MISSING) is not _MISSING
+
+  def keys(self):
+    return [name for name in self.FIELDS
+            if getattr(self, name, _MISSING) is not _MISSING
+           ] + self._get_extra().keys()
+
+  def items(self):
+    return [(name, self[name]) for name in self.keys()]
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __len__(self):
+    return len(self.keys())
+
+  def to_dict(self):
+    """Returns the fields of this object as a dict."""
+    return dict(self.items())
+
+  def __eq__(self, other):
+    if isinstance(other, CompactObject):
+      other = other.to_dict()
+    return self.to_dict() == other
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return '%s(%r)' % (self.__class__.__name__, self.to_dict())
+
+
+class CompactPerson(CompactObject):
+  """A compact opensocial.Person representation."""
+
+  FIELDS = ('id', 'displayName', 'name', 'thumbnailUrl', 'profileUrl')
+  WRAPPER = 'person'
+  __slots__ = FIELDS
+
+  def get_id(self):
+    """Returns the container-specific id of this Person."""
+    return self.get('id')
+
+  def get_display_name(self):
+    """Returns the full name of this Person."""
+    display_name = self.get('displayName')
+    if display_name:
+      return display_name
+    names = self.get('name')
+    if names:
+      return '%s %s' % (names['givenName'], names['familyName'])
+    return ''
+
+  @staticmethod
+  def parse_json(json):
+    return CompactPerson(extract_fields(json))
+
+
+class CompactActivity(CompactObject):
+  """A compact activity entry."""
+
+  FIELDS = ('id', 'userId', 'appId', 'title', 'body', 'postedTime')
+  WRAPPER = 'activity'
+  __slots__ = FIELDS
+
+  @staticmethod
+  def parse_json(json):
+    return CompactActivity(extract_fields(json))
+
+
+class CompactMediaItem(CompactObject):
+  """A compact MediaItem object."""
+
+  FIELDS = ('id', 'albumId', 'title', 'type', 'mimeType', 'url',
+            'thumbnailUrl')
+  WRAPPER = 'mediaItem'
+  __slots__ = FIELDS
+
+  @staticmethod
+  def parse_json(json):
+    return CompactMediaItem(extract_fields(json))
+
+
+class CompactAlbum(CompactObject):
+  """A compact Album object."""
+
+  FIELDS = ('id', 'ownerId', 'title', 'description', 'mediaItemCount',
+            'thumbnailUrl')
+  WRAPPER = 'album'
+  __slots__ = FIELDS
+
+  @staticmethod
+  def parse_json(json):
+    return CompactAlbum(extract_fields(json))
+
+
+# Object types, for ContainerContext.set_object_types, which build compact
+# objects in place of Person, Activity, MediaItem and Album.
+COMPACT_TYPES = {
+  Person: CompactPerson,
+  Activity: CompactActivity,
+  MediaItem: CompactMediaItem,
+  Album: CompactAlbum,
+}
+
+
 class Collection(list):
   """Contains a collection of OpenSocial objects.
   
@@ -220,3 +552,53 @@ class Collection(list):
         for fields in json_list:
             items.append(cls(fields))
     return Collection(items, start, total)
+
+
+class CollectionStream(object):
+  """Iterates over the OpenSocial objects of a streamed collection response.
+  
+  Unlike Collection, entries are decoded one at a time as the response is
+  read, so a large friends list never has to be held in memory at once.
+  startIndex and totalResults are available once they have been read, which
+  is before the first entry for most containers.
+
+  """
+
+  def __init__(self, stream, cls, error_handler=None, chunk_size=8192):
+    """Constructor for CollectionStream.
+    
+    Args:
+      stream: A file-like object with the JSON response.
+      cls: The OpenSocial data type to instantiate for each entry.
+      error_handler: callable (optional) Called with the error JSON if the
+          response turns out to contain an error.
+      chunk_size: int (optional) Number of bytes read at a time.
+
+    """
+    self.stream = stream
+    self.cls = cls
+    self.error_handler = error_handler
+    self._entries = jsonstream.EntryStream(stream, chunk_size=chunk_size)
+
+  def _get_start_index(self):
+    return self._entries.values.get('startIndex')
+
+  def _get_total_results(self):
+    return self._entries.values.get('totalResults')
+
+  startIndex = property(_get_start_index)
+  totalResults = property(_get_total_results)
+
+  def __iter__(self):
+    try:
+      for fields in self._entries:
+        yield self.cls(fields)
+    finally:
+      self.close()
+    error = self._entries.values.get('error')
+    if error and self.error_handler:
+      self.error_handler(error)
+
+  def close(self):
+    """Closes the underlying stream."""
+    self.stream.close()
@@ -18,15 +18,24 @@
 __author__ = 'davidbyttow@google.com (David Byttow)'
 
 
+import errno
 import httplib
 import logging
+import os
+import socket
 import sys
+from StringIO import StringIO
+import threading
+import time
 import urllib2
+import urlparse
 import hashlib 
 from base64 import b64encode
+from binascii import hexlify
 
+import codec
 import oauth
-import simplejson
+import workers
 try:
   from google.appengine.api import urlfetch
 except:
@@ -37,7 +46,7 @@ logging.basicConfig(level=logging.DEBUG)
 
 VERBOSE = 0
 
-def get_default_urlfetch():
+def get_default_urlfetch(keep_alive=False):
   """Creates the default UrlFetch interface.
   
   If AppEngine environment is detected, then the AppEngineUrlFetch object
@@ -45,17 +54,52 @@ def get_default_urlfetch():
   
   TODO: Find a better way to determine if this is an AppEngine environment.
 
+  Args:
+    keep_alive: bool (optional) If True, outside of AppEngine a PooledUrlFetch
+        which reuses HTTP/1.1 keep-alive connections will be created.
+
   """
   if sys.modules.has_key('google.appengine.api.urlfetch'):
     return AppEngineUrlFetch()
+  if keep_alive:
+    return PooledUrlFetch()
   return UrlFetch()
 
+_default_async_urlfetch = None
+_default_async_urlfetch_lock = threading.Lock()
+
+def get_default_async_urlfetch():
+  """Returns the default UrlFetch interface which supports fetch_async.
+  
+  If AppEngine environment is detected, then the AppEngineAsyncUrlFetch
+  object will be created. Otherwise, a single AsyncUrlFetch wrapping the
+  default UrlFetch is shared by all callers, so that contexts created for
+  each incoming request do not each start a pool of threads.
+
+  """
+  global _default_async_urlfetch
+  if sys.modules.has_key('google.appengine.api.urlfetch'):
+    return AppEngineAsyncUrlFetch()
+  _default_async_urlfetch_lock.acquire()
+  try:
+    if not _default_async_urlfetch:
+      _default_async_urlfetch = AsyncUrlFetch(UrlFetch())
+    return _default_async_urlfetch
+  finally:
+    _default_async_urlfetch_lock.release()
+
+
 def log_request(request):
+  if request.stream_body:
+    # Logging the body would build the string streaming avoids.
+    body = '<streamed>'
+  else:
+    body = request.get_post_body()
   logging.debug('URL: %s %s\nHEADERS: %s\nPOST: %s' %
                 (request.get_method(),
                  request.get_url(),
                  str(request.get_headers()),
-                 request.get_post_body()))
+                 body))
 
 
 def log_response(response):
@@ -97,6 +141,232 @@ class UrlFetch(object):
     log_response(response)
     return response
 
+  def fetch_stream(self, request):
+    """Performs a synchronous fetch request without reading the body.
+    
+    Implementations which override fetch should override fetch_stream too,
+    if only with buffered_fetch_stream.
+
+    Args:
+      request: The http.Request object that contains the request information.
+    
+    Returns: An http.StreamingResponse object, which should be closed.
+
+    """
+    log_request(request)
+    req = urllib2.Request(request.get_url(),
+                          data=request.get_post_body(),
+                          headers=request.get_headers())
+    try:
+      return StreamingResponse(httplib.OK, urllib2.urlopen(req))
+    except urllib2.URLError, e:
+      return StreamingResponse(e.code, e)
+
+
+def buffered_fetch_stream(url_fetch, request):
+  """Implements fetch_stream with a fetch which reads the whole body.
+  
+  Args:
+    url_fetch: The UrlFetch implementation.
+    request: The http.Request object that contains the request information.
+  
+  Returns: An http.StreamingResponse object.
+
+  """
+  response = url_fetch.fetch(request)
+  return StreamingResponse(response.status, StringIO(response.content))
+
+
+class PooledUrlFetch(UrlFetch):
+  """Implementation of UrlFetch which reuses HTTP/1.1 keep-alive connections.
+  
+  Idle connections are pooled per scheme, host and port, so repeated calls to
+  the same container skip the DNS lookup, TCP connect and TLS handshake. At
+  most max_connections_per_host idle connections are kept for each host and
+  connections which have been idle for longer than idle_timeout seconds are
+  discarded. A request sent on a reused connection which the server has
+  already closed is retried once on a fresh connection.
+
+  Instances are thread-safe and are meant to be shared, e.g. by passing the
+  same instance to several ContainerContext objects.
+
+  """
+
+  def __init__(self, max_connections_per_host=4, idle_timeout=30,
+               timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+    """Constructor for PooledUrlFetch.
+    
+    Args:
+      max_connections_per_host: int (optional) The maximum number of idle
+          connections kept open for each host.
+      idle_timeout: int (optional) Seconds after which an idle connection is
+          closed rather than reused.
+      timeout: float (optional) Socket timeout for new connections. By
+          default, the one set with socket.setdefaulttimeout() is used.
+
+    """
+    self.max_connections_per_host = max_connections_per_host
+    self.idle_timeout = idle_timeout
+    self.timeout = timeout
+    self._idle = {}
+    self._lock = threading.Lock()
+
+  def fetch(self, request):
+    """Performs a synchronous fetch request over a pooled connection.
+    
+    Args:
+      request: The http.Request object that contains the request information.
+    
+    Returns: An http.Response object.
+
+    """
+    log_request(request)
+    key, connection, http_response = self._open(request)
+    content = http_response.read()
+    self._finish(key, connection, http_response)
+    response = Response(http_response.status, content)
+    log_response(response)
+    return response
+
+  def fetch_stream(self, request):
+    """Performs a synchronous fetch request without reading the body.
+    
+    The connection goes back to the pool once the body has been read to the
+    end and the response is closed. A response closed before the end of the
+    body closes its connection instead.
+
+    Args:
+      request: The http.Request object that contains the request information.
+    
+    Returns: An http.StreamingResponse object, which should be closed.
+
+    """
+    log_request(request)
+    key, connection, http_response = self._open(request)
+    return StreamingResponse(
+        http_response.status, http_response,
+        lambda: self._finish(key, connection, http_response))
+
+  def _open(self, request):
+    """Sends a request and reads the response headers.
+    
+    Returns: A tuple of the pool key, the connection and the
+        httplib.HTTPResponse.
+
+    """
+    scheme, netloc, path, query, fragment = urlparse.urlsplit(
+        request.get_url())
+    selector = path or '/'
+    if query:
+      selector = '%s?%s' % (selector, query)
+    key = (scheme, netloc)
+
+    if VERBOSE > 0:
+      logging.info("URL => %s", request.get_url())
+
+    retried = False
+    while True:
+      connection, reused = self._get_connection(key)
+      try:
+        if request.stream_body and request.post_body:
+          self._send_streamed(connection, selector, request)
+        else:
+          connection.request(request.get_method(), selector,
+                             request.get_post_body(), request.get_headers())
+        return key, connection, connection.getresponse()
+      except (httplib.HTTPException, socket.error), e:
+        connection.close()
+        if reused and not retried and self._is_stale_connection_error(e):
+          retried = True
+          continue
+        raise
+
+  def _send_streamed(self, connection, selector, request):
+    """Sends a request, writing the post body as it is encoded."""
+    connection.putrequest(request.get_method(), selector)
+    for name, value in request.get_headers().iteritems():
+      connection.putheader(name, value)
+    connection.putheader('Content-Length', str(request.get_post_body_length()))
+    connection.endheaders()
+    for chunk in request.iter_post_body():
+      connection.send(chunk)
+
+  def _finish(self, key, connection, http_response):
+    """Returns the connection to the pool if it can be reused.
+    
+    httplib closes a response once its body has been read to the end, so a
+    response which is still open was abandoned part way through and its
+    connection has unread data on it.
+
+    """
+    if http_response.will_close or not http_response.isclosed():
+      connection.close()
+    else:
+      self._release_connection(key, connection)
+
+  def close(self):
+    """Closes all idle connections held by this pool."""
+    self._lock.acquire()
+    try:
+      idle, self._idle = self._idle, {}
+    finally:
+      self._lock.release()
+    for connections in idle.itervalues():
+      for connection, last_used in connections:
+        connection.close()
+
+  def _get_connection(self, key):
+    """Returns a (connection, reused) tuple for the given host key."""
+    now = time.time()
+    expired = []
+    connection = None
+    self._lock.acquire()
+    try:
+      connections = self._idle.get(key)
+      while connections:
+        candidate, last_used = connections.pop()
+        if now - last_used > self.idle_timeout:
+          expired.append(candidate)
+        else:
+          connection = candidate
+          break
+    finally:
+      self._lock.release()
+
+    for candidate in expired:
+      candidate.close()
+    if connection:
+      return connection, True
+    return self._new_connection(key), False
+
+  def _new_connection(self, key):
+    scheme, netloc = key
+    if scheme == 'https':
+      return httplib.HTTPSConnection(netloc, timeout=self.timeout)
+    return httplib.HTTPConnection(netloc, timeout=self.timeout)
+
+  def _release_connection(self, key, connection):
+    self._lock.acquire()
+    try:
+      connections = self._idle.setdefault(key, [])
+      if len(connections) < self.max_connections_per_host:
+        connections.append((connection, time.time()))
+        connection = None
+    finally:
+      self._lock.release()
+    if connection:
+      connection.close()
+
+  def _is_stale_connection_error(self, error):
+    """Tells whether an error means the server closed an idle connection."""
+    if isinstance(error, httplib.BadStatusLine):
+      return True
+    if isinstance(error, socket.error):
+      return error.args and error.args[0] in (errno.ECONNRESET, errno.EPIPE,
+                                              errno.ECONNABORTED)
+    return False
+
+
 class AppEngineUrlFetch(UrlFetch):
   """Implementation of UrlFetch using AppEngine's URLFetch API."""
 
@@ -123,6 +393,78 @@ class AppEngineUrlFetch(UrlFetch):
     log_response(response)
     return response
 
+  def fetch_stream(self, request):
+    """AppEngine's URLFetch always reads the whole body."""
+    return buffered_fetch_stream(self, request)
+
+
+class AsyncUrlFetch(UrlFetch):
+  """Adds fetch_async to any UrlFetch implementation.
+  
+  Fetches are performed by the wrapped UrlFetch on a pool of worker threads,
+  so the wrapped implementation must be thread-safe.
+
+  """
+
+  def __init__(self, url_fetch=None, max_concurrent_fetches=10):
+    """Constructor for AsyncUrlFetch.
+    
+    Args:
+      url_fetch: (optional) The UrlFetch implementation which performs the
+          fetches. Defaults to UrlFetch.
+      max_concurrent_fetches: int (optional) The maximum number of fetches in
+          flight at once.
+
+    """
+    self.url_fetch = url_fetch or UrlFetch()
+    self.pool = workers.WorkerPool(max_concurrent_fetches)
+
+  def fetch(self, request):
+    """Performs a synchronous fetch request with the wrapped UrlFetch."""
+    return self.url_fetch.fetch(request)
+
+  def fetch_stream(self, request):
+    """Performs a streaming fetch request with the wrapped UrlFetch."""
+    return self.url_fetch.fetch_stream(request)
+
+  def fetch_async(self, request):
+    """Starts a fetch request.
+    
+    Args:
+      request: The http.Request object that contains the request information.
+    
+    Returns: A pending result whose get_result() returns an http.Response.
+
+    """
+    return self.pool.submit(self.url_fetch.fetch, request)
+
+
+class AppEngineAsyncUrlFetch(AppEngineUrlFetch):
+  """Implementation of fetch_async using AppEngine's asynchronous URLFetch."""
+
+  def fetch_async(self, request):
+    """Starts a fetch request.
+    
+    Args:
+      request: The http.Request object that contains the request information.
+    
+    Returns: A pending result whose get_result() returns an http.Response.
+
+    """
+    log_request(request)
+    rpc = urlfetch.create_rpc()
+    urlfetch.make_fetch_call(rpc,
+                             request.get_url(),
+                             payload=request.get_post_body(),
+                             method=request.get_method(),
+                             headers=request.get_headers())
+    def get_result():
+      result = rpc.get_result()
+      response = Response(result.status_code, result.content)
+      log_response(response)
+      return response
+    return workers.DeferredResult(get_result)
+
 
 class Request(object):
   """This object is used to make a UrlFetch interface request.
@@ -138,6 +480,8 @@ class Request(object):
     """
     self.use_body_as_signing_parameter = False
     self.add_bodyhash = add_bodyhash;
+    self.stream_body = False
+    self._post_body_length = None
     params = signed_params or {}
     params['opensocial_method'] = method
     self.oauth_request = oauth.OAuthRequest.from_request(method, url,
@@ -154,19 +498,57 @@ class Request(object):
       
   def set_body_as_signing_parameter(self, use_body):
     self.use_body_as_signing_parameter = use_body
+
+  def set_stream_body(self, stream_body):
+    """Sets if the post body is encoded piece by piece rather than at once.
+    
+    A streamed body is never held in memory as a whole: the body hash is
+    computed over the encoded chunks and UrlFetch implementations which
+    support it, such as PooledUrlFetch, send the chunks as they are encoded.
+    Others, and signing with the body as a parameter, still need the whole
+    string from get_post_body.
+
+    Args:
+      stream_body: bool True to stream the post body.
+
+    """
+    self.stream_body = stream_body
         
-  def sign_request(self, consumer, signature_method):
+  def sign_request(self, consumer, signature_method, timestamp=None,
+                   nonce=None):
     """Add oauth parameters and sign the request with the given method.
     
     Args:
       consumer: The OAuthConsumer set with a key and secret.
       signature_method: A supported method for signing the built request.
+      timestamp: int (optional) The oauth_timestamp, by default the current
+          time.
+      nonce: str (optional) The oauth_nonce, by default a new random one.
+
+    """
+    self.add_oauth_parameters(consumer, timestamp, nonce)
+    if VERBOSE > 0:
+      key, raw = signature_method.build_signature_base_string(
+                     self.oauth_request, consumer, None)
+      logging.info("build_signature key => %s" % key)
+      logging.info("build_signature raw => %s" % raw)
+      
+    self.oauth_request.sign_request(signature_method, consumer, None)
+
+  def add_oauth_parameters(self, consumer, timestamp=None, nonce=None):
+    """Adds the oauth parameters which are signed, including the body hash.
+
+    Args:
+      consumer: The OAuthConsumer set with a key and secret.
+      timestamp: int (optional) The oauth_timestamp, by default the current
+          time.
+      nonce: str (optional) The oauth_nonce, by default a new random one.
 
     """
     params = {
       'oauth_consumer_key': consumer.key,
-      'oauth_timestamp': oauth.generate_timestamp(),
-      'oauth_nonce': oauth.generate_nonce(),
+      'oauth_timestamp': timestamp or oauth.generate_timestamp(),
+      'oauth_nonce': nonce or oauth.generate_nonce(),
       'oauth_version': oauth.OAuthRequest.version,
     }
           
@@ -181,20 +563,12 @@ class Request(object):
             logging.info("post_body => %s" % str(self.post_body))
                   
         if self.add_bodyhash:
-            body_hash = b64encode(hashlib.sha1(self.get_post_body()).digest())
-            params['oauth_body_hash'] = body_hash
+            params['oauth_body_hash'] = self.get_post_body_hash()
   
     if self.get_security_token():
       self.set_parameter("xoauth_requestor_id", None)
     
     self.set_parameters(params)
-    if VERBOSE > 0:
-      key, raw = signature_method.build_signature_base_string(
-                     self.oauth_request, consumer, None)
-      logging.info("build_signature key => %s" % key)
-      logging.info("build_signature raw => %s" % raw)
-      
-    self.oauth_request.sign_request(signature_method, consumer, None)
     
   def set_parameter(self, name, value):
     """Set a parameter for this request.
@@ -258,11 +632,162 @@ class Request(object):
     return headers
 
 
+  def _get_post_body_object(self):
+    return self._post_body
+
+  def _set_post_body_object(self, post_body):
+    self._post_body = post_body
+    self._encoded_post_body = None
+    self._post_body_length = None
+
+  post_body = property(_get_post_body_object, _set_post_body_object,
+                       doc="The JSON structure sent as the request body.")
+
+  def invalidate_post_body(self):
+    """Discards the encoded post body after post_body was changed in place."""
+    self._encoded_post_body = None
+    self._post_body_length = None
+
   def get_post_body(self):
-    """Get the JSON encoded post body."""
-    if self.post_body:
-      return simplejson.dumps(self.post_body)
-    return None
+    """Get the JSON encoded post body.
+    
+    The body is encoded on the first call and the same string is then used for
+    the body hash, the signature, the fetch and logging. Assigning post_body
+    discards the encoded string; if the body is modified in place instead,
+    invalidate_post_body() must be called.
+
+    """
+    if self._encoded_post_body is None and self._post_body:
+      self._encoded_post_body = codec.encode_body(self._post_body)
+    return self._encoded_post_body
+
+  def iter_post_body(self, chunk_size=65536):
+    """Iterates over the JSON encoded post body in chunks.
+    
+    Unless the whole body has already been encoded by get_post_body, it is
+    encoded as it is iterated over.
+
+    Args:
+      chunk_size: int (optional) The approximate size of the chunks.
+
+    Returns: An iterator over str chunks which join to get_post_body().
+
+    """
+    if self._encoded_post_body is not None or not self._post_body:
+      body = self.get_post_body() or ''
+      for start in xrange(0, len(body), chunk_size):
+        yield body[start:start + chunk_size]
+      return
+
+    chunks = []
+    size = 0
+    for chunk in codec.iterencode_body(self._post_body):
+      chunks.append(chunk)
+      size += len(chunk)
+      if size >= chunk_size:
+        yield ''.join(chunks)
+        chunks = []
+        size = 0
+    if chunks:
+      yield ''.join(chunks)
+
+  def get_post_body_length(self):
+    """Returns the length in bytes of the JSON encoded post body."""
+    if self._post_body_length is None:
+      if not self.stream_body:
+        self._post_body_length = len(self.get_post_body() or '')
+      else:
+        self._post_body_length = sum(len(chunk)
+                                     for chunk in self.iter_post_body())
+    return self._post_body_length
+
+  def get_post_body_hash(self):
+    """Returns the base64 encoded SHA-1 hash of the post body.
+    
+    A streamed body is hashed chunk by chunk, which also records its length.
+
+    """
+    if not self.stream_body:
+      return b64encode(hashlib.sha1(self.get_post_body()).digest())
+    body_hash = hashlib.sha1()
+    length = 0
+    for chunk in self.iter_post_body():
+      body_hash.update(chunk)
+      length += len(chunk)
+    self._post_body_length = length
+    return b64encode(body_hash.digest())
+
+class BulkSigner(object):
+  """Signs many http.Requests for one consumer in a single call.
+
+  The requests share a timestamp and their nonces come from a single read of
+  os.urandom. With HMAC-SHA1, the HMAC state after the key and the escaped
+  method and URL is computed once per distinct method and URL and copied for
+  each request, and repeated parameters such as the consumer key and
+  security token are escaped once. Other signature methods sign each request
+  in turn.
+
+  """
+
+  def __init__(self, consumer, signature_method):
+    """Constructor for BulkSigner.
+
+    Args:
+      consumer: The OAuthConsumer set with a key and secret.
+      signature_method: A supported method for signing the requests.
+
+    """
+    self.consumer = consumer
+    self.signature_method = signature_method
+
+  def sign(self, requests, timestamp=None):
+    """Adds oauth parameters to the requests and signs them.
+
+    The signatures are the same as those of Request.sign_request given the
+    same timestamp and nonces.
+
+    Args:
+      requests: list The http.Request objects to sign.
+      timestamp: int (optional) The oauth_timestamp, by default the current
+          time.
+
+    """
+    if not requests:
+      return
+    timestamp = timestamp or oauth.generate_timestamp()
+    nonces = generate_nonces(len(requests))
+    signature_method = self.signature_method
+    if (type(signature_method) is not oauth.OAuthSignatureMethod_HMAC_SHA1 or
+        VERBOSE > 0):
+      for request, nonce in zip(requests, nonces):
+        request.sign_request(self.consumer, signature_method, timestamp, nonce)
+      return
+
+    keyed_hmac = signature_method.get_keyed_hmac(self.consumer, None)
+    name = signature_method.get_name()
+    prefixes = {}
+    for request, nonce in zip(requests, nonces):
+      request.add_oauth_parameters(self.consumer, timestamp, nonce)
+      oauth_request = request.oauth_request
+      oauth_request.set_parameter('oauth_signature_method', name)
+      prefix_key = (oauth_request.http_method, oauth_request.http_url)
+      prefix = prefixes.get(prefix_key)
+      if prefix is None:
+        prefix = prefixes[prefix_key] = keyed_hmac.copy()
+        prefix.update('%s&%s&' % (
+            oauth.escape(oauth_request.get_normalized_http_method()),
+            oauth.escape(oauth_request.get_normalized_http_url())))
+      hashed = prefix.copy()
+      hashed.update(oauth.escape(oauth_request.get_normalized_parameters()))
+      oauth_request.set_parameter('oauth_signature',
+                                  b64encode(hashed.digest()))
+
+
+def generate_nonces(count):
+  """Returns count random nonces of 16 hex digits, from one os.urandom call."""
+  data = hexlify(os.urandom(8 * count))
+  return [data[start:start + 16] for start in xrange(0, len(data), 16)]
+
 
 class Response(object):
   """Represents a response from the UrlFetch interface."""
@@ -270,3 +795,48 @@ class Response(object):
   def __init__(self, status, content):
     self.status = status
     self.content = content
+
+
+class StreamingResponse(Response):
+  """A response whose body is read on demand from a file-like stream.
+  
+  Reading content reads the rest of the stream. Either way, the response
+  should be closed once it is no longer needed.
+
+  """
+
+  def __init__(self, status, stream, on_close=None):
+    """Constructor for StreamingResponse.
+    
+    Args:
+      status: int The HTTP status code.
+      stream: A file-like object with read() and close() methods.
+      on_close: callable (optional) Called once, when the response is
+          closed but before the stream is, so that it can tell whether the
+          stream was read to the end.
+
+    """
+    self.status = status
+    self.stream = stream
+    self.on_close = on_close
+    self._content = None
+
+  def _get_content(self):
+    if self._content is None:
+      self._content = self.stream.read()
+      self.close()
+    return self._content
+
+  content = property(_get_content)
+
+  def read(self, size=-1):
+    """Reads up to size bytes of the body from the stream."""
+    return self.stream.read(size)
+
+  def close(self):
+    on_close, self.on_close = self.on_close, None
+    try:
+      if on_close:
+        on_close()
+    finally:
+      self.stream.close()
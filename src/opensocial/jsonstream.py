@@ -0,0 +1,164 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Incremental decoding of the entries of large container responses."""
+
+
+import codec
+
+
+WHITESPACE = ' \t\n\r'
+
+
+class EntryStream(object):
+  """Iterates over the items of the entry array of a JSON document.
+
+  The document is read from a file-like object in chunks and only the item
+  being decoded is held in memory, so a response with thousands of entries
+  can be processed in constant memory. Items are taken from the first array
+  found under one of the given keys, e.g. "entry" for REST responses or
+  "list" for RPC responses.
+
+  Values of the capture keys, such as "totalResults", are decoded as they are
+  passed and stored in the values dict; values which appear after the array
+  are only available once the iteration is over.
+
+  """
+
+  def __init__(self, stream, keys=('entry', 'list'),
+               captures=('startIndex', 'totalResults', 'itemsPerPage',
+                         'error'),
+               chunk_size=8192):
+    """Constructor for EntryStream.
+
+    Args:
+      stream: A file-like object with a read(size) method.
+      keys: tuple (optional) Keys whose array value is iterated over.
+      captures: tuple (optional) Keys whose values are stored in values.
+      chunk_size: int (optional) Number of bytes read at a time.
+
+    """
+    self.stream = stream
+    self.keys = keys
+    self.captures = captures
+    self.chunk_size = chunk_size
+    self.values = {}
+    self._decoder = codec.make_decoder()
+    self._buffer = ''
+    self._pos = 0
+    self._eof = False
+
+  def __iter__(self):
+    found = False
+    while True:
+      c = self._skip_whitespace()
+      if c is None:
+        return
+      if c != '"':
+        self._pos += 1
+        continue
+      string = self._read_string()
+      if self._skip_whitespace() != ':':
+        continue
+      self._pos += 1
+      c = self._skip_whitespace()
+      if string in self.captures:
+        self.values[string] = self._decode()
+      elif c == '[' and string in self.keys and not found:
+        found = True
+        self._pos += 1
+        for item in self._iter_array():
+          yield item
+
+  def _iter_array(self):
+    while True:
+      c = self._skip_whitespace()
+      if c is None or c == ']':
+        return
+      if c == ',':
+        self._pos += 1
+        continue
+      yield self._decode()
+      self._compact()
+
+  def _fill(self):
+    """Reads the next chunk from the stream. Returns False at the end."""
+    if self._eof:
+      return False
+    chunk = self.stream.read(self.chunk_size)
+    if not chunk:
+      self._eof = True
+      return False
+    self._buffer += chunk
+    return True
+
+  def _compact(self):
+    """Drops the part of the buffer which has already been consumed."""
+    if self._pos > self.chunk_size:
+      self._buffer = self._buffer[self._pos:]
+      self._pos = 0
+
+  def _skip_whitespace(self):
+    """Moves to the next non-whitespace character and returns it."""
+    while True:
+      buffer = self._buffer
+      pos = self._pos
+      length = len(buffer)
+      while pos < length and buffer[pos] in WHITESPACE:
+        pos += 1
+      self._pos = pos
+      if pos < length:
+        return buffer[pos]
+      self._compact()
+      if not self._fill():
+        return None
+
+  def _read_string(self):
+    """Reads the raw contents of the string starting at the current quote."""
+    start = self._pos + 1
+    search = start
+    while True:
+      end = self._buffer.find('"', search)
+      if end < 0:
+        search = len(self._buffer)
+        if not self._fill():
+          raise ValueError('Unterminated string in JSON response')
+        continue
+      backslashes = 0
+      while self._buffer[end - backslashes - 1] == '\\':
+        backslashes += 1
+      if backslashes % 2:
+        search = end + 1
+        continue
+      self._pos = end + 1
+      return self._buffer[start:end]
+
+  def _decode(self):
+    """Decodes the JSON value at the current position."""
+    while True:
+      try:
+        value, end = self._decoder.raw_decode(self._buffer, idx=self._pos)
+      except ValueError:
+        if not self._fill():
+          raise
+        continue
+      # A number, or a value decoded from a truncated buffer, may continue in
+      # the next chunk.
+      if end >= len(self._buffer) and self._fill():
+        continue
+      self._pos = end
+      return value
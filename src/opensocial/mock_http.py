@@ -64,3 +64,6 @@ class MockUrlFetch(http.UrlFetch):
     else:
       return self.default_response
 
+  def fetch_stream(self, request):
+    """Perform the fake fetch, returning the body as a stream."""
+    return http.buffered_fetch_stream(self, request)
@@ -0,0 +1,345 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Replay protection for OAuth nonces received by a server."""
+
+
+import SocketServer
+import errno
+import os
+import select
+import socket
+import threading
+import time
+import urllib
+
+
+class NonceStore(object):
+  """Remembers the nonces of accepted requests to detect replayed ones.
+
+  Nonces are unique per consumer, token and timestamp. Requests whose
+  timestamp is more than threshold seconds away from the current time are
+  rejected anyway, so nonces only need to be kept for that long.
+
+  A store can serve as the lookup_nonce of an oauth.OAuthDataStore, e.g.
+  data_store.lookup_nonce = store.lookup_nonce.
+
+  """
+
+  def check(self, consumer_key, token_key, nonce, timestamp):
+    """Records a nonce.
+
+    Args:
+      consumer_key: str The oauth_consumer_key of the request.
+      token_key: str The oauth_token of the request, or None.
+      nonce: str The oauth_nonce of the request.
+      timestamp: The oauth_timestamp of the request.
+
+    Returns: bool True if the nonce is fresh and the request may proceed;
+        False if it was seen before, the timestamp is out of range or the
+        nonce could not be recorded.
+
+    """
+    raise NotImplementedError('NonceStore must be subclassed.')
+
+  def lookup_nonce(self, oauth_consumer, oauth_token, nonce, timestamp):
+    """Records a nonce, with the arguments of OAuthDataStore.lookup_nonce.
+
+    Returns: The nonce if the request must be rejected, otherwise None.
+
+    """
+    if self.check(oauth_consumer.key, oauth_token and oauth_token.key, nonce,
+                  timestamp):
+      return None
+    return nonce
+
+
+class _Shard(object):
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.buckets = {}
+    self.oldest = None
+
+
+class MemoryNonceStore(NonceStore):
+  """Keeps nonces in this process, in buckets of threshold seconds.
+
+  Nonces are spread over shards by their hash, each with its own lock, so
+  concurrent checks rarely wait for each other, even when they come from the
+  same consumer. Within a shard nonces are grouped by timestamp into buckets
+  as wide as threshold; once the oldest bucket only holds expired timestamps
+  it is dropped as a whole. At most max_nonces nonces are kept in all: when
+  the store is full, requests are rejected until buckets expire.
+
+  """
+
+  def __init__(self, threshold=300, shards=16, max_nonces=1000000,
+               clock=time.time):
+    """Constructor for MemoryNonceStore.
+
+    Args:
+      threshold: int (optional) Seconds a timestamp may be away from the
+          current time, e.g. the timestamp_threshold of the OAuthServer.
+      shards: int (optional) Number of independently locked shards.
+      max_nonces: int (optional) The maximum number of nonces kept.
+      clock: (optional) Function returning the current time in seconds.
+
+    """
+    self.threshold = threshold
+    self.max_nonces = max_nonces
+    self.clock = clock
+    self._shards = [_Shard() for i in range(shards)]
+    self._count = 0
+    self._count_lock = threading.Lock()
+
+  def check(self, consumer_key, token_key, nonce, timestamp):
+    try:
+      timestamp = int(timestamp)
+    except (TypeError, ValueError):
+      return False
+    now = int(self.clock())
+    if abs(now - timestamp) > self.threshold:
+      return False
+    # Buckets before this one only hold timestamps older than the threshold.
+    oldest = (now - self.threshold) // self.threshold
+    key = (consumer_key, token_key, nonce, timestamp)
+    shard = self._shards[hash(key) % len(self._shards)]
+    shard.lock.acquire()
+    try:
+      buckets = shard.buckets
+      if shard.oldest < oldest:
+        expired = 0
+        for index in buckets.keys():
+          if index < oldest:
+            expired += len(buckets.pop(index))
+        shard.oldest = oldest
+        if expired:
+          self._add_count(-expired)
+      bucket = buckets.get(timestamp // self.threshold)
+      if bucket is None:
+        bucket = buckets[timestamp // self.threshold] = set()
+      elif key in bucket:
+        return False
+      if not self._add_count(1):
+        return False
+      bucket.add(key)
+      return True
+    finally:
+      shard.lock.release()
+
+  def _add_count(self, delta):
+    """Adds delta to the number of nonces kept, unless that exceeds
+    max_nonces. Returns True if the count was changed.
+    """
+    self._count_lock.acquire()
+    try:
+      if self._count + delta > self.max_nonces:
+        return False
+      self._count += delta
+      return True
+    finally:
+      self._count_lock.release()
+
+  def __len__(self):
+    return self._count
+
+
+class NonceHandler(SocketServer.StreamRequestHandler):
+  """Answers nonce checks sent by a SocketNonceStore.
+
+  Each request is a line of four space-separated, %-escaped fields: consumer
+  key, token key (an unescaped "-" for none), nonce and timestamp. The response is a line
+  holding "1" if the nonce was fresh and "0" otherwise.
+
+  """
+
+  def handle(self):
+    while True:
+      line = self.rfile.readline()
+      if not line:
+        return
+      fields = line.split()
+      accepted = False
+      if len(fields) == 4:
+        consumer_key, token_key, nonce, timestamp = [
+            urllib.unquote(field) for field in fields]
+        if fields[1] == '-':
+          token_key = None
+        accepted = self.server.store.check(consumer_key, token_key, nonce,
+                                           timestamp)
+      self.wfile.write(accepted and '1\n' or '0\n')
+      self.wfile.flush()
+
+
+class NonceServer(object):
+  """Shares a MemoryNonceStore between processes over a local socket.
+
+  Pre-forked workers, or processes on other machines, check nonces through
+  a SocketNonceStore connected to the same server, so a nonce accepted by
+  one of them is rejected by all the others.
+
+  """
+
+  def __init__(self, address, store=None):
+    """Constructor for NonceServer.
+
+    Args:
+      address: The path of a Unix socket, or the (host, port) of a TCP
+          socket, to listen on.
+      store: NonceStore (optional) Where nonces are kept; by default a
+          MemoryNonceStore.
+
+    """
+    if isinstance(address, basestring):
+      if os.path.exists(address):
+        os.remove(address)
+      server_class = _UnixNonceServer
+    else:
+      server_class = _TcpNonceServer
+    self.server = server_class(address, NonceHandler)
+    if store is None:
+      store = MemoryNonceStore()
+    self.server.store = store
+    self.address = self.server.server_address
+    self._thread = None
+    self._serving = False
+
+  def serve_forever(self):
+    """Handles checks in this thread until shutdown is called."""
+    self._serving = True
+    self.server.serve_forever()
+
+  def start(self):
+    """Handles checks in a daemon thread."""
+    self._serving = True
+    self._thread = threading.Thread(target=self.serve_forever)
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+  def shutdown(self):
+    """Stops handling checks and closes the socket."""
+    # SocketServer's shutdown waits for serve_forever to return, forever if
+    # it was never called.
+    if self._serving:
+      self.server.shutdown()
+      self._serving = False
+    self.server.server_close()
+    if isinstance(self.address, basestring) and os.path.exists(self.address):
+      os.remove(self.address)
+
+
+class _UnixNonceServer(SocketServer.ThreadingMixIn,
+                       SocketServer.UnixStreamServer):
+  daemon_threads = True
+
+
+class _TcpNonceServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+class SocketNonceStore(NonceStore):
+  """Checks nonces against a NonceServer.
+
+  Each thread uses its own connection. If the server cannot be reached,
+  nonces are treated as replayed so that no request is accepted unchecked.
+
+  """
+
+  def __init__(self, address, timeout=1.0):
+    """Constructor for SocketNonceStore.
+
+    Args:
+      address: The Unix socket path, or (host, port), of the NonceServer.
+      timeout: float (optional) Socket timeout in seconds.
+
+    """
+    self.address = address
+    self.timeout = timeout
+    self._local = threading.local()
+
+  def check(self, consumer_key, token_key, nonce, timestamp):
+    fields = [urllib.quote(str(field), safe='').replace('-', '%2D')
+              for field in (consumer_key, token_key, nonce, timestamp)]
+    if token_key is None:
+      fields[1] = '-'
+    return self._call(' '.join(fields) + '\n') == '1'
+
+  def _call(self, request):
+    """Sends a check and returns the response line, or None on failure.
+
+    Checks are not idempotent: once a check may have reached the server, the
+    nonce may have been recorded and a second attempt would be answered as a
+    replay. A check is therefore only sent again when sending it on a
+    connection which had been used before failed.
+
+    """
+    for attempt in (0, 1):
+      connection, reused = self._get_connection()
+      if not connection:
+        return None
+      try:
+        connection.sendall(request)
+      except socket.error:
+        self._close_connection()
+        if reused:
+          continue
+        return None
+      try:
+        response = ''
+        while not response.endswith('\n'):
+          data = connection.recv(16)
+          if not data:
+            raise socket.error(errno.ECONNRESET, 'Connection closed')
+          response += data
+        return response.strip()
+      except socket.error:
+        self._close_connection()
+        return None
+    return None
+
+  def _get_connection(self):
+    """Returns a (connection, reused) tuple, or (None, False) on failure."""
+    connection = getattr(self._local, 'connection', None)
+    if connection:
+      # An idle connection only becomes readable when the server closes it.
+      if select.select([connection], [], [], 0)[0]:
+        self._close_connection()
+      else:
+        return connection, True
+    try:
+      if isinstance(self.address, basestring):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(self.timeout)
+        try:
+          connection.connect(self.address)
+        except socket.error:
+          connection.close()
+          raise
+      else:
+        connection = socket.create_connection(self.address, self.timeout)
+    except socket.error:
+      return None, False
+    self._local.connection = connection
+    return connection, False
+
+  def _close_connection(self):
+    connection = getattr(self._local, 'connection', None)
+    self._local.connection = None
+    if connection:
+      connection.close()
@@ -5,6 +5,10 @@ import random
 import urlparse
 import hmac
 import base64
+try:
+    from hashlib import sha1 # 2.5
+except ImportError:
+    import sha as sha1 # deprecated
 
 VERSION = '1.0' # Hi Blaine!
 HTTP_METHOD = 'GET'
@@ -19,10 +23,29 @@ class OAuthError(RuntimeError):
 def build_authenticate_header(realm=''):
     return {'WWW-Authenticate': 'OAuth realm="%s"' % realm}
 
+# number of escaped strings kept by escape(), and the longest string kept
+ESCAPE_CACHE_SIZE = 10000
+ESCAPE_CACHE_LENGTH = 256
+_escaped = {}
+
 # url escape
 def escape(s):
-    # escape '/' too
-    return urllib.quote(s, safe='~')
+    # escape '/' too; consumer keys, method names and the like repeat across
+    # requests, so results for short strings are memoized, keyed on the type
+    # too as equal str and unicode values do not escape to the same type
+    key = (type(s), s)
+    try:
+        return _escaped[key]
+    except KeyError:
+        pass
+    except TypeError:
+        return urllib.quote(s, safe='~')
+    if len(s) > ESCAPE_CACHE_LENGTH:
+        return urllib.quote(s, safe='~')
+    if len(_escaped) >= ESCAPE_CACHE_SIZE:
+        _escaped.clear()
+    escaped = _escaped[key] = urllib.quote(s, safe='~')
+    return escaped
 
 # util function: current timestamp
 # seconds since epoch (UTC)
@@ -96,6 +119,8 @@ class OAuthRequest(object):
         self.http_method = http_method
         self.http_url = http_url
         self.parameters = parameters or {}
+        # key -> (value, 'key=value' escaped) for get_escaped_pairs
+        self._escaped_pairs = {}
 
     def set_parameter(self, parameter, value):
         self.parameters[parameter] = value
@@ -129,7 +154,7 @@ class OAuthRequest(object):
 
     # serialize as post data for a POST request
     def to_postdata(self):
-        return '&'.join('%s=%s' % (escape(str(k)), escape(str(v))) for k, v in self.parameters.iteritems())
+        return '&'.join(pair for k, pair in self.get_escaped_pairs())
 
     # serialize as a url for a GET request
     def to_url(self):
@@ -137,17 +162,23 @@ class OAuthRequest(object):
 
     # return a string that consists of all the parameters that need to be signed
     def get_normalized_parameters(self):
-        params = self.parameters
-        try:
-            # exclude the signature if it exists
-            del params['oauth_signature']
-        except:
-            pass
-        key_values = params.items()
-        # sort lexicographically, first after key, then after value
+        # exclude the signature if it exists, leaving the parameters as they are
+        return '&'.join(pair for k, pair in self.get_escaped_pairs() if k != 'oauth_signature')
+
+    # (key, 'key=value') tuples of all the parameters, escaped and sorted
+    # lexicographically, first after key, then after value; shared by signing
+    # and serialization, and only pairs whose value changed are escaped again
+    def get_escaped_pairs(self):
+        key_values = self.parameters.items()
         key_values.sort()
-        # combine key value pairs in string and escape
-        return '&'.join('%s=%s' % (escape(str(k)), escape(str(v))) for k, v in key_values)
+        cache = self._escaped_pairs
+        pairs = []
+        for k, v in key_values:
+            entry = cache.get(k)
+            if entry is None or entry[0] is not v and (type(entry[0]) is not type(v) or entry[0] != v):
+                entry = cache[k] = (v, '%s=%s' % (escape(str(k)), escape(str(v))))
+            pairs.append((k, entry[1]))
+        return pairs
 
     # just uppercases the http method
     def get_normalized_http_method(self):
@@ -375,7 +406,7 @@ class OAuthServer(object):
     def _check_signature(self, oauth_request, consumer, token):
         timestamp, nonce = oauth_request._get_timestamp_nonce()
         self._check_timestamp(timestamp)
-        self._check_nonce(consumer, token, nonce)
+        self._check_nonce(consumer, token, nonce, timestamp)
         signature_method = self._get_signature_method(oauth_request)
         try:
             signature = oauth_request.get_parameter('oauth_signature')
@@ -396,9 +427,9 @@ class OAuthServer(object):
         if lapsed > self.timestamp_threshold:
             raise OAuthError('Expired timestamp: given %d and now %s has a greater difference than threshold %d' % (timestamp, now, self.timestamp_threshold))
 
-    def _check_nonce(self, consumer, token, nonce):
+    def _check_nonce(self, consumer, token, nonce, timestamp):
         # verify that the nonce is uniqueish
-        nonce = self.data_store.lookup_nonce(consumer, token, nonce)
+        nonce = self.data_store.lookup_nonce(consumer, token, nonce, timestamp)
         if nonce:
             raise OAuthError('Nonce already used: %s' % str(nonce))
 
@@ -441,7 +472,8 @@ class OAuthDataStore(object):
         raise NotImplementedError
 
     def lookup_nonce(self, oauth_consumer, oauth_token, nonce, timestamp):
-        # -> OAuthToken
+        # -> the nonce if already used, else None; opensocial.nonce has
+        # NonceStore implementations of this
         raise NotImplementedError
 
     def fetch_request_token(self, oauth_consumer):
@@ -476,33 +508,48 @@ class OAuthSignatureMethod(object):
 
 class OAuthSignatureMethod_HMAC_SHA1(OAuthSignatureMethod):
 
+    # number of consumer/token secrets whose keyed HMAC state is kept
+    max_keys = 100
+
+    def __init__(self):
+        self._keyed = {}
+
     def get_name(self):
         return 'HMAC-SHA1'
         
     def build_signature_base_string(self, oauth_request, consumer, token):
+        key = '%s&' % escape(consumer.secret)
+        if token:
+            key += escape(token.secret)
+        return key, self._build_raw(oauth_request)
+
+    def _build_raw(self, oauth_request):
         sig = (
             escape(oauth_request.get_normalized_http_method()),
             escape(oauth_request.get_normalized_http_url()),
             escape(oauth_request.get_normalized_parameters()),
         )
-
-        key = '%s&' % escape(consumer.secret)
-        if token:
-            key += escape(token.secret)
-        raw = '&'.join(sig)
-        return key, raw
+        return '&'.join(sig)
+
+    def get_keyed_hmac(self, consumer, token):
+        # hmac object which has already digested the key for these secrets;
+        # copy() it rather than updating it
+        secrets = (consumer.secret, token and token.secret)
+        keyed = self._keyed.get(secrets)
+        if keyed is None:
+            key = '%s&' % escape(consumer.secret)
+            if token:
+                key += escape(token.secret)
+            keyed = hmac.new(key, digestmod=sha1)
+            if len(self._keyed) >= self.max_keys:
+                self._keyed.clear()
+            self._keyed[secrets] = keyed
+        return keyed
 
     def build_signature(self, oauth_request, consumer, token):
-        # build the base signature string
-        key, raw = self.build_signature_base_string(oauth_request, consumer, token)
-
-        # hmac object
-        try:
-            import hashlib # 2.5
-            hashed = hmac.new(key, raw, hashlib.sha1)
-        except:
-            import sha # deprecated
-            hashed = hmac.new(key, raw, sha)
+        # hmac object, starting from the precomputed key state
+        hashed = self.get_keyed_hmac(consumer, token).copy()
+        hashed.update(self._build_raw(oauth_request))
 
         # calculate the digest base 64
         return base64.b64encode(hashed.digest())
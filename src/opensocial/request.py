@@ -20,14 +20,17 @@ __author__ = 'davidbyttow@google.com (David Byttow)'
 
 import hashlib
 import random
+import sys
+import threading
 import time
 import urlparse
 from types import ListType
 
+import codec
 import data
+import errors
 import http
-
-from opensocial import simplejson
+import workers
 
 
 def generate_uuid(*args):
@@ -51,6 +54,7 @@ class Request(object):
   def __init__(self, rest_request, rpc_request, requestor=None):
     self.rest_request = rest_request
     self.rpc_request = rpc_request
+    self.object_types = None
     self.set_requestor(requestor)
     
   def get_requestor(self):
@@ -96,6 +100,44 @@ class Request(object):
   def get_rpc_body(self):
     return self.rpc_request.get_rpc_body()
 
+  def set_object_types(self, object_types):
+    """Sets the classes used to build the objects returned for this request.
+    
+    Args:
+      object_types: dict Maps data classes, e.g. data.Person, to the classes
+          to use in their place, e.g. data.CompactPerson.
+
+    """
+    self.object_types = object_types
+
+  def get_object_type(self, cls):
+    """Returns the class to use in place of the data class cls."""
+    if self.object_types:
+      return self.object_types.get(cls, cls)
+    return cls
+
+  def get_cache_key(self, use_rest=False):
+    """Returns the key under which the response to this request is cached.
+    
+    Args:
+      use_rest: bool (optional) If True, the key for the REST protocol.
+
+    Returns: A (service, key) tuple, or None if this request modifies data
+        and must not be cached.
+
+    """
+    if use_rest:
+      request_info = self.rest_request
+    else:
+      request_info = self.rpc_request
+    if not request_info:
+      return None
+    cache_key = request_info.get_cache_key()
+    if not cache_key:
+      return None
+    service, key = cache_key
+    return service, '%s %s' % (key, self.get_requestor() or '')
+
 
 class FetchSupportedFields(Request):
     """A request class for fetching supported fields. """
@@ -155,9 +197,10 @@ class FetchAlbumRequest(Request):
         
         if json_list != None:
             """ this is  individual album """
-            return data.Album(json_list)
+            return self.get_object_type(data.Album)(json_list)
         
-        return data.Collection.parse_json(json, data.Album )
+        return data.Collection.parse_json(json,
+                                        self.get_object_type(data.Album))
     
     
 class FetchMediaItemsRequest(Request):
@@ -184,9 +227,10 @@ class FetchMediaItemsRequest(Request):
         
         if json_list != None:
             """ this is  individual album """
-            return data.MediaItem(json_list)
+            return self.get_object_type(data.MediaItem)(json_list)
         
-        return data.Collection.parse_json(json, data.MediaItem )
+        return data.Collection.parse_json(
+            json, self.get_object_type(data.MediaItem))
     
     
 class FetchStatusMoodRequest(Request):
@@ -272,7 +316,8 @@ class FetchPeopleRequest(Request):
     Returns: a Collection of Person objects.
 
     """
-    return data.Collection.parse_json(json, data.Person)
+    collection_type = self.get_object_type(data.Collection)
+    return collection_type.parse_json(json, self.get_object_type(data.Person))
 
     
 class FetchPersonRequest(FetchPeopleRequest):
@@ -293,7 +338,7 @@ class FetchPersonRequest(FetchPeopleRequest):
     Returns: A Person object.
 
     """
-    return data.Person.parse_json(json)
+    return self.get_object_type(data.Person).parse_json(json)
 
 
 class FetchAppDataRequest(Request):
@@ -462,7 +507,8 @@ class FetchActivityRequest(Request):
                                               user_id)
   
   def process_json(self, json):
-    return data.Collection.parse_json(json, data.Activity)
+    return data.Collection.parse_json(json,
+                                      self.get_object_type(data.Activity))
 
 
 class RestRequestInfo(object):
@@ -493,6 +539,15 @@ class RestRequestInfo(object):
 
     return http.Request(url, method=self.method, signed_params=self.params, post_body=self.body, add_bodyhash=self.body_hash)
 
+  def get_cache_key(self):
+    """Returns a (service, key) tuple for GET requests, otherwise None."""
+    if self.method != 'GET':
+      return None
+    service = self.path.strip('/').split('/')[0]
+    return service, 'rest:%s?%s' % (self.path,
+                                    codec.dumps(self.params,
+                                                     sort_keys=True))
+
 class TextRpcRequest(Request):
   """ Represents an RPC request which is not configured with parameters, but
   a raw text blob.  Intended for debugging or developer tools."""
@@ -501,7 +556,11 @@ class TextRpcRequest(Request):
     self.set_requestor(requestor)
 
   def get_rpc_body(self):
-    return simplejson.loads(self.__rpc_body)
+    return codec.loads(self.__rpc_body)
+
+  def get_cache_key(self, use_rest=False):
+    """Raw RPC requests are never cached."""
+    return None
 
   def get_requestor(self):
     """Get the requestor id for this request.
@@ -551,6 +610,15 @@ class RpcRequestInfo(object):
     }
     return rpc_body
 
+  def get_cache_key(self):
+    """Returns a (service, key) tuple for *.get methods, otherwise None."""
+    service, sep, operation = self.method.partition('.')
+    if operation != 'get':
+      return None
+    return service, 'rpc:%s:%s' % (self.method,
+                                   codec.dumps(self.params,
+                                                    sort_keys=True))
+
 
 class RequestBatch(object):
   """This class will manage the batching of requests."""
@@ -586,8 +654,211 @@ class RequestBatch(object):
     Args:
       container: The container to execute this batch on.
 
+    Returns: Whatever the container's send_request_batch returns, i.e. a
+        pending result for an AsyncContainerContext.
+
     """
-    container.send_request_batch(self, False)
+    return container.send_request_batch(self, False)
 
   def _set_data(self, key, data):
     self.data[key] = data
+
+
+class AutoBatcher(object):
+  """Collects requests sent separately into shared RPC batches.
+  
+  The first request sent waits up to window seconds, or until max_requests
+  requests are pending, for requests sent from other threads, then sends all
+  of them as one RequestBatch and hands each thread its own result. This
+  turns many concurrent send_request calls into a single round trip.
+
+  """
+
+  def __init__(self, container, window=0.002, max_requests=50):
+    """Constructor for AutoBatcher.
+    
+    Args:
+      container: The ContainerContext to send the batches with.
+      window: float (optional) Seconds to wait for more requests.
+      max_requests: int (optional) Number of pending requests which causes
+          the batch to be sent before the window has passed.
+
+    """
+    self.container = container
+    self.window = window
+    self.max_requests = max_requests
+    self.batches_sent = 0
+    self.requests_sent = 0
+    self._lock = threading.Lock()
+    self._pending = []
+    self._full = None
+
+  def send(self, request):
+    """Sends the request as part of the next batch.
+    
+    May throw the same exceptions as ContainerContext.send_request.
+
+    Args:
+      request: A Request object which supports RPC.
+
+    Returns: The OpenSocial object returned from the container.
+
+    """
+    future = workers.Future()
+    self._lock.acquire()
+    self._pending.append((request, future))
+    leader = len(self._pending) == 1
+    if leader:
+      full = self._full = threading.Event()
+    elif len(self._pending) >= self.max_requests:
+      self._full.set()
+    self._lock.release()
+
+    if leader:
+      full.wait(self.window)
+      self._send_pending()
+    return future.get_result()
+
+  def _send_pending(self):
+    self._lock.acquire()
+    pending, self._pending = self._pending, []
+    self.batches_sent += 1
+    self.requests_sent += len(pending)
+    self._lock.release()
+
+    batch = RequestBatch()
+    for key, (request, future) in enumerate(pending):
+      batch.add_request(key + 1, request)
+    try:
+      self.container._send_rpc_requests(batch)
+    except:
+      exc_info = sys.exc_info()
+      for request, future in pending:
+        future.set_exception(exc_info)
+      return
+
+    for key, (request, future) in enumerate(pending):
+      response = batch.get(key + 1)
+      if isinstance(response, errors.Error):
+        future.set_exception((type(response), response, None))
+      else:
+        future.set_result(response)
+
+
+
+class PageIterator(object):
+  """Iterates over the items of a collection, one page request at a time.
+  
+  Items are yielded as soon as their page arrives. While the caller consumes
+  a page, the request for the next one is already in flight on a thread of
+  its own. It does not use the container's worker pool, since sending a
+  batch may need every worker of that pool. Once totalResults is known,
+  pages_per_batch pages at a time are requested in a single RequestBatch.
+
+  startIndex and totalResults hold the values returned with the first page.
+
+  """
+
+  def __init__(self, container, make_request, page_size=100,
+               start_index=0, pages_per_batch=1):
+    """Constructor for PageIterator.
+    
+    Args:
+      container: The ContainerContext to send the requests with.
+      make_request: callable Returns the Request for a page, given the
+          startIndex and count params to send.
+      page_size: int (optional) Number of items requested per page.
+      start_index: int (optional) Index of the first item.
+      pages_per_batch: int (optional) Number of pages requested together
+          once the size of the collection is known.
+
+    """
+    self.container = container
+    self.make_request = make_request
+    self.page_size = page_size
+    self.pages_per_batch = max(1, pages_per_batch)
+    self.startIndex = start_index
+    self.totalResults = None
+    self.pages_fetched = 0
+
+  def __iter__(self):
+    start = self.startIndex
+    pending = self._prefetch([start])
+    while pending:
+      starts, future = pending
+      pages = future.get_result()
+      if self.totalResults is None:
+        self.totalResults = pages[0].totalResults
+        if pages[0].startIndex is not None:
+          self.startIndex = pages[0].startIndex
+      self.pages_fetched += len(pages)
+
+      # A page is only used if it starts where the one before it ended: the
+      # pages requested after a short page leave a gap and are requested
+      # again.
+      start = starts[0]
+      usable = []
+      done = False
+      for page_start, page in zip(starts, pages):
+        if page_start != start:
+          break
+        usable.append(page)
+        start += len(page)
+        if not page or (
+            self.totalResults is None and len(page) < self.page_size):
+          done = True
+          break
+        if self.totalResults is not None:
+          if start >= self.totalResults:
+            done = True
+            break
+          # Some containers return fewer items than asked for; later pages
+          # are requested with the size they actually use.
+          if len(page) < self.page_size:
+            self.page_size = len(page)
+
+      pending = None
+      if not done:
+        pending = self._prefetch(self._next_starts(start))
+      for page in usable:
+        for item in page:
+          yield item
+
+  def _next_starts(self, start):
+    """Returns the start indexes of the next pages to request together."""
+    if self.totalResults is None:
+      return [start]
+    starts = []
+    while len(starts) < self.pages_per_batch and start < self.totalResults:
+      starts.append(start)
+      start += self.page_size
+    return starts
+
+  def _prefetch(self, starts):
+    return starts, workers.spawn(self._fetch_pages, starts)
+
+  def _fetch_pages(self, starts):
+    """Sends the requests for the pages at starts and returns the pages."""
+    if len(starts) == 1:
+      return [self._get_result(self.container.send_request(
+          self.make_request(starts[0], self.page_size)))]
+
+    batch = RequestBatch()
+    for start in starts:
+      batch.add_request('page-%d' % start,
+                        self.make_request(start, self.page_size))
+    self._get_result(batch.send(self.container))
+    pages = []
+    for start in starts:
+      page = batch.get('page-%d' % start)
+      if isinstance(page, errors.Error):
+        raise page
+      pages.append(page)
+    return pages
+
+  def _get_result(self, result):
+    """Waits for the result of an AsyncContainerContext, if need be."""
+    get_result = getattr(result, 'get_result', None)
+    if get_result:
+      return get_result()
+    return result
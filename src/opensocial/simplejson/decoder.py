@@ -187,6 +187,153 @@ def JSONArray(match, context, _w=WHITESPACE.match):
     return values, end
 pattern(r'\[')(JSONArray)
  
+# A decode loop which dispatches on the next character instead of running
+# the compound Scanner regex and its callbacks for every value. It produces
+# the same values and errors as JSONScanner.
+
+NUMBER_RE = JSONNumber.regex
+WHITESPACE_CHARS = ' \t\n\r\x0b\x0c'
+
+def fast_scanstring(s, end, encoding=None):
+    """
+    Like scanstring, but strings without escapes are sliced out directly
+    rather than matched chunk by chunk.
+    """
+    terminator = s.find('"', end)
+    if terminator != -1 and s.find('\\', end, terminator) == -1:
+        content = s[end:terminator]
+        if not isinstance(content, unicode):
+            content = unicode(content, encoding or DEFAULT_ENCODING)
+        return content, terminator + 1
+    return scanstring(s, end, encoding)
+
+def make_scan_once(context):
+    """
+    Returns a function which decodes the value starting at an index of a
+    string and returns it with the index where it ended, or raises
+    StopIteration if no value starts there.
+    """
+    encoding = getattr(context, 'encoding', None) or DEFAULT_ENCODING
+    object_hook = getattr(context, 'object_hook', None)
+    match_number = NUMBER_RE.match
+    skip = WHITESPACE.match
+    ws = WHITESPACE_CHARS
+
+    def parse_object(s, end):
+        pairs = {}
+        nextchar = s[end:end + 1]
+        if nextchar and nextchar in ws:
+            end = skip(s, end).end()
+            nextchar = s[end:end + 1]
+        # trivial empty object
+        if nextchar == '}':
+            if object_hook is not None:
+                pairs = object_hook(pairs)
+            return pairs, end + 1
+        if nextchar != '"':
+            raise ValueError(errmsg("Expecting property name", s, end))
+        end += 1
+        while True:
+            key, end = fast_scanstring(s, end, encoding)
+            if s[end:end + 1] != ':':
+                end = skip(s, end).end()
+                if s[end:end + 1] != ':':
+                    raise ValueError(errmsg("Expecting : delimiter", s, end))
+            end += 1
+            nextchar = s[end:end + 1]
+            if nextchar and nextchar in ws:
+                end = skip(s, end).end()
+            try:
+                value, end = scan_once(s, end)
+            except StopIteration:
+                raise ValueError(errmsg("Expecting object", s, end))
+            pairs[key] = value
+            nextchar = s[end:end + 1]
+            if nextchar and nextchar in ws:
+                end = skip(s, end).end()
+                nextchar = s[end:end + 1]
+            end += 1
+            if nextchar == '}':
+                break
+            if nextchar != ',':
+                raise ValueError(errmsg("Expecting , delimiter", s, end - 1))
+            nextchar = s[end:end + 1]
+            if nextchar and nextchar in ws:
+                end = skip(s, end).end()
+                nextchar = s[end:end + 1]
+            end += 1
+            if nextchar != '"':
+                raise ValueError(
+                    errmsg("Expecting property name", s, end - 1))
+        if object_hook is not None:
+            pairs = object_hook(pairs)
+        return pairs, end
+
+    def parse_array(s, end):
+        values = []
+        nextchar = s[end:end + 1]
+        if nextchar and nextchar in ws:
+            end = skip(s, end).end()
+            nextchar = s[end:end + 1]
+        # look-ahead for trivial empty array
+        if nextchar == ']':
+            return values, end + 1
+        append = values.append
+        while True:
+            try:
+                value, end = scan_once(s, end)
+            except StopIteration:
+                raise ValueError(errmsg("Expecting object", s, end))
+            append(value)
+            nextchar = s[end:end + 1]
+            if nextchar and nextchar in ws:
+                end = skip(s, end).end()
+                nextchar = s[end:end + 1]
+            end += 1
+            if nextchar == ']':
+                break
+            if nextchar != ',':
+                raise ValueError(errmsg("Expecting , delimiter", s, end))
+            nextchar = s[end:end + 1]
+            if nextchar and nextchar in ws:
+                end = skip(s, end).end()
+        return values, end
+
+    def scan_once(s, idx):
+        try:
+            nextchar = s[idx]
+        except IndexError:
+            raise StopIteration
+        if nextchar == '"':
+            return fast_scanstring(s, idx + 1, encoding)
+        elif nextchar == '{':
+            return parse_object(s, idx + 1)
+        elif nextchar == '[':
+            return parse_array(s, idx + 1)
+        elif nextchar == 'n' and s[idx:idx + 4] == 'null':
+            return None, idx + 4
+        elif nextchar == 't' and s[idx:idx + 4] == 'true':
+            return True, idx + 4
+        elif nextchar == 'f' and s[idx:idx + 5] == 'false':
+            return False, idx + 5
+        m = match_number(s, idx)
+        if m is not None:
+            integer, frac, exp = m.groups()
+            if frac or exp:
+                res = float(integer + (frac or '') + (exp or ''))
+            else:
+                res = int(integer)
+            return res, m.end()
+        elif nextchar == 'N' and s[idx:idx + 3] == 'NaN':
+            return NaN, idx + 3
+        elif nextchar == 'I' and s[idx:idx + 8] == 'Infinity':
+            return PosInf, idx + 8
+        elif nextchar == '-' and s[idx:idx + 9] == '-Infinity':
+            return NegInf, idx + 9
+        raise StopIteration
+
+    return scan_once
+
 ANYTHING = [
     JSONObject,
     JSONArray,
@@ -246,6 +393,7 @@ class JSONDecoder(object):
         """
         self.encoding = encoding
         self.object_hook = object_hook
+        self.scan_once = make_scan_once(self)
 
     def decode(self, s, _w=WHITESPACE.match):
         """
@@ -267,9 +415,11 @@ class JSONDecoder(object):
         This can be used to decode a JSON document from a string that may
         have extraneous data at the end.
         """
-        kw.setdefault('context', self)
         try:
-            obj, end = self._scanner.iterscan(s, **kw).next()
+            if kw.get('context', self) is self:
+                obj, end = self.scan_once(s, kw.get('idx', 0))
+            else:
+                obj, end = self._scanner.iterscan(s, **kw).next()
         except StopIteration:
             raise ValueError("No JSON object could be decoded")
         return obj, end
@@ -64,6 +64,98 @@ def encode_basestring_ascii(s):
     return '"' + str(ESCAPE_ASCII.sub(replace, s)) + '"'
         
 
+def encode_fast(o, allow_nan=True):
+    """
+    Return the same string as JSONEncoder().encode(o) for plain data: dicts,
+    lists, tuples, strings, numbers, booleans and None.
+
+    The value is encoded in a single recursive pass into one list of chunks,
+    without generators and without the circular reference check, so it must
+    not contain circular references (encoding one exceeds the maximum
+    recursion depth).  Other types raise ``TypeError``.
+    """
+    chunks = []
+    _encode_fast(o, chunks.append, allow_nan)
+    return ''.join(chunks)
+
+def _encode_string(s, _search=ESCAPE_ASCII.search):
+    # Most strings need no escaping, which a single search tells.
+    if _search(s) is None:
+        return '"' + str(s) + '"'
+    return encode_basestring_ascii(s)
+
+def _encode_fast(o, append, allow_nan):
+    # Exact types are tested first as they are the common case; subclasses
+    # fall through to the same isinstance checks as JSONEncoder._iterencode.
+    t = type(o)
+    if t is str or t is unicode:
+        append(_encode_string(o))
+    elif t is dict:
+        _encode_fast_dict(o, append, allow_nan)
+    elif t is list:
+        _encode_fast_list(o, append, allow_nan)
+    elif isinstance(o, (str, unicode)):
+        append(_encode_string(o))
+    elif o is None:
+        append('null')
+    elif o is True:
+        append('true')
+    elif o is False:
+        append('false')
+    elif isinstance(o, (int, long)):
+        append(str(o))
+    elif isinstance(o, float):
+        append(floatstr(o, allow_nan))
+    elif isinstance(o, (list, tuple)):
+        _encode_fast_list(o, append, allow_nan)
+    elif isinstance(o, dict):
+        _encode_fast_dict(o, append, allow_nan)
+    else:
+        raise TypeError("%r is not JSON serializable" % (o,))
+
+def _encode_fast_list(lst, append, allow_nan):
+    if not lst:
+        append('[]')
+        return
+    append('[')
+    first = True
+    for value in lst:
+        if first:
+            first = False
+        else:
+            append(', ')
+        _encode_fast(value, append, allow_nan)
+    append(']')
+
+def _encode_fast_dict(dct, append, allow_nan):
+    if not dct:
+        append('{}')
+        return
+    append('{')
+    first = True
+    for key, value in dct.iteritems():
+        if isinstance(key, (str, unicode)):
+            pass
+        elif isinstance(key, float):
+            key = floatstr(key, allow_nan)
+        elif isinstance(key, (int, long)):
+            key = str(key)
+        elif key is None:
+            key = 'null'
+        else:
+            raise TypeError("key %r is not a string" % (key,))
+        if first:
+            append(_encode_string(key) + ': ')
+            first = False
+        else:
+            append(', ' + _encode_string(key) + ': ')
+        t = type(value)
+        if t is str or t is unicode:
+            append(_encode_string(value))
+        else:
+            _encode_fast(value, append, allow_nan)
+    append('}')
+
 class JSONEncoder(object):
     """
     Extensible JSON <http://json.org> encoder for Python data structures.
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Columnar storage of people collections for bulk processing."""
+
+
+import array
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+import data
+
+
+__all__ = ['FriendTable']
+
+
+class FriendTable(object):
+  """A collection of people stored as one list per field.
+
+  Only the fields named in columns are kept. Equal strings, e.g. a default
+  thumbnail URL, are stored once per table. Numeric ids are packed in an
+  array rather than held as separate string objects.
+
+  A FriendTable can replace Collection for people requests through
+  ContainerContext.set_object_types({Collection: FriendTable}). It behaves
+  like a read-only Collection whose items are built on access, and adds
+  filter, select and join_by_id operations which work on whole columns.
+
+  """
+
+  COLUMNS = ('id', 'displayName', 'thumbnailUrl')
+
+  def __init__(self, columns, start=None, total=None, cls=data.Person):
+    """Constructor for FriendTable.
+
+    Args:
+      columns: dict Maps field names to lists of values, one per person.
+      start: int (optional) The startIndex of the collection.
+      total: int (optional) The totalResults of the collection.
+      cls: (optional) The OpenSocial data type built for each row.
+
+    """
+    self.columns = columns
+    self.startIndex = start
+    self.totalResults = total
+    self.cls = cls
+    self._index = None
+
+  @staticmethod
+  def parse_json(json, cls=data.Person, columns=None):
+    """Creates a table from a JSON object returned by an OpenSocial container.
+
+    Args:
+      json: dict The JSON object.
+      cls: (optional) The OpenSocial data type built for each row.
+      columns: tuple (optional) The fields to keep, by default COLUMNS.
+
+    Returns: A FriendTable.
+
+    """
+    entries = json.get('entry') or json.get('list') or []
+    return FriendTable.from_entries(entries, columns, json.get('startIndex'),
+                                    json.get('totalResults'), cls)
+
+  @staticmethod
+  def from_entries(entries, columns=None, start=None, total=None,
+                   cls=data.Person):
+    """Creates a table from a list of JSON dicts of fields."""
+    columns = columns or FriendTable.COLUMNS
+    strings = {}
+    values = dict((name, []) for name in columns)
+    for fields in entries:
+      fields = fields.get('person') or fields
+      for name in columns:
+        value = fields.get(name)
+        if isinstance(value, basestring):
+          value = strings.setdefault(value, value)
+        values[name].append(value)
+    if 'id' in values:
+      values['id'] = _pack_ids(values['id'])
+    return FriendTable(values, start, total, cls)
+
+  def __len__(self):
+    if not self.columns:
+      return 0
+    return len(self.columns.itervalues().next())
+
+  def get_column(self, name):
+    """Returns the values of a field as a list, one per row."""
+    values = self.columns[name]
+    if isinstance(values, array.array):
+      return [str(value) for value in values]
+    return values
+
+  def get_array(self, name):
+    """Returns the values of a field as a numpy array, if numpy is installed.
+
+    Numeric ids are returned as an integer array. Without numpy, the values
+    are returned as a list.
+
+    """
+    values = self.columns[name]
+    if numpy is None:
+      return list(values)
+    if isinstance(values, array.array):
+      return numpy.frombuffer(values, dtype=numpy.int_)
+    return numpy.array(values, dtype=object)
+
+  def get_row(self, row):
+    """Returns the fields of a row as a dict, leaving out missing fields."""
+    fields = {}
+    for name in self.columns:
+      value = self.columns[name][row]
+      if value is not None:
+        fields[name] = value
+    if 'id' in fields and isinstance(self.columns['id'], array.array):
+      fields['id'] = str(fields['id'])
+    return fields
+
+  def __getitem__(self, row):
+    return self.cls(self.get_row(row))
+
+  def __iter__(self):
+    for row in xrange(len(self)):
+      yield self[row]
+
+  def to_people(self):
+    """Returns the rows as a Collection of OpenSocial objects."""
+    return data.Collection(list(self), self.startIndex, self.totalResults)
+
+  def index_of(self, id):
+    """Returns the row of the person with the given id, or None."""
+    if self._index is None:
+      index = {}
+      for row, value in enumerate(self.get_column('id')):
+        index.setdefault(value, row)
+      self._index = index
+    return self._index.get(id)
+
+  def take(self, rows):
+    """Returns a table of the given rows, in the given order."""
+    columns = {}
+    for name, values in self.columns.iteritems():
+      if isinstance(values, array.array):
+        columns[name] = array.array(values.typecode,
+                                    [values[row] for row in rows])
+      else:
+        columns[name] = [values[row] for row in rows]
+    return FriendTable(columns, self.startIndex, self.totalResults, self.cls)
+
+  def filter(self, predicate, column='id'):
+    """Returns a table of the rows which match.
+
+    Args:
+      predicate: Either a sequence of booleans, such as a numpy array, with
+          one value per row, or a callable which is given the value of column
+          for each row.
+      column: str (optional) The field passed to a callable predicate,
+          'id' by default.
+
+    Returns: A FriendTable.
+
+    """
+    if callable(predicate):
+      mask = [predicate(value) for value in self.get_column(column)]
+    else:
+      mask = predicate
+    if numpy is not None and isinstance(mask, numpy.ndarray):
+      return self.take(numpy.flatnonzero(mask).tolist())
+    return self.take([row for row, keep in enumerate(mask) if keep])
+
+  def select(self, *names):
+    """Returns a table holding only the given fields."""
+    columns = dict((name, self.columns[name]) for name in names)
+    return FriendTable(columns, self.startIndex, self.totalResults, self.cls)
+
+  def join_by_id(self, other):
+    """Joins the rows of this table with the rows of another by id.
+
+    Only people found in both tables are kept, in the order of this table.
+    Fields of other which this table does not have are added.
+
+    Args:
+      other: FriendTable The table to join with.
+
+    Returns: A FriendTable.
+
+    """
+    rows = []
+    other_rows = []
+    for row, id in enumerate(self.get_column('id')):
+      other_row = other.index_of(id)
+      if other_row is not None:
+        rows.append(row)
+        other_rows.append(other_row)
+    table = self.take(rows)
+    added = other.select(*[name for name in other.columns
+                           if name not in self.columns]).take(other_rows)
+    table.columns.update(added.columns)
+    return table
+
+
+def _pack_ids(ids):
+  """Packs a list of ids into an array if they are all canonical integers."""
+  try:
+    packed = array.array('l', [int(id) for id in ids])
+  except (TypeError, ValueError, OverflowError):
+    return ids
+  for id, value in zip(ids, packed):
+    if str(value) != id:
+      return ids
+  return packed
@@ -16,16 +16,22 @@
 
 __author__ = 'api.kurrik@google.com (Arne Roomann-Kurrik)'
 
+import atexit
 import base64
 import hashlib
 import urllib
+import urlparse
 import oauth
 import hmac
 import logging
+import os
+import re
 
 from opensocial.Crypto.PublicKey import RSA
 from opensocial.Crypto.Util import number
 
+import cache
+
 class RequestValidator(object):
   def get_signature_base_string(self, method, url, params):
     """
@@ -39,21 +45,21 @@ class RequestValidator(object):
       
     Returns: string A signature base string as defined by the OAuth spec.
     """
-    encoded_params = {}
-    for key, value in params.items():
-      encoded_params[key] = value.encode('utf-8', 'ignore')
-
-    oauth_request = oauth.OAuthRequest(
-        http_method=method.upper(), 
-        http_url=url, 
-        parameters=encoded_params)
-
-    base_str = '&'.join((
-        oauth.escape(oauth_request.get_normalized_http_method()),
-        oauth.escape(oauth_request.get_normalized_http_url()),
-        oauth.escape(oauth_request.get_normalized_parameters())))
+    # Same result as building an oauth.OAuthRequest and normalizing it, without
+    # the intermediate request; escaped strings are memoized by oauth.escape.
+    escape = oauth.escape
+    pairs = []
+    for key, value in params.iteritems():
+      if key != 'oauth_signature':
+        pairs.append((key, value.encode('utf-8', 'ignore')))
+    pairs.sort()
+    normalized_params = '&'.join(['%s=%s' % (escape(str(key)), escape(value))
+                                  for key, value in pairs])
+    parts = urlparse.urlparse(url)
+    normalized_url = '%s://%s%s' % (parts[0], parts[1], parts[2])
 
-    return base_str
+    return '&'.join((escape(method.upper()), escape(normalized_url),
+                     escape(normalized_params)))
     
   def validate(self, method, url, params):
     """
@@ -69,9 +75,24 @@ class RequestValidator(object):
     """
     raise NotImplementedError('RequestValidator must be subclassed.')
 
+  def validate_many(self, requests):
+    """
+    Determines the validity of a batch of OAuth-signed HTTP requests.
+
+    Args:
+      requests: list (method, url, params) tuples, with the arguments of
+          validate for each request.
+
+    Returns: list bool True for each request which validated, False otherwise,
+        in the same order as requests.
+    """
+    return [self.validate(method, url, params)
+            for method, url, params in requests]
+
 
 class RsaSha1Validator(RequestValidator):
-  def __init__(self, public_key_str, exponent=65537):
+  def __init__(self, public_key_str=None, exponent=65537, processes=None,
+               public_key=None):
     """
     Creates a validator based off of the RSA-SHA1 signing mechanism.
     
@@ -90,9 +111,18 @@ class RsaSha1Validator(RequestValidator):
           A list of such values can be found at 
           https://opensocialresources.appspot.com/certificates/
       exponent: int The RSA public key exponent.
+      processes: int (optional) Number of worker processes used by
+          validate_many for the RSA operations.  By default they are done in
+          this process.
+      public_key: (optional) An RSA key object, e.g. from a PublicKeyRing,
+          used instead of parsing public_key_str.
     """
-    public_key_long = long(public_key_str, 16)
-    self.public_key = RSA.construct((public_key_long, exponent))
+    if public_key is None:
+      public_key_long = long(public_key_str, 16)
+      public_key = RSA.construct((public_key_long, exponent))
+    self.public_key = public_key
+    self.processes = processes
+    self._pool = None
   
   def validate(self, method, url, params):
     """
@@ -121,6 +151,74 @@ class RsaSha1Validator(RequestValidator):
       
     return local_hash == remote_hash
 
+  def validate_many(self, requests):
+    """
+    Determines the validity of a batch of OAuth-signed HTTP requests.
+
+    Base strings are built and hashed in this process.  The RSA operations,
+    which take most of the time, are spread over a pool of worker processes
+    if processes was given, so a batch can use every core.
+
+    Args:
+      requests: list (method, url, params) tuples, with the arguments of
+          validate for each request.
+
+    Returns: list bool True for each request which validated, False otherwise,
+        in the same order as requests.
+    """
+    local_hashes = []
+    work = []
+    key = (self.public_key.n, self.public_key.e)
+    for method, url, params in requests:
+      local_hashes.append(hashlib.sha1(
+          self.get_signature_base_string(method, url, params)).digest())
+      try:
+        encoded_remote_signature = urllib.unquote(params["oauth_signature"])
+        work.append((key, base64.decodestring(encoded_remote_signature)))
+      except:
+        work.append(None)
+
+    if self.processes > 1 and len(work) > 1:
+      if self._pool is None:
+        import multiprocessing
+        self._pool = multiprocessing.Pool(self.processes)
+        atexit.register(self._pool.terminate)
+      chunk_size = max(1, len(work) // (self.processes * 4))
+      remote_hashes = self._pool.map(_get_remote_hash, work, chunk_size)
+    else:
+      remote_hashes = map(_get_remote_hash, work)
+
+    return [remote_hash is not None and local_hash == remote_hash
+            for local_hash, remote_hash in zip(local_hashes, remote_hashes)]
+
+  def close(self):
+    """Stops the worker processes used by validate_many, if any."""
+    if self._pool is not None:
+      self._pool.terminate()
+      self._pool = None
+
+
+def _get_remote_hash(work):
+  """Recovers the SHA-1 hash from an RSA signature, in a worker process.
+
+  Args:
+    work: tuple ((modulus, exponent), signature), or None.
+
+  Returns: str The last 20 bytes of the decrypted signature, or None if the
+      signature is not smaller than the modulus.
+  """
+  if work is None:
+    return None
+  (n, e), signature = work
+  signature = number.bytes_to_long(signature)
+  if signature >= n:
+    # Not a valid RSA signature, though it decrypts like signature % n.
+    return None
+  try:
+    return number.long_to_bytes(number.powmod(signature, e, n))[-20:]
+  except:
+    return None
+
 class HmacSha1Validator(RequestValidator):
   def __init__(self, key):
     """
@@ -133,6 +231,8 @@ class HmacSha1Validator(RequestValidator):
       exponent: int The RSA public key exponent.
     """
     self.hmac_key = '%s&' % oauth.escape(key)
+    # The key is digested once; each validation copies this state.
+    self.hmac = hmac.new(self.hmac_key, digestmod=hashlib.sha1)
     
   def validate(self, method, url, params):
     """
@@ -147,7 +247,9 @@ class HmacSha1Validator(RequestValidator):
     Returns: bool True if the request validated, False otherwise.
     """
     base_string = self.get_signature_base_string(method, url, params)
-    local_hash = hmac.new(self.hmac_key, base_string, hashlib.sha1).digest()
+    hashed = self.hmac.copy()
+    hashed.update(base_string)
+    local_hash = hashed.digest()
 
     if not params.has_key("oauth_signature"):
       return False
@@ -159,5 +261,213 @@ class HmacSha1Validator(RequestValidator):
       return False
 
     return local_hash == remote_hash
-    
-    
+
+
+class PublicKeyRing(object):
+  """A cache of container public keys used to validate RSA-SHA1 requests.
+
+  Containers sign requests with one of their keys, named by the
+  xoauth_signature_publickey parameter, and identify themselves with
+  oauth_consumer_key.  Keys are looked up by (container, key name), parsed
+  once and kept as RsaSha1Validator objects in a bounded LRU cache, so a
+  validator is no longer built for each inbound request.
+
+  Keys come from add_key or from files under a directory, at
+  <directory>/<container>/<key name>, holding a hex modulus or a PEM
+  certificate or public key.  Loaded keys expire after ttl seconds so that
+  replaced files are read again.
+
+  """
+
+  def __init__(self, directory=None, max_keys=100, ttl=3600):
+    """Constructor for PublicKeyRing.
+
+    Args:
+      directory: str (optional) The directory keys are loaded from.
+      max_keys: int (optional) The maximum number of parsed keys kept.
+      ttl: int (optional) Seconds a parsed key is kept for.
+
+    """
+    self.directory = directory
+    self.ttl = ttl
+    self._keys = {}
+    self._validators = cache.LruCache(max_keys)
+
+  def add_key(self, container, key_name, key_str):
+    """Adds a key which is not loaded from the directory.
+
+    Args:
+      container: str The oauth_consumer_key of the container.
+      key_name: str The xoauth_signature_publickey value naming the key.
+      key_str: str A hex modulus, or a PEM certificate or public key.
+
+    """
+    self._keys[(container, key_name)] = key_str
+    self._validators.delete((container, key_name))
+
+  def get_validator(self, container, key_name):
+    """Returns the RsaSha1Validator for a key, or None if it is unknown.
+
+    A key which cannot be parsed is logged and treated as unknown.
+
+    """
+    key = (container, key_name)
+    validator = self._validators.get(key)
+    if validator is None:
+      key_str = self._keys.get(key) or self._read_key(container, key_name)
+      if key_str is None:
+        return None
+      try:
+        public_key = parse_public_key(key_str)
+      except ValueError, e:
+        logging.warning('Cannot parse public key %s of %s: %s',
+                        key_name, container, e)
+        return None
+      validator = RsaSha1Validator(public_key=RSA.construct(public_key))
+      self._validators.set(key, validator, self.ttl)
+    return validator
+
+  def get_key(self, container, key_name):
+    """Returns the RSA key object for a key, or None if it is unknown."""
+    validator = self.get_validator(container, key_name)
+    return validator and validator.public_key
+
+  def validate(self, method, url, params):
+    """
+    Determines the validity of an OAuth-signed HTTP request using the key
+    named by its oauth_consumer_key and xoauth_signature_publickey params.
+
+    Returns: bool True if the request validated, False otherwise, including
+        when the key is unknown.
+    """
+    validator = self._get_request_validator(params)
+    return bool(validator) and validator.validate(method, url, params)
+
+  def validate_many(self, requests):
+    """
+    Determines the validity of a batch of OAuth-signed HTTP requests.  The
+    requests signed with each key are passed to its validator's
+    validate_many together.
+
+    Args:
+      requests: list (method, url, params) tuples, with the arguments of
+          validate for each request.
+
+    Returns: list bool True for each request which validated, False otherwise,
+        in the same order as requests.
+    """
+    results = [False] * len(requests)
+    batches = {}
+    for index, request in enumerate(requests):
+      validator = self._get_request_validator(request[2])
+      if validator:
+        validator, indexes, batch = batches.setdefault(
+            id(validator), (validator, [], []))
+        indexes.append(index)
+        batch.append(request)
+    for validator, indexes, batch in batches.itervalues():
+      for index, result in zip(indexes, validator.validate_many(batch)):
+        results[index] = result
+    return results
+
+  def _get_request_validator(self, params):
+    key_name = (params.get('xoauth_signature_publickey') or
+                params.get('xoauth_public_key'))
+    container = params.get('oauth_consumer_key')
+    if not key_name or not container:
+      return None
+    return self.get_validator(container, key_name)
+
+  def _read_key(self, container, key_name):
+    """Reads a key file, or returns None if there is none."""
+    if not self.directory:
+      return None
+    # The names come from the request: never let them leave the directory.
+    for name in (container, key_name):
+      if (name in ('.', '..') or os.path.basename(name) != name or
+          (os.altsep and os.altsep in name)):
+        return None
+    try:
+      f = open(os.path.join(self.directory, container, key_name), 'rb')
+    except IOError:
+      return None
+    try:
+      return f.read()
+    finally:
+      f.close()
+
+
+_PEM_RE = re.compile(
+    r'-----BEGIN ([A-Z ]+)-----(.*?)-----END \1-----', re.DOTALL)
+
+
+def parse_public_key(key_str):
+  """Parses an RSA public key.
+
+  Args:
+    key_str: str A hex modulus, with or without a 0x prefix, for a key whose
+        exponent is 65537, or a PEM "CERTIFICATE", "PUBLIC KEY" or
+        "RSA PUBLIC KEY".
+
+  Returns: tuple The (modulus, exponent) of the key, as longs.
+
+  Raises:
+    ValueError: The key could not be parsed.
+  """
+  match = _PEM_RE.search(key_str)
+  if not match:
+    return long(''.join(key_str.split()), 16), 65537L
+  kind = match.group(1)
+  try:
+    der = base64.decodestring(match.group(2))
+  except Exception, e:
+    raise ValueError('Invalid PEM data: %s' % e)
+  if kind == 'CERTIFICATE':
+    # Certificate ::= SEQUENCE { tbsCertificate, signatureAlgorithm, ... }
+    certificate = _read_der(der, 0, 0x30)[0]
+    tbs = _read_der(certificate, 0, 0x30)[0]
+    pos = 0
+    if tbs[:1] == '\xa0':
+      pos = _read_der(tbs, pos)[1]           # [0] version
+    for field in range(5):                  # serialNumber, signature, issuer,
+      pos = _read_der(tbs, pos)[1]          # validity, subject
+    der = tbs[pos:]
+    kind = 'PUBLIC KEY'
+  if kind == 'PUBLIC KEY':
+    # SubjectPublicKeyInfo ::= SEQUENCE { algorithm, BIT STRING }
+    info = _read_der(der, 0, 0x30)[0]
+    pos = _read_der(info, 0, 0x30)[1]
+    bits = _read_der(info, pos, 0x03)[0]
+    der = bits[1:]
+    kind = 'RSA PUBLIC KEY'
+  if kind != 'RSA PUBLIC KEY':
+    raise ValueError('Unsupported PEM type: %s' % kind)
+  # RSAPublicKey ::= SEQUENCE { modulus INTEGER, publicExponent INTEGER }
+  key = _read_der(der, 0, 0x30)[0]
+  modulus, pos = _read_der(key, 0, 0x02)
+  exponent = _read_der(key, pos, 0x02)[0]
+  return number.bytes_to_long(modulus), number.bytes_to_long(exponent)
+
+
+def _read_der(der, pos, tag=None):
+  """Reads the DER value at pos.
+
+  Returns: tuple The (contents, end) of the value.
+
+  Raises:
+    ValueError: The data is truncated or does not have the expected tag.
+  """
+  if pos + 2 > len(der):
+    raise ValueError('Truncated DER data')
+  if tag is not None and ord(der[pos]) != tag:
+    raise ValueError('Expected DER tag %#x, found %#x' % (tag, ord(der[pos])))
+  length = ord(der[pos + 1])
+  pos += 2
+  if length & 0x80:
+    size = length & 0x7f
+    length = number.bytes_to_long(der[pos:pos + size])
+    pos += size
+  end = pos + length
+  if end > len(der):
+    raise ValueError('Truncated DER data')
+  return der[pos:end], end
@@ -0,0 +1,308 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Thread helpers used to issue container requests concurrently."""
+
+
+import Queue
+import atexit
+import sys
+import threading
+import weakref
+
+
+class Future(object):
+  """The pending result of a call which is executed on another thread."""
+
+  def __init__(self):
+    self._event = threading.Event()
+    self._result = None
+    self._exc_info = None
+
+  def set_result(self, result):
+    """Completes this Future with a value."""
+    self._result = result
+    self._event.set()
+
+  def set_exception(self, exc_info):
+    """Completes this Future with an exception.
+
+    Args:
+      exc_info: tuple The (type, value, traceback) tuple of the exception.
+
+    """
+    self._exc_info = exc_info
+    self._event.set()
+
+  def done(self):
+    """Tells whether or not the result is available."""
+    return self._event.isSet()
+
+  def get_result(self):
+    """Waits for the call to finish and returns its result.
+
+    If the call raised an exception, it is re-raised in the calling thread.
+
+    Returns: The value returned by the call.
+
+    """
+    self._event.wait()
+    if self._exc_info:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+
+class DeferredResult(object):
+  """A result which is computed by a function on the first get_result().
+
+  Used to turn a pending fetch into a pending OpenSocial object: the function
+  waits for the fetch and parses its response in the thread which asks for
+  the result.
+
+  """
+
+  def __init__(self, func):
+    self._func = func
+    self._lock = threading.Lock()
+    self._evaluated = False
+    self._result = None
+    self._exc_info = None
+
+  def get_result(self):
+    """Returns the value of the function, calling it if necessary.
+
+    If the function raised an exception, it is re-raised on every call.
+
+    """
+    self._lock.acquire()
+    try:
+      if not self._evaluated:
+        try:
+          self._result = self._func()
+        except:
+          self._exc_info = sys.exc_info()
+        self._evaluated = True
+        self._func = None
+    finally:
+      self._lock.release()
+    if self._exc_info:
+      raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+    return self._result
+
+
+class SingleFlight(object):
+  """Lets concurrent calls with the same key share a single execution.
+
+  While a call for a key is in progress, further calls for that key wait for
+  it and receive its result, or its exception, instead of running again.
+
+  """
+
+  def __init__(self):
+    self.coalesced = 0
+    self._calls = {}
+    self._lock = threading.Lock()
+
+  def call(self, key, func, *args, **kwargs):
+    """Calls func(*args, **kwargs) unless a call for key is in progress.
+
+    Args:
+      key: A hashable key identifying identical calls.
+      func: The function to call.
+
+    Returns: The result of the call, shared by all of the callers.
+
+    """
+    self._lock.acquire()
+    future = self._calls.get(key)
+    in_progress = future is not None
+    if in_progress:
+      self.coalesced += 1
+    else:
+      future = self._calls[key] = Future()
+    self._lock.release()
+    if in_progress:
+      return future.get_result()
+
+    try:
+      result = func(*args, **kwargs)
+    except:
+      exc_info = sys.exc_info()
+      self._finish(key)
+      future.set_exception(exc_info)
+      raise exc_info[0], exc_info[1], exc_info[2]
+    self._finish(key)
+    future.set_result(result)
+    return result
+
+  def _finish(self, key):
+    self._lock.acquire()
+    del self._calls[key]
+    self._lock.release()
+
+
+def spawn(func, *args, **kwargs):
+  """Calls func(*args, **kwargs) on a new daemon thread.
+
+  Unlike a call submitted to a WorkerPool, the call never waits for a free
+  worker, so it may itself submit calls to a pool and wait for them.
+
+  Returns: A Future for the result of the call.
+
+  """
+  future = Future()
+  def run():
+    try:
+      future.set_result(func(*args, **kwargs))
+    except:
+      future.set_exception(sys.exc_info())
+  thread = threading.Thread(target=run)
+  thread.setDaemon(True)
+  thread.start()
+  return future
+
+
+def wait_all(futures):
+  """Waits for every Future to finish.
+
+  Unlike calling get_result on each Future in turn, all calls are allowed to
+  complete before the first exception, if any, is re-raised.
+
+  Args:
+    futures: list The Future objects to wait for.
+
+  Returns: list The results, in the same order as the given Futures.
+
+  """
+  for future in futures:
+    future._event.wait()
+  return [future.get_result() for future in futures]
+
+
+_pools = weakref.WeakKeyDictionary()
+# The threads of pools which were garbage collected, until they have stopped.
+_stopping_threads = weakref.WeakSet()
+
+
+def _shutdown_pools():
+  for pool in _pools.keys():
+    pool.shutdown()
+  for thread in list(_stopping_threads):
+    thread.join(1.0)
+
+atexit.register(_shutdown_pools)
+
+
+class _PoolState(object):
+  """The queue and counters shared by a WorkerPool and its threads."""
+
+  def __init__(self):
+    self.queue = Queue.Queue()
+    self.lock = threading.Lock()
+    self.workers = 0
+    self.idle = 0
+
+
+class WorkerPool(object):
+  """A bounded pool of daemon threads which execute submitted calls.
+
+  Threads are started on demand, up to max_workers, and then kept around to
+  serve further calls. They only reference the pool's queue, not the pool
+  itself, so they are stopped once the pool is no longer referenced, as well
+  as by shutdown() and when the interpreter exits.
+
+  """
+
+  def __init__(self, max_workers):
+    """Constructor for WorkerPool.
+
+    Args:
+      max_workers: int The maximum number of calls executed at once.
+
+    """
+    self.max_workers = max(1, max_workers)
+    self._state = _PoolState()
+    self._threads = []
+    _pools[self] = True
+
+  def submit(self, func, *args, **kwargs):
+    """Schedules func(*args, **kwargs) to be called on a worker thread.
+
+    Returns: A Future for the result of the call.
+
+    """
+    state = self._state
+    future = Future()
+    state.queue.put((future, func, args, kwargs))
+    state.lock.acquire()
+    try:
+      start_worker = (state.idle < state.queue.qsize() and
+                      state.workers < self.max_workers)
+      if start_worker:
+        state.workers += 1
+    finally:
+      state.lock.release()
+    if start_worker:
+      thread = threading.Thread(target=_work, args=(state,))
+      thread.setDaemon(True)
+      thread.start()
+      self._threads.append(thread)
+    return future
+
+  def shutdown(self, timeout=1.0):
+    """Stops the worker threads once the calls already submitted are done.
+
+    The pool must not be used afterwards.
+
+    Args:
+      timeout: float (optional) Seconds to wait for each thread to stop.
+
+    """
+    threads, self._threads = self._threads, []
+    for thread in threads:
+      self._state.queue.put(None)
+    for thread in threads:
+      thread.join(timeout)
+
+  def __del__(self):
+    for thread in self._threads:
+      self._state.queue.put(None)
+      _stopping_threads.add(thread)
+
+
+def _work(state):
+  """Runs the calls submitted to a WorkerPool until it is stopped."""
+  while True:
+    state.lock.acquire()
+    state.idle += 1
+    state.lock.release()
+    work = state.queue.get()
+    if work is None:
+      return
+    future, func, args, kwargs = work
+    state.lock.acquire()
+    state.idle -= 1
+    state.lock.release()
+    try:
+      future.set_result(func(*args, **kwargs))
+    except:
+      future.set_exception(sys.exc_info())
+      sys.exc_clear()
+    # The call, or the traceback cleared above, may reference the pool's
+    # owner, e.g. through a bound method, which would keep the pool alive
+    # while this thread waits.
+    work = future = func = args = kwargs = None
@@ -0,0 +1,67 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compares the bundled simplejson decode loop with its Scanner-based path on
+container responses.
+"""
+
+
+import sys
+import time
+sys.path.insert(0, sys.path[0] + '/../../src')
+
+from opensocial import simplejson
+
+import json_speed
+
+
+COUNT = 10
+
+
+class ScannerDecoder(simplejson.JSONDecoder):
+  """Decodes through the compound Scanner regex, as the decoder used to."""
+
+  def raw_decode(self, s, **kw):
+    kw['context'] = self
+    return self._scanner.iterscan(s, **kw).next()
+
+
+def time_decode(decoder, s):
+  start = time.time()
+  for i in range(COUNT):
+    decoder.decode(s)
+  return (time.time() - start) * 1000 / COUNT
+
+
+def main():
+  fixtures = (
+    ('people', json_speed.make_people(1000)),
+    ('activities', json_speed.make_activities(1000)),
+    ('person', {'entry': json_speed.make_people(1)['entry'][0]}),
+  )
+  print '%-11s %8s %12s %12s %8s' % ('fixture', 'bytes', 'scanner', 'fast',
+                                     'speedup')
+  for name, value in fixtures:
+    s = simplejson.dumps(value)
+    scanner = time_decode(ScannerDecoder(), s)
+    fast = time_decode(simplejson.JSONDecoder(), s)
+    print '%-11s %8d %9.3f ms %9.3f ms %7.1fx' % (
+        name, len(s), scanner, fast, scanner / fast)
+
+
+if __name__ == '__main__':
+  main()
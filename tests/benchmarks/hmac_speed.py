@@ -0,0 +1,113 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Measures HMAC-SHA1 signatures and validations per second, with the keyed
+HMAC state rebuilt for every request and with it precomputed.
+"""
+
+
+import base64
+import hashlib
+import hmac
+import sys
+import time
+sys.path.insert(0, sys.path[0] + '/../../src')
+
+from opensocial import oauth, validator
+
+
+COUNT = 20000
+
+
+class RekeyingSignatureMethod(oauth.OAuthSignatureMethod_HMAC_SHA1):
+  """Builds a new keyed HMAC for every signature, as the method used to."""
+
+  def build_signature(self, oauth_request, consumer, token):
+    key, raw = self.build_signature_base_string(oauth_request, consumer,
+                                                token)
+    return base64.b64encode(hmac.new(key, raw, hashlib.sha1).digest())
+
+
+class RekeyingValidator(validator.HmacSha1Validator):
+  """Builds a new keyed HMAC for every validation."""
+
+  def __init__(self, key):
+    validator.HmacSha1Validator.__init__(self, key)
+    self.hmac = None
+
+  def validate(self, method, url, params):
+    self.hmac = hmac.new(self.hmac_key, digestmod=hashlib.sha1)
+    return validator.HmacSha1Validator.validate(self, method, url, params)
+
+
+def make_request():
+  params = {
+    'opensocial_method': 'GET',
+    'oauth_consumer_key': 'consumer_key',
+    'oauth_timestamp': '1234567890',
+    'oauth_nonce': '12345678',
+    'oauth_version': '1.0',
+    'oauth_signature_method': 'HMAC-SHA1',
+    'xoauth_requestor_id': '101',
+  }
+  return oauth.OAuthRequest.from_request(
+      'GET', 'http://www.foo.com/rest/people/101/@friends',
+      parameters=params)
+
+
+def rate(func, count):
+  start = time.time()
+  for i in range(count):
+    func()
+  return count / (time.time() - start)
+
+
+def main():
+  consumer = oauth.OAuthConsumer('consumer_key', 'consumer_secret')
+  request = make_request()
+  for name, method in (('rekeyed', RekeyingSignatureMethod()),
+                       ('precomputed', oauth.OAuthSignatureMethod_HMAC_SHA1())):
+    # The HMAC alone, over a fixed base string, and the whole signature.
+    raw = method._build_raw(request)
+    if isinstance(method, RekeyingSignatureMethod):
+      key = 'consumer_secret&'
+      hmac_only = lambda: hmac.new(key, raw, hashlib.sha1).digest()
+    else:
+      keyed = method.get_keyed_hmac(consumer, None)
+      def hmac_only():
+        hashed = keyed.copy()
+        hashed.update(raw)
+        return hashed.digest()
+    print '%-12s hmac %9.0f/s  sign %8.0f/s' % (
+        name, rate(hmac_only, COUNT * 5),
+        rate(lambda: method.build_signature(request, consumer, None), COUNT))
+
+  params = dict(request.parameters)
+  params['oauth_signature'] = oauth.OAuthSignatureMethod_HMAC_SHA1(
+      ).build_signature(request, consumer, None)
+  url = 'http://www.foo.com/rest/people/101/@friends'
+  for name, hmac_validator in (
+      ('rekeyed', RekeyingValidator('consumer_secret')),
+      ('precomputed', validator.HmacSha1Validator('consumer_secret'))):
+    assert hmac_validator.validate('GET', url, params)
+    print '%-12s validate %8.0f/s' % (
+        name, rate(lambda: hmac_validator.validate('GET', url, params),
+                   COUNT))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,98 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compares the JSON throughput of each available codec backend on people
+and activity responses and on an RPC request body.
+"""
+
+
+import sys
+import time
+sys.path.insert(0, sys.path[0] + '/../../src')
+
+from opensocial import codec, request
+
+
+COUNT = 20
+
+
+def make_people(count):
+  return {
+    'startIndex': 0,
+    'totalResults': count,
+    'entry': [{
+      'id': 'orkut.com:%d' % i,
+      'displayName': u'Friend \xe9 %d' % i,
+      'name': {'givenName': 'Friend', 'familyName': str(i)},
+      'thumbnailUrl': 'http://www.foo.com/thumbnails/%d.jpg' % i,
+      'gender': 'female',
+      'age': 20 + i % 50,
+      'hasApp': i % 3 == 0,
+      'aboutMe': 'Lorem ipsum dolor sit amet, "consectetur" adipiscing.',
+    } for i in range(count)],
+  }
+
+
+def make_activities(count):
+  return [{'id': 'activities', 'data': {
+    'totalResults': count,
+    'list': [{
+      'id': str(i),
+      'userId': str(i % 100),
+      'title': '<a href="http://www.foo.com/">Played a game</a>',
+      'body': 'Scored %d points\nin level %d' % (i * 10, i % 7),
+      'postedTime': 1234567890 + i,
+      'mediaItems': [{'mimeType': 'image/jpeg',
+                      'url': 'http://www.foo.com/%d.jpg' % i}],
+    } for i in range(count)],
+  }}]
+
+
+def make_rpc_body(count):
+  return [request.FetchPeopleRequest(str(i), '@friends',
+                                     fields=['id', 'displayName'])
+          .get_rpc_body() for i in range(count)]
+
+
+def time_call(func, arg):
+  start = time.time()
+  for i in range(COUNT):
+    func(arg)
+  return (time.time() - start) * 1000 / COUNT
+
+
+def main():
+  payloads = (('people', make_people(1000)),
+              ('activities', make_activities(1000)),
+              ('rpc body', make_rpc_body(200)))
+  print 'Selected backend: %s' % codec.BACKEND
+  print '%-12s %-11s %8s %12s %12s' % ('backend', 'payload', 'bytes',
+                                       'dumps', 'loads')
+  for name, module in codec.find_backends():
+    encoder_options = codec.ENCODER_OPTIONS.get(name, {})
+    decoder_options = codec.DECODER_OPTIONS.get(name, {})
+    dumps = lambda value: module.dumps(value, **encoder_options)
+    loads = lambda s: module.loads(s, **decoder_options)
+    for payload_name, value in payloads:
+      encoded = dumps(value)
+      print '%-12s %-11s %8d %9.2f ms %9.2f ms' % (
+          name, payload_name, len(encoded),
+          time_call(dumps, value), time_call(loads, encoded))
+
+
+if __name__ == '__main__':
+  main()
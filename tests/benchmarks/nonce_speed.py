@@ -0,0 +1,78 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Measures nonce checks per second for the in-process MemoryNonceStore,
+from one and from several threads, and for a SocketNonceStore talking to a
+NonceServer over a Unix socket.
+"""
+
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+sys.path.insert(0, sys.path[0] + '/../../src')
+
+from opensocial import nonce
+
+
+COUNT = 100000
+CONSUMERS = ['container%d.example.com' % i for i in range(20)]
+
+
+def run(store, count, offset=0):
+  now = int(time.time())
+  consumers = len(CONSUMERS)
+  for i in xrange(offset, offset + count):
+    store.check(CONSUMERS[i % consumers], None, str(i), now)
+
+
+def rate(store, count, threads=1):
+  workers = [threading.Thread(target=run, args=(store, count // threads,
+                                                 i * count))
+             for i in range(threads)]
+  start = time.time()
+  for worker in workers:
+    worker.start()
+  for worker in workers:
+    worker.join()
+  return count / (time.time() - start)
+
+
+def main():
+  for threads in (1, 4):
+    store = nonce.MemoryNonceStore()
+    print 'memory, %d thread(s)  %9.0f checks/s  (%d kept)' % (
+        threads, rate(store, COUNT, threads), len(store))
+
+  directory = tempfile.mkdtemp()
+  try:
+    server = nonce.NonceServer(os.path.join(directory, 'nonces'))
+    server.start()
+    try:
+      print 'unix socket          %9.0f checks/s' % rate(
+          nonce.SocketNonceStore(server.address), COUNT // 10)
+    finally:
+      server.shutdown()
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  main()
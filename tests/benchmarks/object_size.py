@@ -0,0 +1,93 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Compares the memory held by a friends collection of each object type, and
+the time taken to build it and read the ids and names of its people."""
+
+
+import gc
+import sys
+import time
+sys.path.insert(0, sys.path[0] + '/../../src')
+
+from opensocial import data, simplejson
+
+
+FRIENDS = 20000
+
+
+def make_response():
+  return simplejson.dumps({
+    'startIndex': 0,
+    'totalResults': FRIENDS,
+    'entry': [{
+      'id': '%08d' % i,
+      'displayName': 'Friend %d' % i,
+      'name': {'givenName': 'Friend', 'familyName': str(i)},
+      'thumbnailUrl': 'http://www.foo.com/thumbnails/%d.jpg' % i,
+      'profileUrl': 'http://www.foo.com/profiles/%d' % i,
+      'gender': 'female',
+      'aboutMe': 'Lorem ipsum dolor sit amet.',
+      'languagesSpoken': ['en', 'fr'],
+    } for i in range(FRIENDS)],
+  })
+
+
+def size_of(value, seen):
+  """Returns the bytes held by value and the objects it references."""
+  if id(value) in seen:
+    return 0
+  seen.add(id(value))
+  size = sys.getsizeof(value)
+  if isinstance(value, data.LazyObject):
+    size += size_of(value._fields, seen)
+  if isinstance(value, dict):
+    for k, v in dict.iteritems(value):
+      size += size_of(k, seen) + size_of(v, seen)
+  elif isinstance(value, (list, tuple)):
+    for v in value:
+      size += size_of(v, seen)
+  elif isinstance(value, data.CompactObject):
+    for name in ('_extra',) + value.FIELDS:
+      size += size_of(getattr(value, name, None), seen)
+  return size
+
+
+def main():
+  content = make_response()
+  print 'Parsing %d friends' % FRIENDS
+  print '%-14s %8s %10s %10s' % ('', 'size', 'build', 'read')
+  for name, cls in (('Person', data.Person),
+                    ('CompactPerson', data.CompactPerson),
+                    ('LazyPerson', data.LazyPerson)):
+    gc.collect()
+    json = simplejson.loads(content)
+    start = time.time()
+    friends = data.Collection.parse_json(json, cls)
+    built = time.time()
+    del json
+    for person in friends:
+      person.get_id()
+      person.get_display_name()
+    read = time.time()
+    size = size_of(friends, set())
+    print '%-14s %5.1f MB %8.1f ms %8.1f ms' % (
+        name, size / 1e6, (built - start) * 1000, (read - built) * 1000)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,89 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Counts and times the JSON encodings of the body of a signed RPC batch."""
+
+
+import logging
+import sys
+import time
+sys.path.insert(0, sys.path[0] + '/../../src')
+
+from opensocial import codec, http, oauth, request
+
+
+BATCH_SIZE = 200
+COUNT = 50
+
+
+class UncachedRequest(http.Request):
+  """Encodes the body on every access, as http.Request used to."""
+
+  def get_post_body(self):
+    if self.post_body:
+      return codec.encode_body(self.post_body)
+    return None
+
+
+def make_rpcs():
+  rpcs = []
+  for i in range(BATCH_SIZE):
+    rpc = request.FetchPeopleRequest(str(i), '@friends',
+                                     fields=['id', 'displayName', 'name'])
+    rpcs.append(rpc.get_rpc_body())
+  return rpcs
+
+
+def run(request_class, rpcs):
+  consumer = oauth.OAuthConsumer('consumer_key', 'consumer_secret')
+  signature_method = oauth.OAuthSignatureMethod_HMAC_SHA1()
+  encodes = [0]
+  encode_body = codec.encode_body
+  def counting_encode_body(*args, **kwargs):
+    encodes[0] += 1
+    return encode_body(*args, **kwargs)
+  http.codec.encode_body = counting_encode_body
+  try:
+    start = time.time()
+    for i in range(COUNT):
+      http_request = request_class('http://www.foo.com/rpc', method='POST',
+                                   post_body=rpcs)
+      http_request.sign_request(consumer, signature_method)
+      http.log_request(http_request)
+      # What UrlFetch.fetch sends.
+      http_request.get_post_body()
+    elapsed = time.time() - start
+  finally:
+    http.codec.encode_body = encode_body
+  return float(encodes[0]) / COUNT, elapsed
+
+
+def main():
+  logging.getLogger().setLevel(logging.INFO)
+  rpcs = make_rpcs()
+  body_bytes = len(codec.dumps(rpcs))
+  print 'Signing %d requests with a %d byte body (%d RPCs)' % (
+      COUNT, body_bytes, BATCH_SIZE)
+  for name, request_class in (('uncached', UncachedRequest),
+                              ('cached', http.Request)):
+    encodes, elapsed = run(request_class, rpcs)
+    print '%-9s %4.1f encodes/request %8.2f ms/request' % (
+        name, encodes, elapsed * 1000 / COUNT)
+
+
+if __name__ == '__main__':
+  main()
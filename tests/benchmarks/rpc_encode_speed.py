@@ -0,0 +1,68 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Times the encoding of JSON-RPC batch bodies by the bundled encoder, its
+single-pass encode_fast and codec.encode_body.
+"""
+
+
+import sys
+import time
+sys.path.insert(0, sys.path[0] + '/../../src')
+
+from opensocial import codec, request, simplejson
+from opensocial.simplejson.encoder import encode_fast
+
+
+COUNT = 200
+
+
+def make_rpcs(size):
+  rpcs = []
+  for i in range(size):
+    if i % 2:
+      rpc = request.FetchPeopleRequest(str(i), '@friends',
+                                       fields=['id', 'displayName', 'name'])
+    else:
+      rpc = request.UpdateAppDataRequest(str(i), '@self',
+                                         data={'score': str(i * 10),
+                                               'level': 'forest'})
+    rpcs.append(rpc.get_rpc_body())
+  return rpcs
+
+
+def time_encode(encode, rpcs):
+  start = time.time()
+  for i in range(COUNT):
+    encode(rpcs)
+  return (time.time() - start) * 1000000 / COUNT
+
+
+def main():
+  encoder = simplejson.JSONEncoder()
+  print 'codec backend: %s' % codec.BACKEND
+  print '%6s %8s %12s %12s %12s' % ('rpcs', 'bytes', 'iterencode',
+                                    'encode_fast', 'encode_body')
+  for size in (1, 10, 100):
+    rpcs = make_rpcs(size)
+    print '%6d %8d %9.1f us %9.1f us %9.1f us' % (
+        size, len(encode_fast(rpcs)), time_encode(encoder.encode, rpcs),
+        time_encode(encode_fast, rpcs), time_encode(codec.encode_body, rpcs))
+
+
+if __name__ == '__main__':
+  main()
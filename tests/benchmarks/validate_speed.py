@@ -0,0 +1,138 @@
+#!/usr/bin/python
+#
+# Copyright (C) 2009 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Measures inbound signed request verifications per second, one request at
+a time with validate and in batches with validate_many, for RSA-SHA1 with
+an increasing number of worker processes, and for HMAC-SHA1.
+"""
+
+
+import multiprocessing
+import sys
+import time
+sys.path.insert(0, sys.path[0] + '/../../src')
+
+from opensocial import oauth, validator
+
+
+BATCH = 200
+
+URL = 'http://graargh.returnstrue.com/buh/fetchme.php'
+
+RSA_KEY = ('0x00deb51922b2a31dfea37045540385be3b39343ff5b384e105'
+           '339a78e534d13dacf7adad7c20117e180f5f25b702c8730794a0'
+           'eaa6a9e69e37b53fad0a1fc6ffcb838a6d8592de2456aed90270'
+           '87b4cea8df20f5ae7a00b758043708f0a9a2f68f4923d43e19ff'
+           'e358872ad90700782fbb9a9acdbe207bdc35cddbe30e8fecb7d5')
+
+RSA_PARAMS = {
+  'oauth_body_hash': '2jmj7l5rSw0yVb/vlWAYkK/YBwk=',
+  'opensocial_owner_id': 'john.doe',
+  'opensocial_viewer_id': 'john.doe',
+  'opensocial_app_id': '3995',
+  'opensocial_app_url': 'http://localhost/~kurrik/makeRequest.xml',
+  'oauth_version': '1.0',
+  'oauth_timestamp': '1255470195',
+  'oauth_consumer_key': 'kurrik',
+  'oauth_signature_method': 'RSA-SHA1',
+  'oauth_nonce': '1255470195040198000',
+  'oauth_signature': 'mFxgSmrgYxo8GbJji/6pbjTVIEBoVC6tHHp9QSwORqiPg2I1mG7t6M1'
+                     '00XVSowpMpxO76miKOTBxQmeCs26QmBQP1uf9U1yMHs5hqj3b+TbkyI'
+                     'QLflKl9A+WoGr2xFQoQ0i9S+Pq2L3CXS7pFuYqom2UbokixfjRAmtBz'
+                     'tyLJQE=',
+  'xoauth_public_key': 'openssl_key_pk8_shindig.pem',
+  'xoauth_signature_publickey': 'openssl_key_pk8_shindig.pem',
+}
+
+HMAC_PARAMS = {
+  'oauth_body_hash': '2jmj7l5rSw0yVb/vlWAYkK/YBwk=',
+  'opensocial_owner_id': 'john.doe',
+  'opensocial_viewer_id': 'john.doe',
+  'opensocial_app_id': '3995',
+  'opensocial_app_url': 'http://localhost/~kurrik/makeRequest.xml',
+  'oauth_version': '1.0',
+  'oauth_timestamp': '1255468709',
+  'oauth_consumer_key': "I'm a consumer key!",
+  'oauth_signature_method': 'HMAC-SHA1',
+  'oauth_nonce': '1255468709246019000',
+  'oauth_signature': '0CoUIWCAaBtjJqW3wQ0DJXNEa+o=',
+}
+
+
+class OAuthRequestHmacValidator(validator.HmacSha1Validator):
+  """Builds base strings through an oauth.OAuthRequest, as validators did."""
+
+  def get_signature_base_string(self, method, url, params):
+    encoded_params = {}
+    for key, value in params.items():
+      encoded_params[key] = value.encode('utf-8', 'ignore')
+    oauth_request = oauth.OAuthRequest(http_method=method.upper(),
+                                       http_url=url,
+                                       parameters=encoded_params)
+    return '&'.join((
+        oauth.escape(oauth_request.get_normalized_http_method()),
+        oauth.escape(oauth_request.get_normalized_http_url()),
+        oauth.escape(oauth_request.get_normalized_parameters())))
+
+
+def rate(func, count, repeat=5):
+  """Returns the best rate, in items per second, of func over repeat runs."""
+  best = None
+  for i in range(repeat):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return count / best
+
+
+def report(name, per_second, cores=1):
+  print '%-28s %9.0f/s  %9.0f/s per core' % (name, per_second,
+                                              per_second / cores)
+
+
+def main():
+  rsa_requests = [('GET', URL, RSA_PARAMS)] * BATCH
+  hmac_requests = [('GET', URL, HMAC_PARAMS)] * BATCH
+
+  rsa = validator.RsaSha1Validator(RSA_KEY)
+  assert all(rsa.validate_many(rsa_requests))
+  report('rsa validate', rate(
+      lambda: [rsa.validate(*request) for request in rsa_requests], BATCH))
+  report('rsa validate_many', rate(
+      lambda: rsa.validate_many(rsa_requests), BATCH))
+
+  cpus = multiprocessing.cpu_count()
+  processes = 2
+  while processes <= cpus:
+    pooled = validator.RsaSha1Validator(RSA_KEY, processes=processes)
+    assert all(pooled.validate_many(rsa_requests))
+    report('rsa validate_many, %d procs' % processes, rate(
+        lambda: pooled.validate_many(rsa_requests), BATCH), processes)
+    pooled.close()
+    processes *= 2
+
+  for name, cls in (('hmac, OAuthRequest', OAuthRequestHmacValidator),
+                    ('hmac validate_many', validator.HmacSha1Validator)):
+    hmac = cls("I'm a consumer secret!")
+    assert all(hmac.validate_many(hmac_requests))
+    report(name, rate(lambda: hmac.validate_many(hmac_requests), BATCH))
+
+
+if __name__ == '__main__':
+  main()
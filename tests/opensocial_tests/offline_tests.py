@@ -19,9 +19,19 @@ __author__ = 'davidbyttow@google.com (David Byttow)'
 
 import urllib
 import httplib
+import gc
 import hashlib
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
 import unittest
-from base64 import b64encode
+import BaseHTTPServer
+import SocketServer
+from base64 import b64decode, b64encode
+from StringIO import StringIO
 
 from opensocial import *
 from opensocial import mock_http, simplejson, test_data
@@ -76,6 +86,160 @@ class TestHttp(unittest.TestCase):
     except oauth.OAuthError:
       return
     self.fail()
+
+  def test_post_body_encoded_once(self):
+    encodes = []
+    encode_body = http.codec.encode_body
+    def counting_encode_body(obj):
+      encodes.append(obj)
+      return encode_body(obj)
+    http.codec.encode_body = counting_encode_body
+    try:
+      request = http.Request("http://example.com", "POST",
+                             post_body=[{'method': 'people.get'}])
+      request.sign_request(self.consumer, self.signature_method)
+      http.log_request(request)
+      body = request.get_post_body()
+      self.assertEquals(1, len(encodes))
+      self.assertEquals(b64encode(hashlib.sha1(body).digest()),
+                        request.get_parameter('oauth_body_hash'))
+
+      request.post_body = [{'method': 'people.update'}]
+      self.assertEquals('[{"method": "people.update"}]',
+                        request.get_post_body())
+      self.assertEquals(2, len(encodes))
+    finally:
+      http.codec.encode_body = encode_body
+
+
+class KeepAliveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+  """Echoes the request path, or POST body, and counts the connections it was
+  served on.
+  """
+
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+    self.server.connections += 1
+
+  def do_GET(self):
+    content = self.path
+    if self.path.startswith('/big'):
+      content = 'x' * 100000
+    self.send_response(httplib.OK)
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+    # Drop the socket without announcing it, as an idle timeout would.
+    self.close_connection = self.server.drop_connections
+
+  def do_POST(self):
+    content = self.rfile.read(int(self.headers['Content-Length']))
+    self.send_response(httplib.OK)
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, *args):
+    pass
+
+
+class KeepAliveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  connections = 0
+  drop_connections = False
+
+  def handle_error(self, request, client_address):
+    # Clients reset connections whose responses they stop reading.
+    pass
+
+
+class TestPooledUrlFetch(unittest.TestCase):
+
+  def setUp(self):
+    self.server = KeepAliveServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=self.server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    self.url = 'http://127.0.0.1:%d/people' % self.server.server_address[1]
+    self.urlfetch = http.PooledUrlFetch()
+
+  def tearDown(self):
+    self.urlfetch.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def test_reuses_connection(self):
+    for i in range(3):
+      response = self.urlfetch.fetch(http.Request(self.url))
+      self.assertEquals(httplib.OK, response.status)
+      self.assertEquals('/people?opensocial_method=GET', response.content)
+    self.assertEquals(1, self.server.connections)
+
+  def test_stream_releases_connection(self):
+    for i in range(3):
+      response = self.urlfetch.fetch_stream(http.Request(self.url))
+      self.assertEquals(httplib.OK, response.status)
+      self.assertEquals('/people', response.read(7))
+      self.assertEquals('?opensocial_method=GET', response.content)
+    self.assertEquals(1, self.server.connections)
+
+  def test_stream_closed_early(self):
+    big_url = self.url.replace('/people', '/big')
+    response = self.urlfetch.fetch_stream(http.Request(big_url))
+    self.assertEquals('x' * 10, response.read(10))
+    response.close()
+    response = self.urlfetch.fetch(http.Request(self.url))
+    self.assertEquals('/people?opensocial_method=GET', response.content)
+    self.assertEquals(2, self.server.connections)
+
+  def test_streamed_post_body(self):
+    post_body = [{'method': 'appdata.update', 'id': str(i),
+                  'params': {'data': {'score': 'x' * 100}}}
+                 for i in range(100)]
+    request = http.Request(self.url, 'POST', post_body=post_body)
+    request.set_stream_body(True)
+    request.sign_request(oauth.OAuthConsumer('key', 'secret'),
+                         oauth.OAuthSignatureMethod_HMAC_SHA1())
+    response = self.urlfetch.fetch(request)
+    self.assertEquals(None, request._encoded_post_body)
+    self.assertEquals(simplejson.dumps(post_body), response.content)
+    self.assertEquals(b64encode(hashlib.sha1(response.content).digest()),
+                      request.get_parameter('oauth_body_hash'))
+    self.assertEquals(len(response.content), request.get_post_body_length())
+    chunks = list(request.iter_post_body(chunk_size=1000))
+    self.assertTrue(len(chunks) > 10)
+    self.assertEquals(response.content, ''.join(chunks))
+
+  def test_retries_stale_connection(self):
+    self.server.drop_connections = True
+    for i in range(2):
+      response = self.urlfetch.fetch(http.Request(self.url))
+      self.assertEquals(httplib.OK, response.status)
+    self.assertEquals(2, self.server.connections)
+
+  def test_evicts_idle_connections(self):
+    self.urlfetch.idle_timeout = -1
+    for i in range(2):
+      self.urlfetch.fetch(http.Request(self.url))
+    self.assertEquals(2, self.server.connections)
+
+  def test_default_socket_timeout(self):
+    socket.setdefaulttimeout(7)
+    try:
+      self.urlfetch.fetch(http.Request(self.url))
+    finally:
+      socket.setdefaulttimeout(None)
+    connection, last_used = self.urlfetch._idle.values()[0][0]
+    self.assertEquals(7, connection.sock.gettimeout())
+
+  def test_default_urlfetch(self):
+    self.assertTrue(isinstance(http.get_default_urlfetch(keep_alive=True),
+                               http.PooledUrlFetch))
+    self.assertFalse(isinstance(http.get_default_urlfetch(),
+                                http.PooledUrlFetch))
+
     
 class TestRestRequest(unittest.TestCase):
 
@@ -215,7 +379,209 @@ class TestValidator(unittest.TestCase):
     }
     is_valid_request = validator.validate("GET", url, params)
     self.assertFalse(is_valid_request)
+
+  def test_signature_base_string(self):
+    url = "http://graargh.returnstrue.com/buh/fetchme.php?x=1#y"
+    params = {
+      'oauth_signature' : 'abc',
+      'b'               : u'caf\xe9',
+      'a'               : 'x y/z',
+    }
+    encoded_params = dict((key, value.encode('utf-8'))
+                          for key, value in params.items())
+    oauth_request = oauth.OAuthRequest('get', url, encoded_params)
+    expected = '&'.join((
+        oauth.escape(oauth_request.get_normalized_http_method()),
+        oauth.escape(oauth_request.get_normalized_http_url()),
+        oauth.escape(oauth_request.get_normalized_parameters())))
+    self.assertEqual(expected, HmacSha1Validator('secret')
+                     .get_signature_base_string('get', url, params))
+
+  def test_validate_many_rsa(self):
+    public_key_str = ("0x00deb51922b2a31dfea37045540385be3b39343ff5b384e105" +
+                      "339a78e534d13dacf7adad7c20117e180f5f25b702c8730794a0" +
+                      "eaa6a9e69e37b53fad0a1fc6ffcb838a6d8592de2456aed90270" +
+                      "87b4cea8df20f5ae7a00b758043708f0a9a2f68f4923d43e19ff" +
+                      "e358872ad90700782fbb9a9acdbe207bdc35cddbe30e8fecb7d5")
+    url = "http://graargh.returnstrue.com/buh/fetchme.php"
+    params = {
+      'oauth_body_hash'            : '2jmj7l5rSw0yVb/vlWAYkK/YBwk=',
+      'opensocial_owner_id'        : 'john.doe',
+      'opensocial_viewer_id'       : 'john.doe',
+      'opensocial_app_id'          : '3995',
+      'opensocial_app_url'         : 'http://localhost/~kurrik/makeRequest.xml',
+      'oauth_version'              : '1.0',
+      'oauth_timestamp'            : '1255470195',
+      'oauth_consumer_key'         : "kurrik",
+      'oauth_signature_method'     : 'RSA-SHA1',
+      'oauth_nonce'                : '1255470195040198000',
+      'oauth_signature'            : 'mFxgSmrgYxo8GbJji/6pbjTVIEBoVC6tHHp9QSwORqiPg2I1mG7t6M100XVSowpMpxO76miKOTBxQmeCs26QmBQP1uf9U1yMHs5hqj3b+TbkyIQLflKl9A+WoGr2xFQoQ0i9S+Pq2L3CXS7pFuYqom2UbokixfjRAmtBztyLJQE=',
+      'xoauth_public_key'          : 'openssl_key_pk8_shindig.pem',
+      'xoauth_signature_publickey' : 'openssl_key_pk8_shindig.pem',
+    }
+    tampered = dict(params, opensocial_viewer_id='jane.doe')
+    unsigned = dict(params)
+    del unsigned['oauth_signature']
+    # The signature plus the modulus decrypts to the same hash.
+    signature = long(b64decode(params['oauth_signature']).encode('hex'), 16)
+    wrapped_hex = '%x' % (signature + long(public_key_str, 16))
+    wrapped_hex = '0' * (len(wrapped_hex) % 2) + wrapped_hex
+    wrapped = dict(params, oauth_signature=b64encode(wrapped_hex.decode('hex')))
+    requests = [("GET", url, params), ("GET", url, tampered),
+                ("GET", url, unsigned), ("GET", url, params),
+                ("GET", url, wrapped)]
+    expected = [True, False, False, True, False]
+    self.assertFalse(
+        RsaSha1Validator(public_key_str).validate("GET", url, wrapped))
+
+    self.assertEqual(expected,
+                     RsaSha1Validator(public_key_str).validate_many(requests))
+    validator = RsaSha1Validator(public_key_str, processes=2)
+    try:
+      self.assertEqual(expected, validator.validate_many(requests))
+      self.assertEqual(expected, validator.validate_many(requests))
+    finally:
+      validator.close()
+
+  def test_validate_many_hmac(self):
+    validator = HmacSha1Validator("I'm a consumer secret!")
+    url = "http://graargh.returnstrue.com/buh/fetchme.php"
+    params = {
+      'oauth_body_hash'        : '2jmj7l5rSw0yVb/vlWAYkK/YBwk=',
+      'opensocial_owner_id'    : 'john.doe',
+      'opensocial_viewer_id'   : 'john.doe',
+      'opensocial_app_id'      : '3995',
+      'opensocial_app_url'     : 'http://localhost/~kurrik/makeRequest.xml',
+      'oauth_version'          : '1.0',
+      'oauth_timestamp'        : '1255468709',
+      'oauth_consumer_key'     : "I'm a consumer key!",
+      'oauth_signature_method' : 'HMAC-SHA1',
+      'oauth_nonce'            : '1255468709246019000',
+      'oauth_signature'        : '0CoUIWCAaBtjJqW3wQ0DJXNEa+o=',
+    }
+    tampered = dict(params, oauth_nonce='1')
+    self.assertEqual([True, False], validator.validate_many(
+        [("GET", url, params), ("GET", url, tampered)]))
     
+class TestPublicKeyRing(unittest.TestCase):
+
+  modulus = long('B5584B2AD621A69D62CFD1A50406451B8C8CACB9505EEC91C821F553EF9D'
+                 '4210F5AB50488BB6BE6A4404F7681D629568BD079E3990A8DD6C9238311E'
+                 'DDCBA83882EAFB174DBA2E015B2883E673C95194B31052D8F2B5DA867667'
+                 'BA19FB506EE9EDBE1297E23A38A5DB3F9248011BB82343F7532727B1C55B'
+                 '5329BFCA7DA2F6E5', 16)
+
+  certificate = """-----BEGIN CERTIFICATE-----
+MIICCDCCAXGgAwIBAgIUI+qNq9XKh8q1NglFPs/3reYe2GswDQYJKoZIhvcNAQEL
+BQAwFjEUMBIGA1UEAwwLZXhhbXBsZS5jb20wHhcNMjYxMDE4MTUyMTMwWhcNMzYx
+MDE1MTUyMTMwWjAWMRQwEgYDVQQDDAtleGFtcGxlLmNvbTCBnzANBgkqhkiG9w0B
+AQEFAAOBjQAwgYkCgYEAtVhLKtYhpp1iz9GlBAZFG4yMrLlQXuyRyCH1U++dQhD1
+q1BIi7a+akQE92gdYpVovQeeOZCo3WySODEe3cuoOILq+xdNui4BWyiD5nPJUZSz
+EFLY8rXahnZnuhn7UG7p7b4Sl+I6OKXbP5JIARu4I0P3UycnscVbUym/yn2i9uUC
+AwEAAaNTMFEwHQYDVR0OBBYEFCUMp0HmyPJ6H6hQVN4aWmPox7TnMB8GA1UdIwQY
+MBaAFCUMp0HmyPJ6H6hQVN4aWmPox7TnMA8GA1UdEwEB/wQFMAMBAf8wDQYJKoZI
+hvcNAQELBQADgYEAOMnZWGz717RIiuLxmg4vxukLCaDTiHzuHhK2wyZdezWZjiFN
+GCnqiU4/trLJaEetiGHUU2VjfqIk7Xk7G9U5MUTRhQmcTfyC/YSRCUBEZ0U9zc/D
+QPqC4cpEyryaL7eLa839/dkzRJ7V4PT9OumQSN0fKyoUXhJwoDH1CzMPngM=
+-----END CERTIFICATE-----
+"""
+
+  public_key = """-----BEGIN PUBLIC KEY-----
+MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQC1WEsq1iGmnWLP0aUEBkUbjIys
+uVBe7JHIIfVT751CEPWrUEiLtr5qRAT3aB1ilWi9B545kKjdbJI4MR7dy6g4gur7
+F026LgFbKIPmc8lRlLMQUtjytdqGdme6GftQbuntvhKX4jo4pds/kkgBG7gjQ/dT
+JyexxVtTKb/KfaL25QIDAQAB
+-----END PUBLIC KEY-----
+"""
+
+  rsa_public_key = """-----BEGIN RSA PUBLIC KEY-----
+MIGJAoGBALVYSyrWIaadYs/RpQQGRRuMjKy5UF7skcgh9VPvnUIQ9atQSIu2vmpE
+BPdoHWKVaL0HnjmQqN1skjgxHt3LqDiC6vsXTbouAVsog+ZzyVGUsxBS2PK12oZ2
+Z7oZ+1Bu6e2+EpfiOjil2z+SSAEbuCND91MnJ7HFW1Mpv8p9ovblAgMBAAE=
+-----END RSA PUBLIC KEY-----
+"""
+
+  url = 'http://example.org/app'
+
+  params = {
+    'oauth_consumer_key'         : 'example.com',
+    'xoauth_signature_publickey' : 'pub.1.cer',
+    'oauth_nonce'                : '1',
+    'oauth_timestamp'            : '1255470195',
+    'oauth_signature_method'     : 'RSA-SHA1',
+    'opensocial_viewer_id'       : 'john.doe',
+    'oauth_signature'            : 'Fqrgf3mat98C+78hGRxmj5otUm405Z4NMPvcqpJ+tBZ5LX5AF0Aq+eL/W5lIMQdLiozWJBvxQyOmNqi39kzCFZo8lrFpe+XSFe9Vz5C4rEHNp0pJkm3/hYaHRL0S8yu59N6k+St5wMLTl0ivxNHMBFWrqcXYNPeuVf6hiWLHzw8=',
+  }
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    os.mkdir(os.path.join(self.directory, 'example.com'))
+    f = open(os.path.join(self.directory, 'example.com', 'pub.1.cer'), 'w')
+    f.write(self.certificate)
+    f.close()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_parse_public_key(self):
+    for key_str in (self.certificate, self.public_key, self.rsa_public_key,
+                    '0x00%x' % self.modulus, '%X\n' % self.modulus):
+      self.assertEqual((self.modulus, 65537), parse_public_key(key_str))
+    self.assertRaises(ValueError, parse_public_key,
+                      '-----BEGIN PUBLIC KEY-----\nMIGf\n'
+                      '-----END PUBLIC KEY-----')
+
+  def test_validate_with_key_from_directory(self):
+    keyring = PublicKeyRing(self.directory)
+    self.assertTrue(keyring.validate('GET', self.url, self.params))
+    validator = keyring.get_validator('example.com', 'pub.1.cer')
+    self.assertEqual(self.modulus, validator.public_key.n)
+    self.assertTrue(validator is keyring.get_validator('example.com',
+                                                       'pub.1.cer'))
+    tampered = dict(self.params, opensocial_viewer_id='jane.doe')
+    self.assertFalse(keyring.validate('GET', self.url, tampered))
+    self.assertEqual([True, False, True], keyring.validate_many(
+        [('GET', self.url, self.params), ('GET', self.url, tampered),
+         ('GET', self.url, self.params)]))
+
+  def test_unknown_keys(self):
+    keyring = PublicKeyRing(self.directory)
+    for container, key_name in (('example.com', 'pub.2.cer'),
+                                ('other.com', 'pub.1.cer'),
+                                ('..', 'example.com'),
+                                ('example.com', '../example.com/pub.1.cer')):
+      self.assertEqual(None, keyring.get_key(container, key_name))
+      params = dict(self.params, oauth_consumer_key=container,
+                    xoauth_signature_publickey=key_name)
+      self.assertFalse(keyring.validate('GET', self.url, params))
+
+  def test_malformed_keys(self):
+    f = open(os.path.join(self.directory, 'example.com', 'pub.2.cer'), 'w')
+    f.write('-----BEGIN CERTIFICATE-----\nMIIB\n-----END CERTIFICATE-----')
+    f.close()
+    keyring = PublicKeyRing(self.directory)
+    keyring.add_key('other.com', 'pub.1.cer', 'not a key')
+    requests = []
+    for container, key_name in (('example.com', 'pub.2.cer'),
+                                ('other.com', 'pub.1.cer')):
+      self.assertEqual(None, keyring.get_key(container, key_name))
+      params = dict(self.params, oauth_consumer_key=container,
+                    xoauth_signature_publickey=key_name)
+      self.assertFalse(keyring.validate('GET', self.url, params))
+      requests.append(('GET', self.url, params))
+    requests.append(('GET', self.url, self.params))
+    self.assertEqual([False, False, True], keyring.validate_many(requests))
+
+  def test_added_keys_and_eviction(self):
+    keyring = PublicKeyRing(max_keys=1)
+    keyring.add_key('example.com', 'pub.1.cer', self.public_key)
+    keyring.add_key('example.com', 'pub.2.cer', '%x' % self.modulus)
+    self.assertTrue(keyring.validate('GET', self.url, self.params))
+    self.assertEqual(self.modulus,
+                     keyring.get_key('example.com', 'pub.2.cer').n)
+    self.assertEqual(1, len(keyring._validators))
+    self.assertTrue(keyring.validate('GET', self.url, self.params))
+
 class TestContainerContext(unittest.TestCase):
 
   friends_response = http.Response(httplib.OK, simplejson.dumps(
@@ -309,4 +675,1189 @@ class TestContainerContext(unittest.TestCase):
     self.assertEqual('103', request.get_parameter('xoauth_requestor_id'))
     self.assertEqual('http://www.foo.com/rest/people/103/@friends', 
                      request.get_normalized_url())
-    
\ No newline at end of file
+    
+
+class SlowUrlFetch(mock_http.MockUrlFetch):
+  """Answers every fetch with the same response and records the peak number
+  of fetches in flight.
+  """
+
+  def __init__(self, response, delay=0.05):
+    super(SlowUrlFetch, self).__init__()
+    self.default_response = response
+    self.delay = delay
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self.lock = threading.Lock()
+
+  def fetch(self, request):
+    self.lock.acquire()
+    self.in_flight += 1
+    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    self.lock.release()
+    time.sleep(self.delay)
+    response = super(SlowUrlFetch, self).fetch(request)
+    self.lock.acquire()
+    self.in_flight -= 1
+    self.lock.release()
+    return response
+
+
+class TestConcurrentRestBatch(unittest.TestCase):
+
+  person_response = http.Response(httplib.OK, simplejson.dumps({
+    'entry': {'id': '101', 'displayName': 'Kenny McCormick'},
+  }))
+
+  def make_batch(self, size):
+    batch = RequestBatch()
+    for i in range(size):
+      batch.add_request('person%d' % i, request.FetchPersonRequest('@me'))
+    return batch
+
+  def test_max_in_flight(self):
+    config = ContainerConfig(server_rest_base='http://www.foo.com/rest/',
+                             max_concurrent_requests=4)
+    urlfetch = SlowUrlFetch(self.person_response)
+    container = ContainerContext(config, urlfetch)
+    batch = self.make_batch(10)
+    batch.send(container)
+
+    self.assertEqual(10, len(urlfetch.requests))
+    self.assertEqual(4, urlfetch.max_in_flight)
+    for i in range(10):
+      self.assertEqual('101', batch.get('person%d' % i).get_id())
+
+  def test_serial_by_default(self):
+    urlfetch = SlowUrlFetch(self.person_response, delay=0)
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    self.make_batch(3).send(container)
+    self.assertEqual(1, urlfetch.max_in_flight)
+
+  def test_errors_are_captured_per_key(self):
+    config = ContainerConfig(server_rest_base='http://www.foo.com/rest/',
+                             max_concurrent_requests=4)
+    urlfetch = SlowUrlFetch(http.Response(httplib.NOT_FOUND, 'Error'))
+    container = ContainerContext(config, urlfetch)
+    batch = self.make_batch(3)
+    batch.send(container)
+    for i in range(3):
+      self.assertTrue(isinstance(batch.get('person%d' % i), BadRequestError))
+
+  def test_threads_stop_with_the_context(self):
+    config = ContainerConfig(server_rest_base='http://www.foo.com/rest/',
+                             max_concurrent_requests=4)
+    container = ContainerContext(config, SlowUrlFetch(self.person_response))
+    self.make_batch(4).send(container)
+    threads = container._worker_pool._threads[:]
+    self.assertEqual(4, len(threads))
+    del container
+    gc.collect()
+    for thread in threads:
+      thread.join(1)
+      self.assertFalse(thread.isAlive())
+
+
+class TestAsyncContainerContext(unittest.TestCase):
+
+  def setUp(self):
+    self.urlfetch = mock_http.MockUrlFetch()
+    self.container = AsyncContainerContext(TEST_CONFIG, self.urlfetch)
+
+  def test_fetch_person(self):
+    self.urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps({
+      'entry': {'id': '101', 'displayName': 'Kenny McCormick'},
+    })))
+    pending = self.container.fetch_person('@me')
+    person = pending.get_result()
+    self.assertEqual('101', person.get_id())
+    self.assertEqual('Kenny McCormick', person.get_display_name())
+    self.assertEqual(person, pending.get_result())
+
+  def test_fetch_errors_are_raised_by_get_result(self):
+    self.urlfetch.add_response(http.Response(httplib.NOT_FOUND, 'Error'))
+    pending = self.container.fetch_friends('103')
+    self.assertRaises(BadRequestError, pending.get_result)
+
+  def test_rpc_batch(self):
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc')
+    container = AsyncContainerContext(config, self.urlfetch)
+    self.urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps([
+      {'id': 'me', 'data': {'id': '101', 'displayName': 'Kenny'}},
+      {'id': 'friends', 'error': {'code': 403, 'message': 'Forbidden'}},
+    ])))
+    batch = RequestBatch()
+    batch.add_request('me', request.FetchPersonRequest('@me'))
+    batch.add_request('friends', request.FetchPeopleRequest('@me', '@friends'))
+    self.assertEqual(batch, batch.send(container).get_result())
+    self.assertEqual('Kenny', batch.get('me').get_display_name())
+    self.assertTrue(isinstance(batch.get('friends'), BadResponseError))
+
+  def test_default_urlfetch_is_shared(self):
+    first = AsyncContainerContext(TEST_CONFIG)
+    second = AsyncContainerContext(TEST_CONFIG)
+    self.assertTrue(first.url_fetch is second.url_fetch)
+    self.assertTrue(first.url_fetch is http.get_default_async_urlfetch())
+
+  def test_cache(self):
+    response_cache = cache.ResponseCache()
+    container = AsyncContainerContext(TEST_CONFIG, self.urlfetch,
+                                      response_cache)
+    self.urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps({
+      'entry': {'id': '101', 'displayName': 'Kenny McCormick'},
+    })))
+    self.assertEqual('101', container.fetch_person('101').get_result().get_id())
+    batch = RequestBatch()
+    batch.add_request('me', request.FetchPersonRequest('101'))
+    self.assertEqual('101',
+                     batch.send(container).get_result().get('me').get_id())
+    self.assertEqual(1, len(self.urlfetch.requests))
+    self.assertEqual(1, response_cache.hits)
+
+
+class RpcEchoUrlFetch(SlowUrlFetch):
+  """Answers each RPC in a batch with a person whose id is the RPC's userId."""
+
+  def __init__(self, delay=0):
+    super(RpcEchoUrlFetch, self).__init__(None, delay)
+
+  def fetch(self, request):
+    self.default_response = None
+    super(RpcEchoUrlFetch, self).fetch(request)
+    return http.Response(httplib.OK, simplejson.dumps([
+        {'id': rpc['id'], 'data': {'id': rpc['params']['userId']}}
+        for rpc in request.post_body]))
+
+
+class TestRpcBatchChunking(unittest.TestCase):
+
+  def make_batch(self, size):
+    batch = RequestBatch()
+    for i in range(size):
+      batch.add_request('person%d' % i, request.FetchPersonRequest(str(i)))
+    return batch
+
+  def test_split_by_size(self):
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc',
+                             max_rpc_batch_size=10,
+                             max_concurrent_requests=4)
+    urlfetch = RpcEchoUrlFetch(delay=0.05)
+    container = ContainerContext(config, urlfetch)
+    batch = self.make_batch(35)
+    batch.send(container)
+
+    self.assertEqual(4, len(urlfetch.requests))
+    self.assertEqual(4, urlfetch.max_in_flight)
+    self.assertEqual([10, 10, 10, 5],
+                     sorted([len(r.post_body) for r in urlfetch.requests],
+                            reverse=True))
+    for i in range(35):
+      self.assertEqual(str(i), batch.get('person%d' % i).get_id())
+
+  def test_split_by_body_bytes(self):
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc',
+                             max_rpc_body_bytes=1000)
+    urlfetch = RpcEchoUrlFetch()
+    container = ContainerContext(config, urlfetch)
+    batch = self.make_batch(20)
+    batch.send(container)
+
+    self.assertTrue(len(urlfetch.requests) > 1)
+    for http_request in urlfetch.requests:
+      self.assertTrue(len(http_request.get_post_body()) <= 1000)
+    for i in range(20):
+      self.assertEqual(str(i), batch.get('person%d' % i).get_id())
+
+  def test_single_post_by_default(self):
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc')
+    urlfetch = RpcEchoUrlFetch()
+    self.make_batch(50).send(ContainerContext(config, urlfetch))
+    self.assertEqual(1, len(urlfetch.requests))
+
+  def test_chunks_are_signed_together(self):
+    config = ContainerConfig(oauth_consumer_key='consumer_key',
+                             oauth_consumer_secret='consumer_secret',
+                             server_rpc_base='http://www.foo.com/rpc',
+                             max_rpc_batch_size=10,
+                             max_concurrent_requests=4)
+    urlfetch = RpcEchoUrlFetch()
+    batch = self.make_batch(35)
+    batch.send(ContainerContext(config, urlfetch))
+
+    params = [r.oauth_request.parameters for r in urlfetch.requests]
+    self.assertEqual(1, len(set(p['oauth_timestamp'] for p in params)))
+    self.assertEqual(4, len(set(p['oauth_nonce'] for p in params)))
+    validator = HmacSha1Validator('consumer_secret')
+    for p in params:
+      p = dict((key, str(value)) for key, value in p.items())
+      self.assertTrue(validator.validate('POST', 'http://www.foo.com/rpc', p))
+    for i in range(35):
+      self.assertEqual(str(i), batch.get('person%d' % i).get_id())
+
+
+class TestBulkSigner(unittest.TestCase):
+
+  def make_requests(self):
+    requests = []
+    for i in range(6):
+      request = http.Request('http://www.foo.com/rpc/%d' % (i % 2), 'POST',
+                             post_body=[{'method': 'people.get', 'id': i}])
+      request.add_security_token('token %d' % (i % 3))
+      requests.append(request)
+    return requests
+
+  def check_signatures(self, signature_method):
+    consumer = oauth.OAuthConsumer('consumer_key', 'consumer_secret')
+    signed = self.make_requests()
+    http.BulkSigner(consumer, signature_method).sign(signed, 1234567890)
+
+    nonces = set()
+    for request, expected in zip(self.make_requests(), signed):
+      nonce = expected.get_parameter('oauth_nonce')
+      nonces.add(nonce)
+      self.assertEqual(1234567890, expected.get_parameter('oauth_timestamp'))
+      request.sign_request(consumer, signature_method, 1234567890, nonce)
+      self.assertEqual(request.oauth_request.parameters,
+                       expected.oauth_request.parameters)
+      self.assertEqual(request.get_url(), expected.get_url())
+    self.assertEqual(len(signed), len(nonces))
+
+  def test_hmac_sha1(self):
+    self.check_signatures(oauth.OAuthSignatureMethod_HMAC_SHA1())
+
+  def test_other_methods(self):
+    self.check_signatures(oauth.OAuthSignatureMethod_PLAINTEXT())
+
+  def test_generate_nonces(self):
+    nonces = http.generate_nonces(100)
+    self.assertEqual(100, len(set(nonces)))
+    for nonce in nonces:
+      self.assertEqual(16, len(nonce))
+      int(nonce, 16)
+
+
+class TestResponseCache(unittest.TestCase):
+
+  person_response = http.Response(httplib.OK, simplejson.dumps({
+    'entry': {'id': '101', 'displayName': 'Kenny McCormick'},
+  }))
+
+  def setUp(self):
+    self.urlfetch = mock_http.MockUrlFetch()
+    self.cache = cache.ResponseCache(ttls={'activities': 0})
+    self.container = ContainerContext(TEST_CONFIG, self.urlfetch, self.cache)
+
+  def test_rest_reads_are_cached(self):
+    self.urlfetch.add_response(self.person_response)
+    first = self.container.fetch_person('101')
+    second = self.container.fetch_person('101')
+    self.assertEqual(1, len(self.urlfetch.requests))
+    self.assertEqual('Kenny McCormick', second.get_display_name())
+    self.assertFalse(first is second)
+    self.assertEqual(1, self.cache.hits)
+    self.assertEqual(1, self.cache.misses)
+
+  def test_keys_include_params_and_requestor(self):
+    self.urlfetch.add_response(self.person_response)
+    self.urlfetch.add_response(self.person_response)
+    self.urlfetch.add_response(self.person_response)
+    self.container.fetch_person('101')
+    self.container.fetch_person('102')
+    self.container.fetch_person('101', fields=['id'])
+    self.assertEqual(3, len(self.urlfetch.requests))
+    self.assertEqual(0, self.cache.hits)
+
+  def test_contexts_sharing_a_cache(self):
+    def make_context(rest_base, security_token):
+      config = ContainerConfig(server_rest_base=rest_base,
+                               security_token=security_token)
+      return ContainerContext(config, self.urlfetch, self.cache)
+    for name in ('Kenny', 'Kyle', 'Stan'):
+      self.urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps({
+        'entry': {'id': '@me', 'displayName': name},
+      })))
+    kenny = make_context('http://www.foo.com/rest/', 'kenny-token')
+    kyle = make_context('http://www.foo.com/rest/', 'kyle-token')
+    stan = make_context('http://www.bar.com/rest/', 'kenny-token')
+    self.assertEqual('Kenny', kenny.fetch_person('@me').get_display_name())
+    self.assertEqual('Kyle', kyle.fetch_person('@me').get_display_name())
+    self.assertEqual('Stan', stan.fetch_person('@me').get_display_name())
+    self.assertEqual(3, len(self.urlfetch.requests))
+    self.assertEqual(0, self.cache.hits)
+    kenny_again = make_context('http://www.foo.com/rest/', 'kenny-token')
+    self.assertEqual('Kenny',
+                     kenny_again.fetch_person('@me').get_display_name())
+    self.assertEqual(3, len(self.urlfetch.requests))
+
+  def test_rpc_reads_are_cached(self):
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc')
+    urlfetch = RpcEchoUrlFetch()
+    container = ContainerContext(config, urlfetch, self.cache)
+    self.assertEqual('101', container.fetch_person('101').get_id())
+    batch = RequestBatch()
+    batch.add_request('cached', request.FetchPersonRequest('101'))
+    batch.add_request('new', request.FetchPersonRequest('102'))
+    batch.send(container)
+    self.assertEqual('101', batch.get('cached').get_id())
+    self.assertEqual('102', batch.get('new').get_id())
+    self.assertEqual(2, len(urlfetch.requests))
+    self.assertEqual(['102'], [rpc['params']['userId']
+                               for rpc in urlfetch.requests[1].post_body])
+
+  def test_mutations_and_disabled_services_bypass_cache(self):
+    self.assertEqual(None, request.UpdateAppDataRequest(
+        '@me', '@self', data={'key': 'value'}).get_cache_key())
+    self.assertEqual(None, request.CreateActivityRequest(
+        '@me', {'title': 'Hi'}).get_cache_key())
+    self.assertEqual(None, request.CreateAlbumRequest(
+        '@me', {'caption': 'Hi'}).get_cache_key(use_rest=True))
+
+    key = request.FetchActivityRequest('101').get_cache_key()
+    self.assertEqual('activities', key[0])
+    self.cache.set(key, {'list': []})
+    self.assertEqual(None, self.cache.get(key))
+
+  def test_reads_after_writes(self):
+    class AppDataUrlFetch(mock_http.MockUrlFetch):
+      app_data = {}
+      def fetch(self, request):
+        self.requests.append(request)
+        responses = []
+        for rpc in request.post_body:
+          if rpc['method'] == 'appdata.update':
+            self.app_data.update(rpc['params']['data'])
+          responses.append({'id': rpc['id'],
+                            'data': {'101': dict(self.app_data)}})
+        return http.Response(httplib.OK, simplejson.dumps(responses))
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc')
+    urlfetch = AppDataUrlFetch()
+    container = ContainerContext(config, urlfetch, cache.ResponseCache())
+    def read_score():
+      return container.send_request(request.FetchAppDataRequest(
+          '101', '@self', fields=['score']))['101'].get('score')
+    self.assertEqual(None, read_score())
+    container.send_request(request.UpdateAppDataRequest(
+        '101', '@self', data={'score': '10'}))
+    self.assertEqual('10', read_score())
+    self.assertEqual(3, len(urlfetch.requests))
+
+  def test_lru_eviction(self):
+    lru = cache.LruCache(max_entries=2)
+    lru.set('a', 1, 60)
+    lru.set('b', 2, 60)
+    lru.get('a')
+    lru.set('c', 3, 60)
+    self.assertEqual(1, lru.get('a'))
+    self.assertEqual(None, lru.get('b'))
+    self.assertEqual(3, lru.get('c'))
+    lru.set('d', 4, -1)
+    self.assertEqual(None, lru.get('d'))
+
+
+class MemcacheHandler(SocketServer.StreamRequestHandler):
+  """Serves get, set, delete and flush_all of the memcached text protocol."""
+
+  def handle(self):
+    while True:
+      line = self.rfile.readline()
+      if not line:
+        return
+      command = line.split()
+      if command[0] == 'get':
+        value = self.server.values.get(command[1])
+        if value is not None:
+          self.wfile.write('VALUE %s 0 %d\r\n%s\r\n' % (command[1], len(value),
+                                                        value))
+        self.wfile.write('END\r\n')
+      elif command[0] == 'set':
+        value = self.rfile.read(int(command[4]) + 2)[:-2]
+        if int(command[3]) >= 0:
+          self.server.values[command[1]] = value
+        self.wfile.write('STORED\r\n')
+      elif command[0] == 'delete':
+        self.server.values.pop(command[1], None)
+        self.wfile.write('DELETED\r\n')
+      elif command[0] == 'flush_all':
+        self.server.values.clear()
+        self.wfile.write('OK\r\n')
+
+
+class MemcacheServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+  daemon_threads = True
+
+  def __init__(self):
+    SocketServer.TCPServer.__init__(self, ('127.0.0.1', 0), MemcacheHandler)
+    self.values = {}
+
+
+class TestCacheBackends(unittest.TestCase):
+
+  friends_json = {
+    'startIndex': 0,
+    'totalResults': 1,
+    'entry': [{'id': '102', 'displayName': u'Stan Marsh \u2603'}],
+  }
+
+  def check_backend(self, backend):
+    response_cache = cache.ResponseCache(backend=backend)
+    key = request.FetchPeopleRequest('101', '@friends').get_cache_key()
+    self.assertEqual(None, response_cache.get(key))
+    response_cache.set(key, self.friends_json)
+
+    # A second cache on the same backend, as in another worker process.
+    other_cache = cache.ResponseCache(backend=backend)
+    friends = request.FetchPeopleRequest('101', '@friends').process_json(
+        other_cache.get(key))
+    self.assertEqual(1, friends.totalResults)
+    self.assertEqual(u'Stan Marsh \u2603', friends[0].get_display_name())
+
+    backend.set('expired', 'value', -1)
+    self.assertEqual(None, backend.get('expired'))
+    backend.set('deleted', 'value', 60)
+    backend.delete('deleted')
+    self.assertEqual(None, backend.get('deleted'))
+
+    # Workers serving different viewers share the backend, not the entries.
+    urlfetch = mock_http.MockUrlFetch()
+    names = []
+    for name in ('Kenny', 'Kyle'):
+      urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps({
+        'entry': {'id': '@me', 'displayName': name},
+      })))
+      config = ContainerConfig(server_rest_base='http://www.foo.com/rest/',
+                               security_token='%s-token' % name)
+      container = ContainerContext(config, urlfetch,
+                                   cache.ResponseCache(backend=backend))
+      names.append(container.fetch_person('@me').get_display_name())
+    self.assertEqual(['Kenny', 'Kyle'], names)
+
+  def test_memory_backend(self):
+    self.check_backend(cache.MemoryCacheBackend())
+
+  def test_file_backend(self):
+    directory = tempfile.mkdtemp()
+    try:
+      self.check_backend(cache.FileCacheBackend(directory))
+    finally:
+      shutil.rmtree(directory)
+
+  def test_memcache_backend(self):
+    server = MemcacheServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    try:
+      backend = cache.MemcacheBackend(server.server_address)
+      self.check_backend(backend)
+      backend.set('key', 'line one\r\nline two', 60)
+      self.assertEqual('line one\r\nline two', backend.get('key'))
+    finally:
+      server.shutdown()
+      server.server_close()
+
+  def test_memcache_backend_unreachable(self):
+    server = MemcacheServer()
+    address = server.server_address
+    server.server_close()
+    backend = cache.MemcacheBackend(address)
+    backend.set('key', 'value', 60)
+    self.assertEqual(None, backend.get('key'))
+
+
+class TestNonceStores(unittest.TestCase):
+
+  def check_store(self, store):
+    now = int(time.time())
+    self.assertTrue(store.check('consumer', None, 'n1', now))
+    self.assertFalse(store.check('consumer', None, 'n1', now))
+    self.assertFalse(store.check('consumer', None, 'n1', str(now)))
+    self.assertTrue(store.check('consumer', None, 'n1', now - 1))
+    self.assertTrue(store.check('consumer', 'token', 'n1', now))
+    self.assertTrue(store.check('other', None, 'n1', now))
+    self.assertTrue(store.check('consumer', '-', 'n1', now))
+    self.assertTrue(store.check('a b\n', None, 'x y', now))
+    self.assertFalse(store.check('a b\n', None, 'x y', now))
+    self.assertFalse(store.check('consumer', None, 'n2', now - 3600))
+    self.assertFalse(store.check('consumer', None, 'n2', now + 3600))
+    self.assertFalse(store.check('consumer', None, 'n2', 'soon'))
+
+  def test_memory_store(self):
+    self.check_store(nonce.MemoryNonceStore())
+
+  def test_buckets_expire(self):
+    clock = [1000000]
+    store = nonce.MemoryNonceStore(threshold=300, shards=2,
+                                   clock=lambda: clock[0])
+    for i in range(10):
+      self.assertTrue(store.check('consumer%d' % i, None, 'n', 1000000 - i))
+    self.assertEqual(10, len(store))
+    clock[0] += 301
+    self.assertFalse(store.check('consumer0', None, 'n', 1000000))
+    clock[0] += 300
+    self.assertTrue(store.check('consumer0', None, 'n', clock[0]))
+    self.assertTrue(store.check('consumer1', None, 'n', clock[0]))
+    self.assertEqual(2, len(store))
+
+  def test_memory_is_bounded(self):
+    store = nonce.MemoryNonceStore(shards=1, max_nonces=3)
+    now = time.time()
+    for i in range(3):
+      self.assertTrue(store.check('consumer', None, str(i), now))
+    self.assertFalse(store.check('consumer', None, '3', now))
+    self.assertEqual(3, len(store))
+
+  def test_one_consumer_fills_the_store(self):
+    store = nonce.MemoryNonceStore(shards=16, max_nonces=1000)
+    now = time.time()
+    for i in range(1000):
+      self.assertTrue(store.check('consumer', None, str(i), now))
+    self.assertFalse(store.check('other', None, 'n', now))
+    self.assertEqual(1000, len(store))
+
+  def test_socket_store(self):
+    directory = tempfile.mkdtemp()
+    try:
+      for address in (os.path.join(directory, 'nonces'), ('127.0.0.1', 0)):
+        server = nonce.NonceServer(address)
+        server.start()
+        try:
+          self.check_store(nonce.SocketNonceStore(server.address))
+          other_process = nonce.SocketNonceStore(server.address)
+          self.assertFalse(other_process.check('consumer', None, 'n1',
+                                               int(time.time())))
+        finally:
+          server.shutdown()
+        self.assertFalse(nonce.SocketNonceStore(server.address).check(
+            'consumer', None, 'n3', int(time.time())))
+    finally:
+      shutil.rmtree(directory)
+
+  def test_shutdown_without_serving(self):
+    server = nonce.NonceServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.shutdown)
+    thread.setDaemon(True)
+    thread.start()
+    thread.join(5)
+    self.assertFalse(thread.isAlive())
+
+  def test_socket_store_does_not_resend_checks(self):
+    class SlowStore(nonce.MemoryNonceStore):
+      checks = 0
+      def check(self, *args):
+        self.checks += 1
+        time.sleep(0.2)
+        return nonce.MemoryNonceStore.check(self, *args)
+    store = SlowStore()
+    server = nonce.NonceServer(('127.0.0.1', 0), store)
+    server.start()
+    try:
+      client = nonce.SocketNonceStore(server.address, timeout=0.05)
+      self.assertFalse(client.check('consumer', None, 'n1', int(time.time())))
+      time.sleep(0.3)
+      self.assertEqual(1, store.checks)
+    finally:
+      server.shutdown()
+
+  def test_oauth_server_rejects_replays(self):
+    consumer = oauth.OAuthConsumer('consumer', 'secret')
+    data_store = oauth.OAuthDataStore()
+    data_store.lookup_consumer = lambda key: consumer
+    data_store.lookup_nonce = nonce.MemoryNonceStore().lookup_nonce
+    signature_method = oauth.OAuthSignatureMethod_HMAC_SHA1()
+    server = oauth.OAuthServer(data_store, {'HMAC-SHA1': signature_method})
+    oauth_request = oauth.OAuthRequest.from_consumer_and_token(
+        consumer, http_url='http://www.foo.com/app',
+        parameters={'opensocial_viewer_id': '101'})
+    oauth_request.sign_request(signature_method, consumer, None)
+    server._check_signature(oauth_request, consumer, None)
+    self.assertRaises(oauth.OAuthError, server._check_signature,
+                      oauth_request, consumer, None)
+
+
+class TestRequestCoalescing(unittest.TestCase):
+
+  person_response = http.Response(httplib.OK, simplejson.dumps({
+    'entry': {'id': '101', 'displayName': 'Kenny McCormick'},
+  }))
+
+  def fetch_concurrently(self, container, user_ids):
+    results = {}
+    def fetch(i, user_id):
+      results[i] = container.fetch_person(user_id)
+    threads = [threading.Thread(target=fetch, args=(i, user_id))
+               for i, user_id in enumerate(user_ids)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return [results[i] for i in range(len(user_ids))]
+
+  def test_identical_requests_share_one_call(self):
+    urlfetch = SlowUrlFetch(self.person_response, delay=0.2)
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    container.set_coalesce_requests(True)
+    people = self.fetch_concurrently(container, ['101'] * 5)
+    self.assertEqual(1, len(urlfetch.requests))
+    self.assertEqual(4, container.single_flight.coalesced)
+    for person in people:
+      self.assertEqual('101', person.get_id())
+
+  def test_different_requests_are_not_coalesced(self):
+    urlfetch = SlowUrlFetch(self.person_response, delay=0.2)
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    container.set_coalesce_requests(True)
+    self.fetch_concurrently(container, ['101', '102'])
+    self.assertEqual(2, len(urlfetch.requests))
+    self.assertEqual(0, container.single_flight.coalesced)
+
+  def test_errors_are_shared(self):
+    urlfetch = SlowUrlFetch(http.Response(httplib.NOT_FOUND, 'Error'),
+                            delay=0.2)
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    container.set_coalesce_requests(True)
+    errors = []
+    def fetch():
+      try:
+        container.fetch_person('101')
+      except BadRequestError, e:
+        errors.append(e)
+    threads = [threading.Thread(target=fetch) for i in range(3)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(3, len(errors))
+    self.assertEqual(1, len(urlfetch.requests))
+
+
+class TestAutoBatching(unittest.TestCase):
+
+  def setUp(self):
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc')
+    self.urlfetch = RpcEchoUrlFetch()
+    self.container = ContainerContext(config, self.urlfetch)
+
+  def fetch_concurrently(self, user_ids):
+    results = {}
+    def fetch(user_id):
+      results[user_id] = self.container.fetch_person(user_id)
+    threads = [threading.Thread(target=fetch, args=(user_id,))
+               for user_id in user_ids]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    return results
+
+  def test_requests_share_a_batch(self):
+    self.container.set_auto_batching(True, window=0.5)
+    user_ids = [str(i) for i in range(10)]
+    results = self.fetch_concurrently(user_ids)
+    self.assertEqual(1, len(self.urlfetch.requests))
+    self.assertEqual(10, len(self.urlfetch.requests[0].post_body))
+    for user_id in user_ids:
+      self.assertEqual(user_id, results[user_id].get_id())
+
+  def test_full_batch_is_sent_early(self):
+    self.container.set_auto_batching(True, window=5, max_requests=2)
+    start = time.time()
+    self.fetch_concurrently(['101', '102'])
+    self.assertTrue(time.time() - start < 5)
+    self.assertEqual(1, self.container.auto_batcher.batches_sent)
+
+  def test_errors_are_raised_per_request(self):
+    self.container.set_auto_batching(True)
+    self.urlfetch = mock_http.MockUrlFetch()
+    self.container.url_fetch = self.urlfetch
+    self.urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps([
+      {'id': 1, 'error': {'code': 404, 'message': 'Not found'}},
+    ])))
+    self.assertRaises(BadResponseError, self.container.fetch_person, '101')
+
+
+class TestStreaming(unittest.TestCase):
+
+  def setUp(self):
+    self.urlfetch = mock_http.MockUrlFetch()
+    self.container = ContainerContext(TEST_CONFIG, self.urlfetch)
+    self.people = [{'id': str(i), 'displayName': 'Person "%d"' % i,
+                    'tags': ['a', 'b\\', {'c': [1.5, None]}]}
+                   for i in range(50)]
+
+  def test_entry_stream(self):
+    content = simplejson.dumps({
+      'startIndex': 0,
+      'entry': self.people,
+      'totalResults': 50,
+    })
+    for chunk_size in (1, 7, 8192):
+      entries = jsonstream.EntryStream(StringIO(content), chunk_size=chunk_size)
+      self.assertEqual(self.people, list(entries))
+      self.assertEqual(0, entries.values['startIndex'])
+      self.assertEqual(50, entries.values['totalResults'])
+
+  def test_stream_friends_rest(self):
+    self.urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps({
+      'startIndex': 0,
+      'totalResults': 50,
+      'entry': self.people,
+    })))
+    friends = self.container.stream_friends('@me')
+    request = self.urlfetch.get_request()
+    self.assertEqual('http://www.foo.com/rest/people/@me/@friends',
+                     request.get_normalized_url())
+    people = list(friends)
+    self.assertEqual(50, friends.totalResults)
+    self.assertEqual(50, len(people))
+    self.assertTrue(isinstance(people[0], Person))
+    self.assertEqual('Person "49"', people[49].get_display_name())
+
+  def test_stream_friends_rpc(self):
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc')
+    container = ContainerContext(config, self.urlfetch)
+    self.urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps([
+      {'id': 'people', 'data': {'totalResults': 50, 'list': self.people}},
+    ])))
+    people = list(container.stream_friends('@me'))
+    self.assertEqual(self.people, people)
+
+  def test_stream_errors(self):
+    self.urlfetch.add_response(http.Response(httplib.NOT_FOUND, 'Error'))
+    self.assertRaises(BadRequestError, self.container.stream_friends, '103')
+    self.urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps({
+      'error': {'code': httplib.UNAUTHORIZED},
+    })))
+    friends = self.container.stream_friends('103')
+    self.assertRaises(UnauthorizedRequestError, list, friends)
+
+
+class PagingUrlFetch(mock_http.MockUrlFetch):
+  """Serves pages of a collection of total people, at most max_count at a
+  time, over REST or RPC. Pages starting at an index in short_pages hold at
+  most short_pages[index] people.
+  """
+
+  def __init__(self, total, max_count=None, delay=0, short_pages=None):
+    super(PagingUrlFetch, self).__init__()
+    self.total = total
+    self.max_count = max_count
+    self.delay = delay
+    self.short_pages = short_pages or {}
+
+  def get_page(self, start, count):
+    if self.max_count:
+      count = min(count, self.max_count)
+    count = min(count, self.short_pages.get(start, count))
+    return {
+      'startIndex': start,
+      'totalResults': self.total,
+      'entry': [{'id': str(i)}
+                for i in range(start, min(start + count, self.total))],
+    }
+
+  def fetch(self, request):
+    self.requests.append(request)
+    time.sleep(self.delay)
+    if request.get_method() == 'GET':
+      json = self.get_page(int(request.get_parameter('startIndex')),
+                           int(request.get_parameter('count')))
+    else:
+      json = [{'id': rpc['id'],
+               'data': self.get_page(rpc['params']['startIndex'],
+                                     rpc['params']['count'])}
+              for rpc in request.post_body]
+    return http.Response(httplib.OK, simplejson.dumps(json))
+
+
+class TestPaging(unittest.TestCase):
+
+  def test_iter_friends(self):
+    urlfetch = PagingUrlFetch(25)
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    friends = container.iter_friends('@me', page_size=10)
+    ids = [person.get_id() for person in friends]
+    self.assertEqual([str(i) for i in range(25)], ids)
+    self.assertEqual(25, friends.totalResults)
+    self.assertEqual(3, len(urlfetch.requests))
+    self.assertEqual('http://www.foo.com/rest/people/@me/@friends',
+                     urlfetch.requests[0].get_normalized_url())
+
+  def test_pages_per_batch(self):
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc')
+    urlfetch = PagingUrlFetch(95)
+    container = ContainerContext(config, urlfetch)
+    friends = container.iter_friends('@me', page_size=10, pages_per_batch=5)
+    ids = [person.get_id() for person in friends]
+    self.assertEqual([str(i) for i in range(95)], ids)
+    self.assertEqual(10, friends.pages_fetched)
+    self.assertEqual([1, 5, 4],
+                     [len(request.post_body) for request in urlfetch.requests])
+
+  def test_container_page_size_limit(self):
+    urlfetch = PagingUrlFetch(25, max_count=5)
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    friends = container.iter_friends('@me', page_size=10, pages_per_batch=2)
+    ids = [person.get_id() for person in friends]
+    self.assertEqual([str(i) for i in range(25)], ids)
+
+  def test_short_middle_page(self):
+    config = ContainerConfig(server_rpc_base='http://www.foo.com/rpc')
+    urlfetch = PagingUrlFetch(50, short_pages={10: 5})
+    container = ContainerContext(config, urlfetch)
+    friends = container.iter_friends('@me', page_size=10, pages_per_batch=3)
+    ids = [person.get_id() for person in friends]
+    self.assertEqual([str(i) for i in range(50)], ids)
+
+  def test_concurrent_iterators_with_small_pool(self):
+    config = ContainerConfig(server_rest_base='http://www.foo.com/rest/',
+                             max_concurrent_requests=2)
+    container = ContainerContext(config, PagingUrlFetch(100, delay=0.01))
+    results = []
+    def iterate():
+      friends = container.iter_friends('@me', page_size=10, pages_per_batch=3)
+      results.append(len(list(friends)))
+    threads = [threading.Thread(target=iterate) for i in range(2)]
+    for thread in threads:
+      thread.setDaemon(True)
+      thread.start()
+    for thread in threads:
+      thread.join(5)
+      self.assertFalse(thread.isAlive())
+    self.assertEqual([100, 100], results)
+
+  def test_iter_activities(self):
+    urlfetch = PagingUrlFetch(3)
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    activities = list(container.iter_activities('@me', page_size=2))
+    self.assertEqual(3, len(activities))
+    self.assertTrue(isinstance(activities[0], Activity))
+
+  def test_errors_are_raised(self):
+    container = ContainerContext(TEST_CONFIG, mock_http.MockUrlFetch())
+    self.assertRaises(BadRequestError, list, container.iter_friends('@me'))
+
+
+class TestCompactObjects(unittest.TestCase):
+
+  def test_compact_person(self):
+    fields = {
+      'id': '101',
+      'name': {'givenName': 'Kenny', 'familyName': 'McCormick'},
+      'gender': 'male',
+    }
+    person = CompactPerson.parse_json({'entry': fields})
+    self.assertEqual('101', person.get_id())
+    self.assertEqual('Kenny McCormick', person.get_display_name())
+    self.assertEqual('male', person.get_field('gender'))
+    self.assertEqual('male', person['gender'])
+    self.assertEqual(None, person.get('aboutMe'))
+    self.assertRaises(KeyError, lambda: person['displayName'])
+    self.assertFalse('displayName' in person)
+    self.assertEqual(fields, person.to_dict())
+    self.assertEqual(Person(fields), person)
+    self.assertFalse(hasattr(person, '__dict__'))
+
+  def test_container_object_types(self):
+    urlfetch = mock_http.MockUrlFetch()
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    container.set_object_types(COMPACT_TYPES)
+    urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps({
+      'startIndex': 0,
+      'totalResults': 2,
+      'entry': [{'id': '102', 'displayName': 'Stan'},
+                {'id': '103', 'displayName': 'Kyle'}],
+    })))
+    friends = container.fetch_friends('@me')
+    self.assertEqual(2, friends.totalResults)
+    self.assertTrue(isinstance(friends[0], CompactPerson))
+    self.assertEqual('Kyle', friends[1].get_display_name())
+
+
+class TestFriendTable(unittest.TestCase):
+
+  def setUp(self):
+    self.json = {
+      'startIndex': 0,
+      'totalResults': 3,
+      'entry': [
+        {'id': '102', 'displayName': 'Stan', 'thumbnailUrl': 'default.jpg'},
+        {'id': '103', 'displayName': 'Kyle', 'thumbnailUrl': 'default.jpg'},
+        {'id': '104', 'displayName': 'Eric'},
+      ],
+    }
+
+  def test_parse_json(self):
+    table = FriendTable.parse_json(self.json)
+    self.assertEqual(3, len(table))
+    self.assertEqual(3, table.totalResults)
+    self.assertEqual(['102', '103', '104'], table.get_column('id'))
+    thumbnails = table.get_column('thumbnailUrl')
+    self.assertTrue(thumbnails[0] is thumbnails[1])
+    self.assertEqual(self.json['entry'], list(table))
+    self.assertTrue(isinstance(table.to_people()[2], Person))
+    self.assertEqual(1, table.index_of('103'))
+
+  def test_non_numeric_ids(self):
+    self.json['entry'][0]['id'] = 'orkut.com:102'
+    table = FriendTable.parse_json(self.json)
+    self.assertEqual('orkut.com:102', table[0].get_id())
+    self.assertEqual('103', table[1].get_id())
+
+  def test_filter_select_join(self):
+    table = FriendTable.parse_json(self.json)
+    named = table.filter(lambda name: name.startswith('E'), 'displayName')
+    self.assertEqual(['104'], named.get_column('id'))
+    self.assertEqual(['102', '104'],
+                     table.filter(lambda id: id != '103').get_column('id'))
+    self.assertEqual(['103'],
+                     table.filter([False, True, False]).get_column('id'))
+    ids = table.select('id')
+    self.assertEqual(['id'], ids.columns.keys())
+
+    scores = FriendTable.from_entries(
+        [{'id': '104', 'score': 3}, {'id': '102', 'score': 5}],
+        columns=('id', 'score'))
+    joined = table.join_by_id(scores)
+    self.assertEqual(['102', '104'], joined.get_column('id'))
+    self.assertEqual([5, 3], joined.get_column('score'))
+    self.assertEqual(['Stan', 'Eric'], joined.get_column('displayName'))
+
+  def test_container_object_types(self):
+    urlfetch = mock_http.MockUrlFetch()
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    container.set_object_types({Collection: FriendTable})
+    urlfetch.add_response(http.Response(httplib.OK,
+                                        simplejson.dumps(self.json)))
+    friends = container.fetch_friends('@me')
+    self.assertTrue(isinstance(friends, FriendTable))
+    self.assertEqual('Kyle', friends[1].get_display_name())
+
+
+class TestLazyObjects(unittest.TestCase):
+
+  def test_fields_are_read_through(self):
+    fields = {
+      'id': '101',
+      'name': {'givenName': 'Kenny', 'familyName': 'McCormick'},
+      'gender': 'male',
+    }
+    person = LazyPerson.parse_json({'entry': fields})
+    self.assertEqual('101', person.get_id())
+    self.assertEqual('Kenny McCormick', person.get_display_name())
+    self.assertTrue(person._fields is fields)
+    self.assertTrue('gender' in person)
+    self.assertFalse('displayName' in person)
+    self.assertEqual(None, person.get('displayName'))
+    self.assertRaises(KeyError, lambda: person['displayName'])
+    self.assertEqual(3, len(person))
+    self.assertEqual(Person(fields), person)
+    self.assertEqual(fields, dict(person))
+    self.assertEqual(fields, person.to_dict())
+
+  def test_is_not_a_dict(self):
+    person = LazyPerson({'id': '101'})
+    self.assertFalse(isinstance(person, dict))
+    self.assertRaises(TypeError, codec.dumps, person)
+    self.assertEqual('{"id": "101"}', codec.dumps(person.to_dict()))
+
+  def test_updates_are_kept(self):
+    fields = {'id': '101', 'displayName': 'Kenny'}
+    person = LazyPerson(fields)
+    person['displayName'] = 'Mysterion'
+    del person['id']
+    self.assertEqual({'displayName': 'Mysterion'}, person)
+    self.assertEqual({'id': '101', 'displayName': 'Kenny'}, fields)
+
+  def test_container_object_types(self):
+    urlfetch = mock_http.MockUrlFetch()
+    container = ContainerContext(TEST_CONFIG, urlfetch)
+    container.set_object_types(LAZY_TYPES)
+    urlfetch.add_response(http.Response(httplib.OK, simplejson.dumps({
+      'entry': [{'id': '102', 'displayName': 'Stan'}],
+    })))
+    friends = container.fetch_friends('@me')
+    self.assertTrue(isinstance(friends[0], LazyPerson))
+    self.assertEqual('Stan', friends[0].get_display_name())
+
+
+class TestCodec(unittest.TestCase):
+
+  def setUp(self):
+    self.value = {
+      'startIndex': 0,
+      'totalResults': 2,
+      'entry': [
+        {'id': '102', 'displayName': u'St\xe9phane "Stan" Marsh',
+         'thumbnailUrl': 'http://www.foo.com/102.jpg', 'age': 10,
+         'score': 0.25, 'hasApp': True, 'aboutMe': None},
+        {'id': '103', 'name': {'givenName': 'Kyle', 'familyName': 'B'},
+         'tags': ['a\\b', 'c\nd', u'\u2603']},
+      ],
+    }
+
+  def test_backends_agree(self):
+    backends = codec.find_backends()
+    self.assertEqual('bundled', backends[-1][0])
+    self.assertEqual(codec.BACKEND, backends[0][0])
+    expected = simplejson.dumps(self.value, sort_keys=True)
+    for name, module in backends:
+      encoder_options = codec.ENCODER_OPTIONS.get(name, {})
+      decoder_options = codec.DECODER_OPTIONS.get(name, {})
+      encoded = module.dumps(self.value, sort_keys=True, **encoder_options)
+      self.assertEqual(expected, encoded, name)
+      self.assertEqual(self.value, module.loads(encoded, **decoder_options),
+                       name)
+      for value in ('caf\xc3\xa9', 'caf\xe9', {'caf\xc3\xa9': ['\x01']}):
+        self.assertEqual(simplejson.dumps(value),
+                         module.dumps(value, **encoder_options), name)
+      for s in ('"a\x01b\tc\nd"', '"caf\xc3\xa9"'):
+        self.assertEqual(simplejson.loads(s),
+                         module.loads(s, **decoder_options), name)
+
+  def test_loads_dumps(self):
+    encoded = codec.dumps(self.value)
+    self.assertTrue(isinstance(encoded, str))
+    self.assertEqual(self.value, codec.loads(encoded))
+    self.assertEqual(u'a\x01b', codec.loads('"a\x01b"'))
+    self.assertEqual('"caf\\u00c3\\u00a9"', codec.dumps('caf\xc3\xa9'))
+    self.assertEqual(codec.dumps(['caf\xe9']), codec.encode_body(['caf\xe9']))
+    self.assertEqual('{"a": 1, "b": [true, null]}',
+                     codec.dumps({'b': [True, None], 'a': 1}, sort_keys=True))
+
+
+class TestFastDecoder(unittest.TestCase):
+
+  def setUp(self):
+    self.decoder = simplejson.JSONDecoder()
+    # Decoding with another context object goes through the Scanner.
+    self.context = simplejson.JSONDecoder()
+
+  def assertSameDecoding(self, s):
+    def decode(**kw):
+      try:
+        return self.decoder.raw_decode(s, **kw)
+      except ValueError, e:
+        return str(e)
+    self.assertEqual(decode(context=self.context), decode())
+
+  def test_same_values(self):
+    for s in ('{"entry": [{"id": "1", "name": {"givenName": "A"}}]}',
+              '[1, -2.5, 1e10, 12345678901234567890, true, false, null]',
+              '{ "a" :\t[ "b\\"c\\u2603", {} , [ ] ] }',
+              '"\\u00e9\\n"', '[NaN, Infinity, -Infinity]',
+              '{"a": "\xc3\xa9"}', u'{"a": "\u2603"}'):
+      self.assertSameDecoding(s)
+
+  def test_same_errors(self):
+    for s in ('{"a": [1, 2}', '{"a" 1}', '{"a": }', '[1 2]', '{a: 1}',
+              '"abc', '["a\\x"]', '', ' 1', '{"a": 1,}'):
+      self.assertSameDecoding(s)
+
+  def test_object_hook(self):
+    decoder = simplejson.JSONDecoder(object_hook=lambda d: len(d))
+    self.assertEqual([2, 0], decoder.decode('[{"a": 1, "b": 2}, {}]'))
+
+
+class TestFastEncoder(unittest.TestCase):
+
+  def test_same_output(self):
+    from opensocial.simplejson.encoder import encode_fast
+    batch = RequestBatch()
+    batch.add_request('me', request.FetchPersonRequest('@me'))
+    batch.add_request('data', request.UpdateAppDataRequest(
+        '@me', '@self', data={'score': 1.5, 'name': u'St\xe9phane "S"'}))
+    rpcs = [rpc.get_rpc_body() for rpc in batch.requests.values()]
+    values = (rpcs, [], {}, (1, 2L), {1: None, 2.5: True, None: False},
+              ['\n\t\\', float('inf')])
+    for value in values:
+      self.assertEqual(simplejson.dumps(value), encode_fast(value))
+      self.assertEqual(simplejson.dumps(value), codec.encode_body(value))
+    self.assertRaises(TypeError, encode_fast, [object()])
+    self.assertRaises(TypeError, encode_fast, {(1, 2): 3})
+
+
+class TestStreamedRequestBodies(unittest.TestCase):
+
+  def test_config_streams_bodies(self):
+    config = ContainerConfig(oauth_consumer_key='key',
+                             oauth_consumer_secret='secret',
+                             server_rpc_base='http://www.foo.com/rpc',
+                             stream_request_bodies=True)
+    urlfetch = RpcEchoUrlFetch()
+    container = ContainerContext(config, urlfetch)
+    person = container.fetch_person('101')
+    self.assertEqual('101', person.get_id())
+    request = urlfetch.requests[0]
+    self.assertTrue(request.stream_body)
+    body = ''.join(request.iter_post_body())
+    self.assertEqual(b64encode(hashlib.sha1(body).digest()),
+                     request.get_parameter('oauth_body_hash'))
+
+
+class TestHmacSigning(unittest.TestCase):
+
+  def test_keyed_state_is_reused(self):
+    import hmac
+    method = oauth.OAuthSignatureMethod_HMAC_SHA1()
+    request = oauth.OAuthRequest.from_request(
+        'GET', 'http://www.foo.com/rest/people/@me/@self',
+        parameters={'opensocial_method': 'GET', 'oauth_nonce': '1'})
+    token = oauth.OAuthToken('token', 'token&secret')
+    for consumer, token in ((oauth.OAuthConsumer('a', 'secret'), None),
+                            (oauth.OAuthConsumer('b', 'other'), token),
+                            (oauth.OAuthConsumer('a', 'secret'), None)):
+      key, raw = method.build_signature_base_string(request, consumer, token)
+      expected = b64encode(hmac.new(key, raw, hashlib.sha1).digest())
+      self.assertEqual(expected,
+                       method.build_signature(request, consumer, token))
+      self.assertEqual(expected,
+                       method.build_signature(request, consumer, token))
+    self.assertEqual(2, len(method._keyed))
+
+
+class TestParameterNormalization(unittest.TestCase):
+
+  def setUp(self):
+    self.params = {
+      'opensocial_method': 'GET',
+      'oauth_consumer_key': 'example.com:consumer',
+      'oauth_nonce': '12345678',
+      'oauth_timestamp': 1234567890,
+      'oauth_signature': 'abc/def=',
+      'st': 'a b&c',
+    }
+    self.request = oauth.OAuthRequest.from_request(
+        'GET', 'http://www.foo.com/rest/people/@me/@self',
+        parameters=dict(self.params))
+
+  def expected(self, params):
+    return '&'.join('%s=%s' % (urllib.quote(str(k), safe='~'),
+                               urllib.quote(str(v), safe='~'))
+                    for k, v in sorted(params.items()))
+
+  def test_signature_is_excluded_without_mutation(self):
+    params = dict(self.params)
+    del params['oauth_signature']
+    self.assertEqual(self.expected(params),
+                     self.request.get_normalized_parameters())
+    self.assertEqual('abc/def=',
+                     self.request.get_parameter('oauth_signature'))
+    self.assertEqual(self.expected(self.params), self.request.to_postdata())
+
+  def test_changed_values_are_escaped_again(self):
+    self.request.get_normalized_parameters()
+    self.request.set_parameter('st', 'd/e')
+    self.request.set_parameter('oauth_timestamp', '1234567890')
+    self.request.set_parameter('xoauth_requestor_id', None)
+    self.params.update({'st': 'd/e', 'xoauth_requestor_id': None})
+    self.assertEqual(self.expected(self.params), self.request.to_postdata())
+
+  def test_escape_is_memoized(self):
+    self.assertEqual('a%20b%2Fc~', oauth.escape('a b/c~'))
+    self.assertEqual('a%20b%2Fc~', oauth.escape('a b/c~'))
+    self.assertEqual('a%20b%2Fc~', oauth._escaped[(str, 'a b/c~')])
+    long_value = 'x' * (oauth.ESCAPE_CACHE_LENGTH + 1)
+    self.assertEqual(long_value, oauth.escape(long_value))
+    self.assertFalse((str, long_value) in oauth._escaped)
+    self.assertTrue(isinstance(oauth.escape(u'memo-type'), unicode))
+    self.assertTrue(isinstance(oauth.escape('memo-type'), str))